@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Benchmark of the decoding strategies of image_access.py on a large jpg image: full
+# decode (PIL and OpenCV), DCT-reduced decode (1/2, 1/4, 1/8), and region-limited decode
+# (lines in the top quarter of the image, its best case, or over the whole image).
+# Each case runs in a new process, which reports its time and its peak memory (RSS) over
+# the interpreter's baseline. Throughput is given in MB/s of the jpg file.
+#   Without an input image, a synthetic one of the given megapixels is generated.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, resource, subprocess, sys, tempfile, time
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" ) )
+import numpy as np
+from PIL import Image
+import cv2 as cv
+import image_access
+
+CASES = [ "pil_full", "cv_full", "reduced_2", "reduced_4", "reduced_8", "cv_reduced_4", "regions_top25", "regions_top25_gray", "regions_spread" ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def run_case( case, path_filename ):
+	""" Decodes the image with the strategy of the case (in the current process) and returns the decoded array.
+	"""
+	if case == "pil_full":
+		return np.asarray( Image.open( path_filename ) )
+	if case == "cv_full":
+		return cv.imread( path_filename, cv.IMREAD_UNCHANGED )
+	if case == "cv_reduced_4":
+		return cv.imread( path_filename, cv.IMREAD_REDUCED_COLOR_4 )
+	if case.startswith( "reduced_" ):
+		return image_access.read_reduced( path_filename, 1.0 / int(case.split('_')[1]) )[0]
+	# Some lines in the upper quarter of the image (e.g. the labels of a drawer scan: the best case), or over the whole
+	# image (as a herbarium sheet with a label at the bottom: all the rows are decoded)
+	width, height = image_access.image_size( path_filename )
+	bottom = height // 4 if case.startswith( "regions_top25" ) else height
+	boxes = [ [ width // 10, y, width // 2, y + 60 ] for y in range( 50, bottom - 60, 200 ) ]
+	return image_access.read_regions( path_filename, boxes, 'L' if case.endswith( "_gray" ) else None )[0]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def peak_rss():
+	""" Peak resident memory (KB) of this process. ru_maxrss is inherited through fork/exec, so VmHWM is used when available.
+	"""
+	if os.path.isfile( "/proc/self/status" ):
+		with open( "/proc/self/status" ) as f:
+			for line in f:
+				if line.startswith( "VmHWM:" ):
+					return int( line.split()[1] )
+	return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def child( case, path_filename ):
+	""" Runs one case and prints: seconds, peak RSS increase (KB), and shape of the result.
+	"""
+	rss_before = peak_rss()
+	start = time.time()
+	array = run_case( case, path_filename )
+	elapsed = time.time() - start
+	rss_after = peak_rss()
+	shape = "x".join( str(d) for d in array.shape ) if not isinstance( array, list ) else str(len(array)) + " crops"
+	print( str(elapsed) + "\t" + str(rss_after - rss_before) + "\t" + shape )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_image( megapixels, path_filename ):
+	""" Saves a jpg image with some texture (blocks plus noise), of about the given megapixels.
+	"""
+	width = int( (megapixels * 1e6 * 4 / 3) ** 0.5 )
+	height = int( width * 3 / 4 )
+	rng = np.random.RandomState( 0 )
+	blocks = rng.randint( 0, 255, (height // 32 + 1, width // 32 + 1, 3) ).astype( np.uint8 )
+	image = np.repeat( np.repeat( blocks, 32, axis=0 ), 32, axis=1 )[:height, :width]
+	image = cv.add( image, rng.randint( 0, 30, image.shape ).astype( np.uint8 ) )
+	cv.imwrite( path_filename, image, [int(cv.IMWRITE_JPEG_QUALITY), 90] )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Benchmark of the reduced-resolution and region-limited jpg decoding.
+	"""
+	parser = argparse.ArgumentParser("Benchmark of the reduced-resolution and region-limited jpg decoding.")
+	parser.add_argument('-i', '--image', action="store", default="", help="Path + Filename of the jpg image (default: a synthetic image).")
+	parser.add_argument('-mp', '--megapixels', action="store", type=float, default=100.0, help="Megapixels of the synthetic image.")
+	parser.add_argument('-r', '--repeats', action="store", type=int, default=3, help="Repetitions of each case (the best time is reported).")
+	parser.add_argument('--child', action="store", nargs=2, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child is not None:
+		child( args.child[0], args.child[1] )
+		sys.exit(0)
+
+	path_filename = args.image
+	tmp_dir = None
+	if path_filename == "":
+		tmp_dir = tempfile.mkdtemp()
+		path_filename = tmp_dir + "/synthetic.jpg"
+		synthetic_image( args.megapixels, path_filename )
+	elif not os.path.isfile( path_filename ):
+		print('Error: The image (' + path_filename + ') was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	mb = os.stat( path_filename ).st_size / 1e6
+	width, height = image_access.image_size( path_filename )
+	print("Image: " + str(width) + "x" + str(height) + ", " + ("%.1f" % mb) + " MB")
+	print("%-20s %10s %10s %14s   %s" % ("case", "seconds", "MB/s", "peak RSS (MB)", "decoded"))
+	for case in CASES:
+		best_time, best_rss, shape = None, None, ""
+		for r in range( args.repeats ):
+			output = subprocess.check_output( [ sys.executable, os.path.abspath(__file__), "--child", case, path_filename ] ).decode()
+			elapsed, rss, shape = output.strip().split('\t')
+			best_time = float(elapsed) if best_time is None else min( best_time, float(elapsed) )
+			best_rss = int(rss) if best_rss is None else min( best_rss, int(rss) )
+		print("%-20s %10.3f %10.1f %14.1f   %s" % (case, best_time, mb / best_time, best_rss / 1024.0, shape))
+
+	if tmp_dir is not None:
+		os.remove( path_filename )
+		os.rmdir( tmp_dir )
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Benchmark of the batched OCRopus recognition (ocropus_batch.py) on the CPU. A network
+# with the shape of the OCRopus models (48 pixels high lines, a bidirectional LSTM, and a
+# softmax over the characters) is built with random weights, and a set of prepared lines of
+# random widths is recognized one by one (matrix-vector products per timestep, as ocrolib)
+# and in width buckets of several batch sizes. It reports lines/sec per batch size, the
+# padding overhead, and the maximum difference of the outputs with the one-by-one pass.
+#   The number of BLAS threads can be set with OMP_NUM_THREADS / OPENBLAS_NUM_THREADS (the
+# *_mt.py scripts run one process per core).
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, sys, time
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" ) )
+import numpy as np
+import ocropus_batch
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def random_weights( ni, ns, no, rng ):
+	""" Random weights of a bidirectional LSTM (ni inputs, ns hidden units per direction) plus a softmax of no classes.
+	"""
+	def lstm():
+		return ( rng.randn( 4 * ns, 1 + ni + ns ) * 0.1, ( rng.randn(ns) * 0.1, rng.randn(ns) * 0.1, rng.randn(ns) * 0.1 ) )
+	return { 'forward': lstm(), 'backward': lstm(), 'softmax': rng.randn( no, 1 + 2 * ns ) * 0.1 }
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Benchmark of the batched OCRopus recognition.
+	"""
+	parser = argparse.ArgumentParser("Benchmark of the batched OCRopus recognition.")
+	parser.add_argument('-n', '--n_lines', action="store", type=int, default=64, help="Number of lines.")
+	parser.add_argument('-minw', '--min_width', action="store", type=int, default=150, help="Minimum width (timesteps) of the lines.")
+	parser.add_argument('-maxw', '--max_width', action="store", type=int, default=1200, help="Maximum width (timesteps) of the lines.")
+	parser.add_argument('-ni', '--inputs', action="store", type=int, default=48, help="Height of the normalized lines (inputs of the LSTM).")
+	parser.add_argument('-ns', '--hidden', action="store", type=int, default=100, help="Hidden units of each LSTM direction.")
+	parser.add_argument('-no', '--classes', action="store", type=int, default=100, help="Number of classes (characters plus blank).")
+	parser.add_argument('-bs', '--batch_sizes', action="store", default="1,2,4,8,16,32,64", help="Batch sizes (comma separated).")
+	args = parser.parse_args()
+
+	rng = np.random.RandomState( 0 )
+	weights = random_weights( args.inputs, args.hidden, args.classes, rng )
+	lines = [ rng.rand( rng.randint( args.min_width, args.max_width + 1 ), args.inputs ) for i in range( args.n_lines ) ]
+	timesteps = sum( len(xs) for xs in lines )
+	print("Lines: " + str(len(lines)) + ", timesteps: " + str(timesteps) + ", network: " + str(args.inputs) + "x" + str(args.hidden) + "x2 -> " + str(args.classes) + ", CPUs: " + str(os.cpu_count()))
+
+	start = time.time()
+	reference = [ ocropus_batch.forward_line( weights, xs ) for xs in lines ]
+	elapsed = time.time() - start
+	print("%-12s %10s %10s %10s %12s" % ("batch size", "seconds", "lines/s", "padding", "max diff"))
+	print("%-12s %10.3f %10.1f %10s %12s" % ("one by one", elapsed, len(lines) / elapsed, "-", "-"))
+
+	for batch_size in [ int(b) for b in args.batch_sizes.split(',') ]:
+		padded = 0
+		for batch in ocropus_batch.buckets( [ len(xs) for xs in lines ], batch_size ):
+			padded = padded + len(batch) * max( len(lines[i]) for i in batch )
+		start = time.time()
+		outputs = ocropus_batch.forward_lines( weights, lines, batch_size )
+		elapsed = time.time() - start
+		diff = max( np.abs( ys - ref ).max() for ys, ref in zip( outputs, reference ) )
+		print("%-12d %10.3f %10.1f %9.1f%% %12.2e" % (batch_size, elapsed, len(lines) / elapsed, 100.0 * (padded - timesteps) / timesteps, diff))
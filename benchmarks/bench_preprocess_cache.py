@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Benchmark of the shared preprocessing of the cropped lines (preprocess_cache.py). It
+# measures, in one process, the input stage of the two engines for each line:
+#   - separate: OCRopus decodes and binarizes the crop (ocropus_nlbin.py), and Tesseract
+#     decodes it again (and thresholds it internally).
+#   - shared, cold cache: the crop is decoded and preprocessed once, its variants stored,
+#     and the second engine takes its variant from the cache.
+#   - shared, warm cache: both engines take their variant from the cache (a run after
+#     preprocess_cache.py, or a rerun of the engines).
+#   It reports ms/line of both engines together and the time saved per line. The crops are
+# synthetic unless a folder of jpg lines is given.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, io, os, shutil, sys, tempfile, time
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" ) )
+import numpy as np
+from PIL import Image
+import cv2 as cv
+import job_scheduler, ocropus_nlbin, preprocess_cache
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_lines( n_lines ):
+	""" Returns the jpg encodings of n_lines synthetic crops of text lines.
+	"""
+	rng = np.random.RandomState( 0 )
+	lines = []
+	for i in range( n_lines ):
+		width = rng.randint( 400, 1600 )
+		image = np.full( (70, width, 3), 225, dtype=np.uint8 )
+		image = cv.add( image, rng.randint( 0, 20, image.shape ).astype( np.uint8 ) )
+		cv.putText( image, "Collected " + str(rng.randint(1900, 2000)) + " Gainesville, Florida", (10, 50), cv.FONT_HERSHEY_SIMPLEX, 1.4, (20, 20, 20), 3 )
+		lines.append( cv.imencode( '.jpg', image, [int(cv.IMWRITE_JPEG_QUALITY), 90] )[1].tobytes() )
+	return lines
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def separate( content ):
+	""" Input stage of both engines without the shared preprocessing.
+	"""
+	ocropus_nlbin.binarize( ocropus_nlbin.read_image_gray( content ) )
+	np.asarray( Image.open( io.BytesIO( content ) ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def shared( content, cache_dir ):
+	""" Input stage of both engines with the shared preprocessing: OCRopus takes the binarized variant and Tesseract the grayscale one.
+	"""
+	preprocess_cache.get_variants( content, cache_dir ).get( 'bin' )
+	preprocess_cache.get_variants( content, cache_dir )['gray'].tobytes()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Benchmark of the shared preprocessing of the cropped lines.
+	"""
+	parser = argparse.ArgumentParser("Benchmark of the shared preprocessing of the cropped lines.")
+	parser.add_argument('-if', '--input_folder', action="store", default="", help="Folder of jpg lines (default: synthetic lines).")
+	parser.add_argument('-n', '--n_lines', action="store", type=int, default=100, help="Number of synthetic lines.")
+	args = parser.parse_args()
+
+	if args.input_folder != "":
+		lines = []
+		for filename in job_scheduler.walk_files( args.input_folder, '.jpg' ):
+			with open( args.input_folder + "/" + filename, 'rb' ) as f:
+				lines.append( f.read() )
+	else:
+		lines = synthetic_lines( args.n_lines )
+	if len(lines) == 0:
+		print('Error: No jpg lines were found.\n')
+		parser.print_help()
+		sys.exit(1)
+	print("Lines: " + str(len(lines)))
+
+	start = time.time()
+	for content in lines:
+		separate( content )
+	separate_time = time.time() - start
+
+	cache_dir = tempfile.mkdtemp()
+	start = time.time()
+	for content in lines:
+		shared( content, cache_dir )
+	cold_time = time.time() - start
+
+	start = time.time()
+	for content in lines:
+		shared( content, cache_dir )
+	warm_time = time.time() - start
+	cache_bytes = sum( os.path.getsize( os.path.join( d, f ) ) for d, subdirs, files in os.walk( cache_dir ) for f in files )
+	shutil.rmtree( cache_dir )
+
+	print("%-24s %12s %16s" % ("input of both engines", "ms/line", "saved ms/line"))
+	print("%-24s %12.2f %16s" % ("separate", 1000.0 * separate_time / len(lines), "-"))
+	print("%-24s %12.2f %16.2f" % ("shared, cold cache", 1000.0 * cold_time / len(lines), 1000.0 * (separate_time - cold_time) / len(lines)))
+	print("%-24s %12.2f %16.2f" % ("shared, warm cache", 1000.0 * warm_time / len(lines), 1000.0 * (separate_time - warm_time) / len(lines)))
+	print("Cache: " + str(cache_bytes // 1024) + " KB (" + str(cache_bytes // len(lines)) + " bytes/line)")
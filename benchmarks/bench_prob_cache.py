@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Benchmark of the columnar cache of the probabilities files (prob_cache.py) with the
+# voting scripts. Three synthetic engine directories of -n lines (text .prob files, with
+# -b binary ones, see prob_io.py) are created, and getLinesAccepted.py and
+# getLinesRejected.py are run:
+#   - files: reading every probabilities file (before).
+#   - cold: with -pc, building the caches (one-time ingest).
+#   - warm: with -pc, loading the memory-mapped caches.
+#   - touched: with -pc, after one file of each directory is modified (rebuilt caches).
+#   The outputs of all the runs must be the same.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, shutil, subprocess, sys, tempfile, time
+SRC_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" )
+sys.path.insert( 0, SRC_DIR )
+import numpy as np
+import prob_io
+
+ENGINES = [ "ocropus", "tesseract", "google" ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_dirs( tmp_dir, n_lines, binary ):
+	""" Creates the images folder and the three engine folders: each engine reads the same text of a line, with a few
+	differences, and a few lines are missing in each engine. Returns the list of folders.
+	"""
+	rng = np.random.RandomState( 0 )
+	alphabet = list( "abcdefghijklmnopqrstuvwxyz0123456789.,-" )
+	dirs = [ tmp_dir + "/" + name for name in [ "images" ] + ENGINES ]
+	for d in dirs:
+		os.makedirs( d )
+	for i in range( n_lines ):
+		basename = "specimen_" + ( "%05d" % (i // 20) ) + "_" + ( "%03d" % (i % 20) )
+		open( dirs[0] + "/" + basename + ".jpg", 'w' ).close()
+		words = [ ''.join( rng.choice( alphabet, rng.randint( 2, 9 ) ) ) for w in range( rng.randint( 1, 6 ) ) ]
+		text = " ".join( words )
+		for d in dirs[1:]:
+			if rng.rand() < 0.05:
+				continue
+			symbols = list( text )
+			if rng.rand() < 0.2:
+				symbols[ rng.randint( len(symbols) ) ] = "x"
+			probs = [ 0.95 if s == " " else float( rng.uniform( 0.6, 1.0 ) ) for s in symbols ]
+			with open( d + "/" + basename + ".prob", 'wb' ) as f:
+				f.write( prob_io.encode( symbols, probs, binary ) )
+	return dirs
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def run( script, dirs, output, cache_dir ):
+	""" Runs a voting script over the folders. Returns the seconds it took.
+	"""
+	arguments = [ "-i1", dirs[1], "-i2", dirs[2], "-i3", dirs[3], "-o", output ]
+	if script == "getLinesRejected":
+		arguments = [ "-i0", dirs[0] ] + arguments
+	if cache_dir != "":
+		arguments = arguments + [ "-pc", cache_dir ]
+	start = time.time()
+	subprocess.check_call( [ sys.executable, SRC_DIR + "/" + script + ".py" ] + arguments, stdout=subprocess.DEVNULL )
+	return time.time() - start
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Benchmark of the columnar cache of the probabilities files.
+	"""
+	parser = argparse.ArgumentParser("Benchmark of the columnar cache of the probabilities files with the voting scripts.")
+	parser.add_argument('-n', '--n_lines', action="store", type=int, default=20000, help="Number of lines.")
+	parser.add_argument('-b', '--binary', action="store_true", help="Write the probabilities files in the binary format.")
+	args = parser.parse_args()
+
+	tmp_dir = tempfile.mkdtemp()
+	dirs = synthetic_dirs( tmp_dir, args.n_lines, args.binary )
+	cache_dir = tmp_dir + "/cache"
+	print("Lines: " + str(args.n_lines) + ", probabilities files: " + str( sum( len(os.listdir(d)) for d in dirs[1:] ) ) + " (" + ( "binary" if args.binary else "text" ) + ")")
+
+	print("%-18s %10s %10s %10s %10s" % ("script", "files (s)", "cold (s)", "warm (s)", "touched (s)"))
+	for script in [ "getLinesAccepted", "getLinesRejected" ]:
+		shutil.rmtree( cache_dir, ignore_errors=True )
+		times = [ run( script, dirs, tmp_dir + "/files.txt", "" ), run( script, dirs, tmp_dir + "/cold.txt", cache_dir ), run( script, dirs, tmp_dir + "/warm.txt", cache_dir ) ]
+		# Modify one file of each folder: its cache is built again
+		for d in dirs[1:]:
+			filename = d + "/" + sorted( os.listdir( d ) )[0]
+			st = os.stat( filename )
+			os.utime( filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000) )
+		times.append( run( script, dirs, tmp_dir + "/touched.txt", cache_dir ) )
+		print("%-18s %10.2f %10.2f %10.2f %10.2f" % tuple( [ script ] + times ))
+
+		outputs = [ open( tmp_dir + "/" + name + ".txt" ).read() for name in [ "files", "cold", "warm", "touched" ] ]
+		assert all( o == outputs[0] for o in outputs ), "Different outputs"
+	print("Caches: " + str( len( os.listdir( cache_dir ) ) ) + " folders, " + ( "%.1f" % ( sum( os.path.getsize( os.path.join(r, f) ) for r, ds, fs in os.walk( cache_dir ) for f in fs ) / 1e6 ) ) + " MB")
+
+	shutil.rmtree( tmp_dir )
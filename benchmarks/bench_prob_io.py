@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Parsing benchmark of the probabilities files (.prob) on a synthetic collection of 1M
+# symbol lines (-n), split in files of about 40 symbols, computing the text, the number of
+# symbols, and the average probability of each file (getLinesAccepted.getConfidence):
+#   - loop: the per-line loop with a float() per line of the scripts (before).
+#   - text: prob_io.parse_text + prob_io.confidence on the same text files.
+#   - binary: prob_io.parse_binary (numpy.frombuffer) + prob_io.confidence on the binary files.
+#   The contents are parsed from memory (only the parsing is measured) and, with -d, also
+# read from the files of a directory.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, shutil, sys, tempfile, time
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" ) )
+import numpy as np
+import line_container, prob_io
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_files( n_lines, symbols_per_file ):
+	""" Contents (text format) of probabilities files with n_lines symbol lines in total.
+	"""
+	rng = np.random.RandomState( 0 )
+	alphabet = list( "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,;:-() " )
+	contents = []
+	n = 0
+	while n < n_lines:
+		size = min( n_lines - n, rng.randint( symbols_per_file // 2, symbols_per_file * 3 // 2 + 1 ) )
+		symbols = rng.choice( alphabet, size )
+		probs = rng.uniform( 0.3, 1.0, size )
+		contents.append( ''.join( s + "\t" + str(p) + "\n" for s, p in zip( symbols, probs ) ).encode('utf-8') )
+		n = n + size
+	return contents
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def loop_confidence( lines ):
+	""" Text, number of symbols, and average probability of the lines of a text file, with the per-line loop of the scripts.
+	"""
+	sum = 0.0
+	n = 0
+	text = ""
+	for line in lines:
+		words = line.split('\t')
+		if words[0] != ' ':
+			text = text + words[0]
+			if ( len(words) > 1 ):
+				sum = sum + float(words[1])
+				n = n + 1
+	if n == 0:
+		return "", 0, 0.0
+	return text, n, sum/n
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def io_confidence( codes, probs ):
+	""" Text, number of symbols, and average probability with prob_io.
+	"""
+	text, text_s, n, mean = prob_io.confidence( codes, probs )
+	return text, n, mean
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def report( name, seconds, n_lines, n_bytes, base ):
+	print("%-10s %10.3f %14.0f %12.1f %9.1fx" % (name, seconds, n_lines / seconds, n_bytes / 1e6, base / seconds))
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Parsing benchmark of the text and binary probabilities files.
+	"""
+	parser = argparse.ArgumentParser("Parsing benchmark of the text and binary probabilities files.")
+	parser.add_argument('-n', '--n_lines', action="store", type=int, default=1000000, help="Number of symbol lines of the collection.")
+	parser.add_argument('-s', '--symbols', action="store", type=int, default=40, help="Average number of symbols per file.")
+	parser.add_argument('-d', '--disk', action="store_true", help="Also read the files from a directory.")
+	args = parser.parse_args()
+
+	texts = synthetic_files( args.n_lines, args.symbols )
+	binaries = [ prob_io.convert( c, True ) for c in texts ]
+	print("Files: " + str(len(texts)) + ", symbol lines: " + str(args.n_lines))
+
+	# Same results in the three parsers (the text files exactly, the binary ones with float32 probabilities)
+	for t, b in zip( texts[:200], binaries[:200] ):
+		r_loop = loop_confidence( [ line.rstrip() for line in t.decode('utf-8').split('\n') ] )
+		r_text = io_confidence( *prob_io.decode( t ) )
+		r_bin = io_confidence( *prob_io.decode( b ) )
+		assert r_loop == r_text and r_loop[:2] == r_bin[:2] and abs( r_loop[2] - r_bin[2] ) < 1e-6
+
+	print("%-10s %10s %14s %12s %10s" % ("parser", "seconds", "lines/s", "size (MB)", "speedup"))
+	start = time.time()
+	for t in texts:
+		loop_confidence( [ line.rstrip() for line in t.decode('utf-8').split('\n') ] )
+	base = time.time() - start
+	report( "loop", base, args.n_lines, sum( len(t) for t in texts ), base )
+	start = time.time()
+	for t in texts:
+		io_confidence( *prob_io.parse_text( t ) )
+	report( "text", time.time() - start, args.n_lines, sum( len(t) for t in texts ), base )
+	start = time.time()
+	for b in binaries:
+		io_confidence( *prob_io.parse_binary( b ) )
+	report( "binary", time.time() - start, args.n_lines, sum( len(b) for b in binaries ), base )
+
+	if args.disk:
+		# The same files read from a directory (open_text + loop as getConfidence, and prob_io.read_prob)
+		tmp_dir = tempfile.mkdtemp()
+		for name, contents in [ ("text", texts), ("binary", binaries) ]:
+			os.makedirs( tmp_dir + "/" + name )
+			line_container.write_files( tmp_dir + "/" + name, [ ( "line_" + ("%07d" % i) + ".prob", c ) for i, c in enumerate( contents ) ] )
+		filenames = sorted( os.listdir( tmp_dir + "/text" ) )
+		start = time.time()
+		for f in filenames:
+			with line_container.open_text( tmp_dir + "/text", f ) as f_prob:
+				loop_confidence( [ line.rstrip() for line in f_prob ] )
+		base = time.time() - start
+		report( "loop/disk", base, args.n_lines, sum( len(t) for t in texts ), base )
+		for name in [ "text", "binary" ]:
+			start = time.time()
+			for f in filenames:
+				io_confidence( *prob_io.read_prob( tmp_dir + "/" + name, f ) )
+			report( name + "/disk", time.time() - start, args.n_lines, sum( len(t) for t in ( texts if name == "text" else binaries ) ), base )
+		shutil.rmtree( tmp_dir )
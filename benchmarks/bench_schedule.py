@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Makespan benchmark of the order in which the OCR pools receive the lines, on a skewed
+# collection (most lines narrow, a few very wide ones at the end of the folder walk):
+#   - walk: the lines in the order of the folders, in chunks of chunk_size (before).
+#   - cost: the lines in decreasing order of width x height, read from their headers, in
+#     chunks of decreasing size (job_scheduler.cost_chunks).
+#   The binarization time of every line (binarizeDir_mt.py) is measured once, and the
+# makespan of both orders is simulated for several numbers of workers (each free worker
+# takes the next chunk), against the lower bound max(total / workers, longest line). Both
+# orders are also run with job_scheduler.run_tasks and -j workers in this host.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, heapq, multiprocessing, os, shutil, sys, tempfile, time
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" ) )
+import numpy as np
+import cv2 as cv
+import binarizeDir_mt, image_access, job_scheduler, line_container, ocropus_nlbin
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def skewed_lines( dir_name, n_lines, wide_fraction ):
+	""" Saves n_lines synthetic jpg lines: most of them 300 to 700 pixels wide, and wide_fraction of them 3000 to 6000 pixels
+	wide, in a subfolder which the folder walk lists last.
+	"""
+	rng = np.random.RandomState( 0 )
+	os.makedirs( dir_name + "/z_wide" )
+	n_wide = int( round( n_lines * wide_fraction ) )
+	for i in range( n_lines ):
+		wide = i >= n_lines - n_wide
+		width = rng.randint( 3000, 6001 ) if wide else rng.randint( 300, 701 )
+		image = np.full( (64, width, 3), 225, dtype=np.uint8 )
+		image = cv.add( image, rng.randint( 0, 20, image.shape ).astype( np.uint8 ) )
+		for x in range( 10, width - 200, 420 ):
+			cv.putText( image, "Gainesville, Fl.", (x, 46), cv.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 3 )
+		filename = ( "z_wide/" if wide else "" ) + "line_" + ( "%05d" % i ) + ".jpg"
+		cv.imwrite( dir_name + "/" + filename, image, [int(cv.IMWRITE_JPEG_QUALITY), 95] )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def makespan( chunks, seconds, n_workers ):
+	""" Simulated makespan of the chunks (lists of lines) when each free worker takes the next chunk.
+	"""
+	workers = [ 0.0 ] * n_workers
+	for chunk in chunks:
+		start = heapq.heappop( workers )
+		heapq.heappush( workers, start + sum( seconds[f] for f in chunk ) )
+	return max( workers )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def walk_chunks( files, chunk_size ):
+	""" Chunks of the lines in the order of the folder walk.
+	"""
+	return [ files[i:i + chunk_size] for i in range( 0, len(files), chunk_size ) ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Makespan benchmark of the order of the lines.
+	"""
+	parser = argparse.ArgumentParser("Makespan benchmark of the walk and longest-job-first orders of the lines.")
+	parser.add_argument('-if', '--input_folder', action="store", default="", help="Folder of jpg lines (default: a synthetic skewed collection).")
+	parser.add_argument('-n', '--n_lines', action="store", type=int, default=300, help="Number of synthetic lines.")
+	parser.add_argument('-wf', '--wide_fraction', action="store", type=float, default=0.05, help="Fraction of very wide synthetic lines.")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=16, help="Chunk size (maximum chunk size of the cost order).")
+	parser.add_argument('-w', '--workers', action="store", default="4,8,16,32", help="Numbers of workers of the simulation (comma separated).")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=multiprocessing.cpu_count(), help="Number of workers of the real runs.")
+	args = parser.parse_args()
+
+	tmp_dir = tempfile.mkdtemp()
+	input_dir = args.input_folder
+	if input_dir == "":
+		input_dir = tmp_dir + "/lines"
+		skewed_lines( input_dir, args.n_lines, args.wide_fraction )
+	files = job_scheduler.walk_files( input_dir, '.jpg' )
+
+	# Cost estimated from the headers, and binarization time of each line
+	start = time.time()
+	costs = [ image_access.line_cost( input_dir, f ) for f in files ]
+	header_time = time.time() - start
+	seconds = {}
+	for f in files:
+		start = time.time()
+		ocropus_nlbin.binarize_content( line_container.read_bytes( input_dir, f ) )
+		seconds[ f ] = time.time() - start
+	total = sum( seconds.values() )
+	correlation = np.corrcoef( costs, [ seconds[f] for f in files ] )[0, 1]
+	print("Lines: " + str(len(files)) + ", binarization: " + ( "%.2f" % total ) + " s, longest line: " + ( "%.2f" % max( seconds.values() ) ) + " s, headers read in " + ( "%.3f" % header_time ) + " s, correlation cost/time: " + ( "%.3f" % correlation ))
+
+	print("%-10s %14s %14s %14s %12s" % ("workers", "walk (s)", "cost (s)", "lower bound", "reduction"))
+	for n_workers in [ int(w) for w in args.workers.split(',') ]:
+		walk = makespan( walk_chunks( files, args.chunk_size ), seconds, n_workers )
+		cost = makespan( job_scheduler.cost_chunks( files, costs, n_workers, args.chunk_size ), seconds, n_workers )
+		bound = max( total / n_workers, max( seconds.values() ) )
+		print("%-10d %14.2f %14.2f %14.2f %11.1f%%" % (n_workers, walk, cost, bound, 100.0 * (walk - cost) / walk))
+
+	# Real runs in this host
+	output_dir = tmp_dir + "/bin"
+	for sub_dir in set( os.path.dirname(f) for f in files ):
+		os.makedirs( output_dir + "/" + sub_dir, exist_ok=True )
+	for name, chunks in [ ("walk", walk_chunks( files, args.chunk_size )), ("cost", job_scheduler.cost_chunks( files, costs, args.jobs, args.chunk_size )) ]:
+		start = time.time()
+		for chunk, results, error in job_scheduler.run_tasks( binarizeDir_mt.binarize_lines, chunks, args.jobs, 0, 0, binarizeDir_mt.init_worker, (input_dir, output_dir, False) ):
+			pass
+		print("Run with " + str(args.jobs) + " workers, " + name + " order: " + ( "%.2f" % (time.time() - start) ) + " s (" + str(len(chunks)) + " chunks)")
+
+	shutil.rmtree( tmp_dir )
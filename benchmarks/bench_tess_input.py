@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Benchmark of the two ways of giving the cropped lines to the Tesseract workers of
+# tessDir_mt.py:
+#   - files: the lines are saved as jpg files (crop_save), and each worker reads and decodes
+#     its line files.
+#   - shared memory: the main process decodes each specimen once and copies the crops of
+#     its lines to a shared memory segment (image_access.share_regions), and the workers
+#     copy the raw pixels of each crop from it (as tessDir_mt.tesseract_shared).
+#   With -t (and tesserocr installed), both inputs run the code of tessDir_mt.py: its worker
+# initialization, tesseract_lines over the line files, and shared_tasks and tesseract_shared
+# over the segments (--lines), through job_scheduler.run_tasks.
+#   It reports lines/sec of the input stage (or of the input plus the recognition, with -t),
+# the bytes written to and read from disk, and the bytes passed
+# through shared memory. The specimens are synthetic unless a folder and its lines (global
+# text file or manifest) are given.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, itertools, multiprocessing, os, shutil, sys, tempfile, time
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" ) )
+import numpy as np
+from PIL import Image
+import cv2 as cv
+import image_access, job_scheduler, line_manifest
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_specimens( dir_name, n_specimens, n_lines ):
+	""" Saves n_specimens jpg images with n_lines text lines each. Returns the records of their lines (as line_manifest).
+	"""
+	rng = np.random.RandomState( 0 )
+	records = []
+	for s in range( n_specimens ):
+		image = np.full( (3000, 4000, 3), 225, dtype=np.uint8 )
+		image = cv.add( image, rng.randint( 0, 20, image.shape ).astype( np.uint8 ) )
+		specimen = "SPECIMEN" + str(s)
+		for i in range( n_lines ):
+			y = 200 + i * 2500 // n_lines
+			x2 = rng.randint( 1200, 3800 )
+			cv.putText( image, "Collected " + str(rng.randint(1900, 2000)) + " Gainesville, Florida", (120, y + 45), cv.FONT_HERSHEY_SIMPLEX, 1.6, (20, 20, 20), 3 )
+			records.append( ( specimen, i + 1, specimen + ".jpg", specimen + "_" + ("%03d" % (i + 1)) + ".jpg", 100, y, x2, y + 60, "" ) )
+		cv.imwrite( dir_name + "/" + specimen + ".jpg", image, [int(cv.IMWRITE_JPEG_QUALITY), 90] )
+	return records
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_files( path_filenames ):
+	""" Worker of the file input (without -t): reads and decodes the line files.
+	"""
+	for path_filename in path_filenames:
+		np.asarray( Image.open( path_filename ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_shared( items ):
+	""" Worker of the shared memory input (without -t): copies the pixels of the crops [(segment name, filename, region)] of a
+	segment, as tessDir_mt.tesseract_shared does before SetImageBytes.
+	"""
+	segment = image_access.attach_segment( items[0][0] )
+	for name, filename, region in items:
+		pixels = image_access.region_view( segment, region )
+		pixels.tobytes()
+		del pixels
+	segment.close()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def shared_tasks( imgs_dir, records, segments, failed ):
+	""" Tasks of the shared memory input, as tessDir_mt.shared_tasks (which needs tesserocr to be imported).
+	"""
+	for specimen, specimen_records in itertools.groupby( records, key=lambda r: r[0] ):
+		specimen_records = list( specimen_records )
+		segment, regions = image_access.share_regions( imgs_dir + "/" + specimen_records[0][2], [ list( r[4:8] ) for r in specimen_records ] )
+		segment.close()
+		segments[ segment.name ] = [ segment, len(specimen_records) ]
+		yield [ ( segment.name, r[3], region ) for r, region in zip( specimen_records, regions ) ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Benchmark of the file and shared memory inputs of the Tesseract workers.
+	"""
+	parser = argparse.ArgumentParser("Benchmark of the file and shared memory inputs of the Tesseract workers.")
+	parser.add_argument('-id', '--imgs_dir', action="store", default="", help="Folder of the specimen images (default: synthetic specimens).")
+	parser.add_argument('-ln', '--lines', action="store", default="", help="Global text file or manifest of the lines of the specimens of imgs_dir.")
+	parser.add_argument('-ns', '--n_specimens', action="store", type=int, default=8, help="Number of synthetic specimens.")
+	parser.add_argument('-nl', '--n_lines', action="store", type=int, default=20, help="Lines per synthetic specimen.")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=multiprocessing.cpu_count(), help="Number of worker processes.")
+	parser.add_argument('-t', '--tesseract', action="store_true", help="Recognize the lines with Tesseract (tesserocr) too.")
+	args = parser.parse_args()
+
+	tmp_dir = tempfile.mkdtemp()
+	if args.imgs_dir == "":
+		imgs_dir = tmp_dir
+		records = synthetic_specimens( imgs_dir, args.n_specimens, args.n_lines )
+	elif not os.path.isfile( args.lines ):
+		print('Error: The file of the lines was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+	else:
+		imgs_dir = args.imgs_dir
+		records = line_manifest.read_records( args.lines )
+	groups = [ list(g) for k, g in itertools.groupby( records, key=lambda r: r[0] ) ]
+	specimen_bytes = sum( os.stat( imgs_dir + "/" + g[0][2] ).st_size for g in groups )
+	print("Specimens: " + str(len(groups)) + ", lines: " + str(len(records)) + ", workers: " + str(args.jobs) + ", recognition: " + str(args.tesseract))
+
+	# Files: the lines are saved as jpg files (as crop_save), then read and decoded by the workers
+	lines_dir = tmp_dir + "/lines"
+	os.makedirs( lines_dir )
+	start = time.time()
+	written = 0
+	for g in groups:
+		crops, size = image_access.read_regions( imgs_dir + "/" + g[0][2], [ list( r[4:8] ) for r in g ] )
+		for r, crop in zip( g, crops ):
+			cv.imwrite( lines_dir + "/" + r[3], crop, [int(cv.IMWRITE_JPEG_QUALITY), 100] )
+			written = written + os.stat( lines_dir + "/" + r[3] ).st_size
+	save_time = time.time() - start
+
+	if args.tesseract:
+		# The shipped workers: one Tesseract API per process, results written to tmp_dir/text and tmp_dir/conf
+		import tessDir_mt
+		for dir_name in [ tmp_dir + "/text", tmp_dir + "/conf" ]:
+			os.makedirs( dir_name )
+		files_function, shared_function, initializer = tessDir_mt.tesseract_lines, tessDir_mt.tesseract_shared, tessDir_mt.init_worker
+		files_args, shared_args = [ ( d, tmp_dir + "/text", tmp_dir + "/conf", False ) for d in [ lines_dir, imgs_dir ] ]
+	else:
+		files_function, shared_function, initializer = read_files, read_shared, None
+		files_args, shared_args = (), ()
+
+	filenames = [ r[3] for r in records ]
+	read = sum( os.stat( lines_dir + "/" + f ).st_size for f in filenames )
+	tasks = [ filenames[i:i + 16] for i in range( 0, len(filenames), 16 ) ]
+	if not args.tesseract:
+		tasks = [ [ lines_dir + "/" + f for f in task ] for task in tasks ]
+	start = time.time()
+	for task, result, error in job_scheduler.run_tasks( files_function, tasks, args.jobs, 0, 1, initializer, files_args, False ):
+		assert error == "", error
+	files_time = time.time() - start
+
+	# Shared memory: each specimen is decoded once by the main process (when a worker is free), and the workers copy the
+	# crops from memory
+	start = time.time()
+	shared = 0
+	segments = {}
+	failed = []
+	if args.tesseract:
+		tessDir_mt.IMGS_DIR = imgs_dir
+		tasks = tessDir_mt.shared_tasks( records, segments, failed )
+	else:
+		tasks = shared_tasks( imgs_dir, records, segments, failed )
+	try:
+		for items, result, error in job_scheduler.run_tasks( shared_function, tasks, args.jobs, 0, 1, initializer, shared_args, False ):
+			assert error == "", error
+			name = items[0][0]
+			shared = shared + segments[ name ][0].size
+			segments.pop( name )[0].unlink()
+	finally:
+		for segment, remaining in segments.values():
+			segment.unlink()
+	shared_time = time.time() - start
+	assert len(failed) == 0, "Specimens which could not be decoded: " + str(failed)
+
+	print("%-16s %10s %10s %14s %14s %14s" % ("input", "seconds", "lines/s", "disk written", "disk read", "shared memory"))
+	print("%-16s %10.3f %10.1f %14d %14d %14d" % ("files", files_time, len(records) / files_time, written, read, 0))
+	print("%-16s %10.3f %10.1f %14d %14d %14d" % ("files + saving", files_time + save_time, len(records) / (files_time + save_time), written, read + specimen_bytes, 0))
+	print("%-16s %10.3f %10.1f %14d %14d %14d" % ("shared memory", shared_time, len(records) / shared_time, 0, specimen_bytes, shared))
+	print("(files + saving and shared memory both decode the specimens; files only counts the workers)")
+
+	shutil.rmtree( tmp_dir )
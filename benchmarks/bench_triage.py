@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Benchmark of the triage of the cropped lines (triage_lines.py). It scores the lines of a
+# directory (or of a synthetic collection of text lines, blank boxes, slivers, and barcodes),
+# and reports the throughput of the filter, the skipped lines by reason, and the OCR engine
+# seconds saved per collection: skipped lines x (OCRopus + Tesseract seconds per line).
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, shutil, sys, tempfile, time
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" ) )
+import numpy as np
+import cv2 as cv
+import line_container, triage_lines
+
+# Composition of the synthetic collection: (kind, fraction)
+SYNTHETIC = [ ("text", 0.80), ("blank", 0.08), ("sliver", 0.05), ("barcode", 0.04), ("dark", 0.03) ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_line( kind, rng ):
+	""" Returns a grayscale crop of the kind: text, blank, sliver, barcode, or dark.
+	"""
+	height = rng.randint( 30, 80 )
+	width = rng.randint( 200, 1200 )
+	if kind == "sliver":
+		height = rng.randint( 1, 6 )
+	crop = np.full( (height, width), 235, dtype=np.uint8 )
+	if kind == "text":
+		chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .,-"
+		text = ''.join( chars[i] for i in rng.randint( 0, len(chars), width // 18 ) )
+		cv.putText( crop, text, (5, int(height * 0.7)), cv.FONT_HERSHEY_SIMPLEX, height / 60.0, 20, 2 )
+	elif kind == "barcode":
+		x = 10
+		while x < width - 10:
+			bar = rng.randint( 2, 8 )
+			crop[ 1:height-1, x:x+bar ] = 15
+			x = x + bar + rng.randint( 2, 8 )
+	elif kind == "dark":
+		crop[:] = 30
+	noise = rng.randint( -6, 7, crop.shape )
+	return np.clip( crop.astype( np.int16 ) + noise, 0, 255 ).astype( np.uint8 )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_collection( dir_name, n_lines ):
+	""" Saves n_lines synthetic crops (jpg) in the directory. Returns the dictionary {filename: kind}.
+	"""
+	rng = np.random.RandomState( 0 )
+	kinds = {}
+	n = 0
+	for kind, fraction in SYNTHETIC:
+		for i in range( int( round( n_lines * fraction ) ) ):
+			filename = "SPECIMEN" + str(n // 20) + "_" + ("%03d" % (n % 20 + 1)) + ".jpg"
+			cv.imwrite( dir_name + "/" + filename, synthetic_line( kind, rng ), [int(cv.IMWRITE_JPEG_QUALITY), 95] )
+			kinds[ filename ] = kind
+			n = n + 1
+	return kinds
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Benchmark of the triage of the cropped lines.
+	"""
+	parser = argparse.ArgumentParser("Benchmark of the triage of the cropped lines.")
+	parser.add_argument('-id', '--input_dir', action="store", default="", help="Directory with the cropped lines (default: a synthetic collection).")
+	parser.add_argument('-n', '--n_lines', action="store", type=int, default=2000, help="Number of lines of the synthetic collection.")
+	parser.add_argument('-cl', '--collection_lines', action="store", type=int, default=0, help="Lines of the collection to extrapolate the savings to (default: the lines of the benchmark).")
+	parser.add_argument('-os', '--ocropus_seconds', action="store", type=float, default=1.5, help="OCRopus seconds per line (nlbin + rpred processes).")
+	parser.add_argument('-ts', '--tesseract_seconds', action="store", type=float, default=0.15, help="Tesseract seconds per line.")
+	args = parser.parse_args()
+
+	kinds = {}
+	tmp_dir = None
+	input_dir = args.input_dir
+	if input_dir == "":
+		tmp_dir = tempfile.mkdtemp()
+		input_dir = tmp_dir
+		kinds = synthetic_collection( input_dir, args.n_lines )
+	elif not os.path.isdir( input_dir ):
+		print('Error: The directory of the cropped lines was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	triage_lines.INPUT_DIR = input_dir
+	filename_list = sorted( line_container.list_files( input_dir, '.jpg' ) + line_container.list_files( input_dir, '.png' ) )
+
+	# Single process throughput of the filter
+	start = time.time()
+	results = [ triage_lines.score_line( filename ) for filename in filename_list ]
+	elapsed = time.time() - start
+
+	counts = {}
+	for filename, reason, features in results:
+		counts[ reason ] = counts.get( reason, 0 ) + 1
+	n_skipped = len(results) - counts.get( "", 0 )
+
+	print("Lines: " + str(len(results)) + ", triage: " + ("%.3f" % elapsed) + " s (" + ("%.0f" % (len(results) / max(elapsed, 1e-9))) + " lines/s, one process)")
+	for reason in sorted( counts ):
+		print("  " + (reason if reason != "" else "processed") + ": " + str(counts[reason]))
+
+	# Quality of the filter on the synthetic collection
+	if len(kinds) > 0:
+		lost = sum( 1 for filename, reason, features in results if reason != "" and kinds[filename] == "text" )
+		missed = sum( 1 for filename, reason, features in results if reason == "" and kinds[filename] != "text" )
+		print("Text lines skipped (false positives): " + str(lost) + ", non-text lines processed (false negatives): " + str(missed))
+
+	collection_lines = args.collection_lines if args.collection_lines > 0 else len(results)
+	skipped_lines = n_skipped * collection_lines / float( max(len(results), 1) )
+	saved = skipped_lines * (args.ocropus_seconds + args.tesseract_seconds)
+	cost = elapsed * collection_lines / float( max(len(results), 1) )
+	print("Per collection of " + str(collection_lines) + " lines: " + ("%.0f" % skipped_lines) + " lines skipped, " + ("%.0f" % saved) + " engine-seconds saved, " + ("%.0f" % cost) + " seconds of triage.")
+
+	if tmp_dir is not None:
+		shutil.rmtree( tmp_dir )
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   End-to-end check of get_lines_googleDir_mt.py against the stub Vision server
+# (stub_vision_server.py, --endpoint), without credentials nor network. A folder of -n
+# synthetic images is processed twice:
+#   - first run: every -fr-th request fails as a whole and the first image of each request
+#     gets a transient error, and -k images are rejected (permanent error). It checks the
+#     batching (no request has more than -b images), the retries (every image which is not
+#     rejected is answered and saved), and that the journal holds the saved images only.
+#   - second run (resume): the rejected images are accepted. It checks that only them are
+#     sent, and that every image has its lines once in the global file.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, collections, hashlib, os, shutil, subprocess, sys, tempfile, time
+SRC_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "src" )
+sys.path.insert( 0, SRC_DIR )
+import numpy as np
+from PIL import Image
+import stub_vision_server
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_images( dir_name, n_images ):
+	""" Saves n_images different jpg images in the directory. Returns {filename: sha1 of the content}.
+	"""
+	rng = np.random.RandomState( 0 )
+	digests = {}
+	for i in range( n_images ):
+		filename = "MCZ_ENT_" + ( "%08d" % i ) + ".jpg"
+		Image.fromarray( rng.randint( 0, 256, (160, 480, 3) ).astype( np.uint8 ) ).save( dir_name + "/" + filename, quality=90 )
+		with open( dir_name + "/" + filename, 'rb' ) as f:
+			digests[ filename ] = hashlib.sha1( f.read() ).hexdigest()
+	return digests
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def run( arguments ):
+	""" Runs get_lines_googleDir_mt.py. Returns (exit code, seconds).
+	"""
+	start = time.time()
+	returncode = subprocess.call( [ sys.executable, SRC_DIR + "/get_lines_googleDir_mt.py" ] + arguments, stdout=subprocess.DEVNULL )
+	return ( returncode, time.time() - start )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_journal( path_filename ):
+	with open( path_filename ) as f:
+		return [ line.rstrip('\n') for line in f if line.strip() != "" ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Checks the batching, retries, and journal resume of get_lines_googleDir_mt.py with the stub server.
+	"""
+	parser = argparse.ArgumentParser("Checks the batching, retries, and journal resume of get_lines_googleDir_mt.py against the stub Vision server.")
+	parser.add_argument('-n', '--n_images', action="store", type=int, default=20, help="Number of images.")
+	parser.add_argument('-b', '--batch_size', action="store", type=int, default=8, help="Images per request (-b of the script).")
+	parser.add_argument('-t', '--threads', action="store", type=int, default=3, help="Requests in flight (-t of the script).")
+	parser.add_argument('-fr', '--fail_request', action="store", type=int, default=2, help="Every n-th request fails as a whole.")
+	parser.add_argument('-k', '--rejected', action="store", type=int, default=3, help="Images rejected in the first run.")
+	args = parser.parse_args()
+
+	tmp_dir = tempfile.mkdtemp()
+	input_dir, output_dir = tmp_dir + "/images", tmp_dir + "/lines"
+	os.makedirs( input_dir )
+	digests = synthetic_images( input_dir, args.n_images )
+	rejected = sorted( digests )[ :args.rejected ]
+	server, stub, endpoint = stub_vision_server.start_server( 0, args.fail_request, 1 )
+	stub.reject = set( digests[ f ] for f in rejected )
+	arguments = [ "-id", input_dir, "-od", output_dir, "-of", output_dir + "/lines.txt", "-ep", endpoint, "-b", str(args.batch_size), "-t", str(args.threads), "-r", "3" ]
+
+	try:
+		# First run: faults and rejected images
+		returncode, seconds = run( arguments )
+		print("First run: exit code " + str(returncode) + ", " + ( "%.1f" % seconds ) + " s, " + str(len(stub.requests)) + " requests of " + str(stub.requests) + " images")
+		assert returncode == ( 5 if args.rejected > 0 else 0 ), "Unexpected exit code"
+		assert max( stub.requests ) <= args.batch_size, "A request has more images than the batch size"
+		assert args.n_images < args.batch_size or args.batch_size in stub.requests, "No request has a full batch"
+		if args.fail_request > 0:
+			assert len(stub.requests) >= args.fail_request, "No request failed"
+		accepted = set( digests[f] for f in digests if f not in rejected )
+		assert set( stub.answered ) == accepted, "Images not answered after the retries"
+		journal = read_journal( output_dir + "/journal.txt" )
+		assert sorted( journal ) == sorted( f for f in digests if f not in rejected ), "The journal does not hold the saved images"
+		for filename in journal:
+			basename = os.path.splitext( filename )[0]
+			assert len( [ f for f in os.listdir( output_dir ) if f.startswith( basename + "_" ) and f.endswith( ".jpg" ) ] ) > 0, "No lines of " + filename
+
+		# Second run: only the images missing from the journal are sent
+		stub.reject = set()
+		n_answered = len(stub.answered)
+		returncode, seconds = run( arguments )
+		resent = stub.answered[ n_answered: ]
+		print("Second run: exit code " + str(returncode) + ", " + ( "%.1f" % seconds ) + " s, images sent again: " + str(len(resent)))
+		assert returncode == 0, "Unexpected exit code"
+		assert sorted( resent ) == sorted( digests[f] for f in rejected ), "The resumed run did not send only the missing images"
+		assert sorted( read_journal( output_dir + "/journal.txt" ) ) == sorted( digests ), "The journal is not complete"
+		with open( output_dir + "/lines.txt" ) as f:
+			records = [ line.split('\t') for line in f if line.strip() != "" ]
+		counts = collections.Counter( r[1] for r in records )
+		assert set( r[0] for r in records ) == set( digests ) and max( counts.values() ) == 1, "The global file does not have the lines of every image once"
+		print("OK: " + str(args.n_images) + " images, " + str(len(records)) + " lines")
+	finally:
+		server.stop( 0 )
+		shutil.rmtree( tmp_dir )
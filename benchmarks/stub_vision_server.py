@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Stub gRPC server of the Google Cloud Vision API (ImageAnnotator.BatchAnnotateImages),
+# to run get_lines_googleDir_mt.py (--endpoint host:port, insecure channel) without
+# credentials nor network. Every image gets a synthetic DOCUMENT_TEXT_DETECTION response:
+# a few lines of words, with the bounding boxes of their symbols inside the image, and the
+# line breaks the script needs to assemble them.
+#   Faults can be injected: every -fr-th request fails as a whole (UNAVAILABLE), and the
+# first -ie images of each request get a transient error (UNAVAILABLE) the first time they
+# are seen, so both retries of annotate_batch are exercised. The images whose sha1 is in
+# the reject set get a permanent error (INVALID_ARGUMENT). The sizes of the requests and the
+# images answered are recorded (see check_google_dir.py).
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, hashlib, io, sys, threading
+from concurrent import futures
+import grpc
+from PIL import Image
+from google.cloud import vision
+from google.cloud.vision_v1.proto import image_annotator_pb2, image_annotator_pb2_grpc
+
+breaks = vision.enums.TextAnnotation.DetectedBreak.BreakType
+WORDS = [ "Museum", "of", "Comparative", "Zoology", "Harvard", "Coll.", "Locality", "No.", "1923", "det." ]
+# Size, in pixels, of a symbol
+SYMBOL_W = 12
+SYMBOL_H = 20
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_lines( content, n_lines=3 ):
+	""" Text of the lines of an image: words chosen by the sha1 of its content (the same image, the same text).
+	"""
+	digest = hashlib.sha1( content ).digest()
+	return [ ' '.join( WORDS[ digest[ (3 * i + j) % len(digest) ] % len(WORDS) ] for j in range( 1 + digest[i] % 3 ) ) for i in range( n_lines ) ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def synthetic_response( content ):
+	""" AnnotateImageResponse of an image: its lines from the top left corner, one paragraph, and the full text.
+	"""
+	width, height = Image.open( io.BytesIO( content ) ).size
+	lines = synthetic_lines( content, max( 1, min( 3, (height - 10) // (SYMBOL_H + 5) ) ) )
+	response = image_annotator_pb2.AnnotateImageResponse()
+	paragraph = response.full_text_annotation.pages.add( width=width, height=height ).blocks.add().paragraphs.add()
+	y = 10
+	for text in lines:
+		x = 10
+		words = text.split(' ')
+		for n_word, word_text in enumerate( words ):
+			word = paragraph.words.add()
+			for n_symbol, c in enumerate( word_text ):
+				x2, y2 = min( x + SYMBOL_W, width - 1 ), min( y + SYMBOL_H, height - 1 )
+				symbol = word.symbols.add( text=c, confidence=0.9 )
+				for vx, vy in [ (x, y), (x2, y), (x2, y2), (x, y2) ]:
+					symbol.bounding_box.vertices.add( x=vx, y=vy )
+				if n_symbol == len(word_text) - 1:
+					symbol.property.detected_break.type = breaks.LINE_BREAK if n_word == len(words) - 1 else breaks.SPACE
+				x = x + SYMBOL_W
+			x = x + SYMBOL_W
+		y = y + SYMBOL_H + 5
+	response.full_text_annotation.text = '\n'.join( lines ) + '\n'
+	return response
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+class StubAnnotator( image_annotator_pb2_grpc.ImageAnnotatorServicer ):
+	""" BatchAnnotateImages with synthetic responses and injected faults (see above).
+	"""
+	def __init__( self, fail_request=0, image_errors=0 ):
+		self.fail_request = fail_request
+		self.image_errors = image_errors
+		self.reject = set()
+		self.lock = threading.Lock()
+		self.requests = []			# Number of images of each request (also of the failed ones)
+		self.answered = []			# sha1 of the images answered without error
+		self.seen = set()
+
+	def BatchAnnotateImages( self, request, context ):
+		with self.lock:
+			self.requests.append( len(request.requests) )
+			n_request = len(self.requests)
+		if self.fail_request > 0 and n_request % self.fail_request == 0:
+			context.abort( grpc.StatusCode.UNAVAILABLE, "Stub: request " + str(n_request) + " failed." )
+
+		batch_response = image_annotator_pb2.BatchAnnotateImagesResponse()
+		for n_image, image_request in enumerate( request.requests ):
+			content = image_request.image.content
+			digest = hashlib.sha1( content ).hexdigest()
+			with self.lock:
+				first_time = digest not in self.seen
+				self.seen.add( digest )
+			response = batch_response.responses.add()
+			if digest in self.reject:
+				response.error.code = 3		# INVALID_ARGUMENT
+				response.error.message = "Stub: rejected image."
+			elif first_time and n_image < self.image_errors:
+				response.error.code = 14	# UNAVAILABLE
+				response.error.message = "Stub: transient error."
+			else:
+				response.CopyFrom( synthetic_response( content ) )
+				with self.lock:
+					self.answered.append( digest )
+		return batch_response
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def start_server( port=0, fail_request=0, image_errors=0, threads=16 ):
+	""" Starts the stub server in 127.0.0.1 (port 0: any free port). Returns (server, servicer, "host:port").
+	"""
+	servicer = StubAnnotator( fail_request, image_errors )
+	server = grpc.server( futures.ThreadPoolExecutor( max_workers=threads ), options=[ ('grpc.max_receive_message_length', 256 * 1024 * 1024) ] )
+	image_annotator_pb2_grpc.add_ImageAnnotatorServicer_to_server( servicer, server )
+	port = server.add_insecure_port( "127.0.0.1:" + str(port) )
+	server.start()
+	return ( server, servicer, "127.0.0.1:" + str(port) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Runs the stub server until it is interrupted.
+	"""
+	parser = argparse.ArgumentParser("Stub gRPC server of the Google Cloud Vision API, for get_lines_googleDir_mt.py --endpoint.")
+	parser.add_argument('-p', '--port', action="store", type=int, default=50051, help="Port of the server (127.0.0.1).")
+	parser.add_argument('-fr', '--fail_request', action="store", type=int, default=0, help="Every n-th request fails as a whole with UNAVAILABLE (0: never).")
+	parser.add_argument('-ie', '--image_errors', action="store", type=int, default=0, help="Number of images of each request that get a transient error the first time they are seen.")
+	args = parser.parse_args()
+
+	server, servicer, endpoint = start_server( args.port, args.fail_request, args.image_errors )
+	print("Stub Vision server at " + endpoint)
+	sys.stdout.flush()
+	try:
+		server.wait_for_termination()
+	except KeyboardInterrupt:
+		server.stop( 0 )
+	print("Requests: " + str(len(servicer.requests)) + ", images answered: " + str(len(servicer.answered)))
@@ -22,6 +22,7 @@
 ##########################################################################################
 import argparse, io, os, sys
 from Bio import pairwise2
+import line_container, prob_cache, prob_io
 
 # python3 ../ALOT/accept_from_ngrams.py -i1 ./gr_ocropus_fixed/ -i2 ./gr_tesseract_fixed -i3 ./gr_google_fixed -d accepted
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -31,6 +32,8 @@ fname_google_stats = "/home/user/digi_13297227/H-MaTE/google_symbols_stats.txt"
 ocropus_stats = {}
 tesseract_stats = {}
 google_stats = {}
+# Folder of the line containers where the results are saved ("": plain files)
+CONTAINER_ENGINE = ""
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 def align(s1, p1, s2, p2):
 	""" Aligns the text and probability files of two strings. Returns their aligned versions.
@@ -120,26 +123,11 @@ def align(s1, p1, s2, p2):
 	return(s1_aligned, p1_aligned, s2_aligned, p2_aligned)
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
-def loadProbFile( probPathFilename ):
-	""" Reads the probability file and returns a list with the symbols and a list with the probabilities.
+def loadProbFile( probPath, probFilename, engine="" ):
+	""" Reads the probability file (from the directory or from the line container of its image) and returns a list 
+	with the symbols and a list with the probabilities.
 	"""
-	symbols_list = []
-	prob_list = []
-	with open( probPathFilename ) as f_prob: 
-		for line in f_prob:
-			try:
-				symbol, prob = line.rstrip('\n').split("\t")
-				if symbol != '':
-					if len(symbol) > 1:
-						for c in symbol:
-							symbols_list.append( c )
-							prob_list.append( float(prob) )
-					else:
-						symbols_list.append( symbol )
-						prob_list.append( float(prob) )
-			except:
-				break
-
+	symbols_list, prob_list = prob_io.characters( *prob_cache.read_prob( probPath, probFilename, engine ) )
 	return symbols_list, prob_list
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -489,26 +477,22 @@ def verify_and_save(s_list, p_list, pathAccept, filename, pathReject):
 		s_prob = s_prob[:-1]
 
 		# We write the accepted results to disk
-		text_PathFilename = pathAccept + "/" + filename[:-5] + ".txt"
-		prob_PathFilename = pathAccept + "/" + filename
 		f_t = None
-		with open( text_PathFilename, "w+" ) as f_t:
+		with line_container.open_write( pathAccept, filename[:-5] + ".txt", CONTAINER_ENGINE, CONTAINER_ENGINE != "" ) as f_t:
 			f_t.write( s_text )
 		f_p = None
-		with open( prob_PathFilename, "w+" ) as f_p:
+		with line_container.open_write( pathAccept, filename, CONTAINER_ENGINE, CONTAINER_ENGINE != "" ) as f_p:
 			f_p.write( s_prob )
 	else:
 		if len(s_prob)>1:
 			s_prob = s_prob[:-1]
 
 		# We write the accepted results to disk
-		text_PathFilename = pathReject + "/" + filename[:-5] + ".txt"
-		prob_PathFilename = pathReject + "/" + filename
 		f_t = None
-		with open( text_PathFilename, "w+" ) as f_t:
+		with line_container.open_write( pathReject, filename[:-5] + ".txt", CONTAINER_ENGINE, CONTAINER_ENGINE != "" ) as f_t:
 			f_t.write( s_text )
 		f_p = None
-		with open( prob_PathFilename, "w+" ) as f_p:
+		with line_container.open_write( pathReject, filename, CONTAINER_ENGINE, CONTAINER_ENGINE != "" ) as f_p:
 			f_p.write( s_prob )
 
 # python3 ../ALOT/accept_from_ngrams.py -i1 ./gr_ocropus_fixed/ -i2 ./gr_tesseract_fixed -i3 ./gr_google_fixed -d accepted
@@ -520,6 +504,11 @@ if __name__ == '__main__':
 	parser.add_argument('-i1', '--input1', action="store", required=True, help="Directory where the OCRopus probability files are located.")
 	parser.add_argument('-i2', '--input2', action="store", required=True, help="Directory where the Tesseract probability files are located.")
 	parser.add_argument('-i3', '--input3', action="store", required=True, help="Directory where the Google probability files are located.")
+	parser.add_argument('-e1', '--engine1', action="store", default="ocropus", help="Engine of the OCRopus probability files, when they are stored in line containers.")
+	parser.add_argument('-e2', '--engine2', action="store", default="tesseract", help="Engine of the Tesseract probability files, when they are stored in line containers.")
+	parser.add_argument('-e3', '--engine3', action="store", default="google", help="Engine of the Google probability files, when they are stored in line containers.")
+	parser.add_argument('-pc', '--prob_cache', action="store", default="", help="Folder of the columnar caches of the probabilities files (see prob_cache.py); they are built the first time and rebuilt when the files change.")
+	parser.add_argument('-ce', '--container_engine', action="store", default="", help="Save the results in this folder of the line containers of the destination directories (default: plain files).")
 	parser.add_argument('-da', '--dstdir_a', action="store", required=True, help="Directory where the accepted text and probability files will be saved.")
 	parser.add_argument('-dr', '--dstdir_r', action="store", required=True, help="Directory where the rejected text and probability files will be saved.")
 	args = parser.parse_args()
@@ -556,20 +545,20 @@ if __name__ == '__main__':
 			parser.print_help()
 			sys.exit(-5)
 
+	CONTAINER_ENGINE = args.container_engine
+
+	# Columnar caches of the probabilities files (see prob_cache.py)
+	if args.prob_cache != "":
+		prob_cache.open_caches( [ (args.input1, args.engine1), (args.input2, args.engine2), (args.input3, args.engine3) ], args.prob_cache )
+
 	# Create the lists of files to process
-	files_list1 = list()
-	for root, dirs, filenames in os.walk( args.input1 ):
-		files_list1 = list(f for f in filenames if f.endswith('.prob'))
+	files_list1 = prob_cache.list_files( args.input1, args.engine1 )
 	n1 = len(files_list1)
 
-	files_list2 = list()
-	for root, dirs, filenames in os.walk( args.input2 ):
-		files_list2 = list(f for f in filenames if f.endswith('.prob'))
+	files_list2 = prob_cache.list_files( args.input2, args.engine2 )
 	n2 = len(files_list2)
 
-	files_list3 = list()
-	for root, dirs, filenames in os.walk( args.input3 ):
-		files_list3 = list(f for f in filenames if f.endswith('.prob'))
+	files_list3 = prob_cache.list_files( args.input3, args.engine3 )
 	n3 = len(files_list3)
 
 	files_set1 = set( files_list1 )
@@ -612,11 +601,11 @@ if __name__ == '__main__':
 	while i<len(files_list123):
 		filename = files_list123[i]
 		s1, p1 = [], []
-		s1, p1 = loadProbFile( args.input1 + "/" + filename )
+		s1, p1 = loadProbFile( args.input1, filename, args.engine1 )
 		s2, p2 = [], []
-		s2, p2 = loadProbFile( args.input2 + "/" + filename )
+		s2, p2 = loadProbFile( args.input2, filename, args.engine2 )
 		s3, p3 = [], []
-		s3, p3 = loadProbFile( args.input3 + "/" + filename )
+		s3, p3 = loadProbFile( args.input3, filename, args.engine3 )
 
 		n1 = len(s1)
 		n2 = len(s2)
@@ -744,9 +733,9 @@ if __name__ == '__main__':
 		# Read & load the content of the text and probability files
 		filename = files_list12[i]
 		s1, p1 = [], []
-		s1, p1 = loadProbFile( args.input1 + "/" + filename )
+		s1, p1 = loadProbFile( args.input1, filename, args.engine1 )
 		s2, p2 = [], []
-		s2, p2 = loadProbFile( args.input2 + "/" + filename )
+		s2, p2 = loadProbFile( args.input2, filename, args.engine2 )
 
 		n1 = len(s1)
 		n2 = len(s2)
@@ -798,9 +787,9 @@ if __name__ == '__main__':
 		# Read & load the content of the text and probability files
 		filename = files_list13[i]
 		s1, p1 = [], []
-		s1, p1 = loadProbFile( args.input1 + "/" + filename )
+		s1, p1 = loadProbFile( args.input1, filename, args.engine1 )
 		s3, p3 = [], []
-		s3, p3 = loadProbFile( args.input3 + "/" + filename )
+		s3, p3 = loadProbFile( args.input3, filename, args.engine3 )
 
 		n1 = len(s1)
 		n3 = len(s3)
@@ -853,9 +842,9 @@ if __name__ == '__main__':
 		# Read & load the content of the text and probability files
 		filename = files_list23[i]
 		s2, p2 = [], []
-		s2, p2 = loadProbFile( args.input2 + "/" + filename )
+		s2, p2 = loadProbFile( args.input2, filename, args.engine2 )
 		s3, p3 = [], []
-		s3, p3 = loadProbFile( args.input3 + "/" + filename )
+		s3, p3 = loadProbFile( args.input3, filename, args.engine3 )
 
 		n2 = len(s2)
 		n3 = len(s3)
@@ -22,6 +22,7 @@
 
 import argparse, os, sys
 import pandas as pd
+import line_container, prob_io
 
 path_filename_2g = "/home/user/digi_13297227/H-MaTE/2_gram.tsv"
 path_filename_1g = "/home/user/digi_13297227/H-MaTE/1_gram.tsv"
@@ -44,6 +45,8 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser("Using the n-gram files, augment the confidence of the probability files.")
 	parser.add_argument('-sd', '--srcdir', action="store", required=True, help="Directory where the probability files are located.")
 	parser.add_argument('-dd', '--dstdir', action="store", required=True, help="Directory where the new augmented probability files will be saved.")
+	parser.add_argument('-e', '--engine', action="store", default="", help="Engine of the text and probability files, when they are stored in line containers.")
+	parser.add_argument('-ce', '--container_engine', action="store", default="", help="Save the new files in this folder of the line containers of the destination directory (default: plain files).")
 	args = parser.parse_args()
 
 	# Arguments Validations
@@ -84,9 +87,7 @@ if __name__ == '__main__':
 		dict_1g[ row['gram'] ] = int(row['n'])
 
 	# Create the lists of files to process
-	files_list = list()
-	for root, dirs, filenames in os.walk( args.srcdir ):
-		files_list = list(f for f in filenames if f.endswith('.txt'))
+	files_list = line_container.list_files( args.srcdir, '.txt', args.engine )
 
 	# Process each text file
 	j = 0
@@ -95,18 +96,7 @@ if __name__ == '__main__':
 		prob_path_filename = args.srcdir + "/" + basename + ".prob"
 
 		# Load the probability file in two lists
-		symbols_list = []
-		prob_list = []
-		f_prob = None
-		with open( prob_path_filename ) as f_prob: 
-			for line in f_prob:
-				try:
-					symbol, prob = line.rstrip('\n').split("\t")
-
-					symbols_list.append( symbol )
-					prob_list.append( float(prob) )
-				except:
-					break
+		symbols_list, prob_list = prob_io.entries( *prob_io.read_prob( args.srcdir, basename + ".prob", args.engine ) )
 
 		size_symbols_list = len(symbols_list)
 		symbols_string = ''.join( symbols_list )
@@ -180,7 +170,6 @@ if __name__ == '__main__':
 				continue
 
 		# Create a new probability file in the destination directory
-		new_prob_path_filename = args.dstdir + "/" + basename + ".prob"
 
 		s_to_save = ""
 		i = 0
@@ -189,7 +178,7 @@ if __name__ == '__main__':
 			i = i + 1
 
 		new_f_prob = None
-		with open( new_prob_path_filename, "w+" ) as new_f_prob: 
+		with line_container.open_write( args.dstdir, basename + ".prob", args.container_engine, args.container_engine != "" ) as new_f_prob: 
 			new_f_prob.write(s_to_save)
 
 		if (b_changed):
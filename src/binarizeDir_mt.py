@@ -3,6 +3,11 @@
 # Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
 # Description: 
 #   Using OCROPY, this script binarizes the jpg images in a folder 
+#   The lines are binarized in a pool of processes with the ocropus-nlbin algorithm (see
+# ocropus_nlbin.py), and each one is saved as <line>.bin.png. With -ext, one ocropus-nlbin
+# process is run per line instead.
+# The input folder may also hold per-image line containers (see line_container.py), and the
+# binarized lines can be stored as <line>.bin.png in the ocropus folder of the containers.
 #
 ##########################################################################################
 # Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
@@ -20,20 +25,111 @@
 # limitations under the License.
 ##########################################################################################
 
-import argparse, os, sys
-from subprocess import Popen
-from itertools import islice
+import argparse, os, shutil, sys, tempfile
 import multiprocessing
+import worker_profile
+import image_access, job_scheduler, line_container, ocropus_nlbin, triage_lines
 
 # DIR_OCROPY = 
-CORES_N = multiprocessing.cpu_count()
+CORES_N = worker_profile.jobs( "binarizeDir_mt", multiprocessing.cpu_count() )
+INPUT_DIR = ""
+OUTPUT_DIR = ""
+CONTAINER = False
+# Binarized lines stored in the containers at once
+FLUSH_N = 256
+# Seconds a line may take before its process is killed
+TIME_LIMIT = 60
 
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def binarize_line( filename ):
+	""" Binarizes a line of INPUT_DIR in the process (ocropus_nlbin.py). Returns (filename, binarized line as PNG bytes, or
+	None if it was written to OUTPUT_DIR/<line>.bin.png, error message or "").
+	"""
+	try:
+		bin_png, gray_png = ocropus_nlbin.binarize_content( line_container.read_bytes( INPUT_DIR, filename ) )
+	except Exception as e:
+		return ( filename, None, str(e) )
+	if bin_png is None:
+		return ( filename, None, "empty image" )
+	if CONTAINER:
+		return ( filename, bin_png, "" )
+	with open( OUTPUT_DIR + "/" + filename[:-4] + ".bin.png", "wb" ) as f:
+		f.write( bin_png )
+	return ( filename, None, "" )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def binarize_lines( filenames ):
+	""" Binarizes a list of lines of INPUT_DIR (see binarize_line).
+	"""
+	results = []
+	for filename in filenames:
+		results = job_scheduler.next_item( 1, results )
+		results.append( binarize_line( filename ) )
+	return results
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def init_worker( input_dir, output_dir, container ):
+	""" Sets the folders of the worker processes of the pool.
+	"""
+	global INPUT_DIR, OUTPUT_DIR, CONTAINER
+	INPUT_DIR, OUTPUT_DIR, CONTAINER = input_dir, output_dir, container
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def binarize_external( files, n_jobs, time_limit=0, retries=0 ):
+	""" Binarizes the lines running one ocropus-nlbin process per line (killed after time_limit seconds, and run again up
+	to retries times), and renames its output (<line>/0001.bin.png) to <line>.bin.png. Returns (the list of lines which
+	could not be binarized, the list of (line, reason) of the lines over the time limit).
+	"""
+	# OCROPY only works with files: the lines stored in containers are extracted to a temporary folder
+	tmp_dir = tempfile.mkdtemp()
+	input_folder = INPUT_DIR
+	if len( line_container.list_containers( INPUT_DIR ) ) > 0:
+		input_folder = tmp_dir + "/lines"
+		for f in files:
+			if not os.path.exists( os.path.dirname( input_folder + "/" + f ) ):
+				os.makedirs( os.path.dirname( input_folder + "/" + f ) )
+			with open( input_folder + "/" + f, "wb" ) as f_out:
+				f_out.write( line_container.read_bytes( INPUT_DIR, f ) )
+	output_folder = tmp_dir + "/bin"
+
+	# commands = [DIR_OCROPY + "/ocropus-nlbin -n " + input_folder + "/" + f + " -o " + output_folder + "/" + f[:-4] for f in files]
+	commands = ["ocropus-nlbin -n " + input_folder + "/" + f + " -o " + output_folder + "/" + f[:-4] for f in files]
+	results, failed = job_scheduler.run_commands( commands, n_jobs, False, True, time_limit, retries )
+	quarantine = [ ( f, job_scheduler.TIMEOUT ) for f, result in zip( files, results ) if result[1] == job_scheduler.TIMEOUT_CODE ]
+
+	errors = []
+	bin_files = []
+	for f in files:
+		bin_filename = output_folder + "/" + f[:-4] + "/0001.bin.png"
+		if not os.path.isfile( bin_filename ):
+			errors.append( f )
+		elif CONTAINER:
+			with open( bin_filename, 'rb' ) as f_in:
+				bin_files.append( (os.path.basename( f[:-4] ) + ".bin.png", f_in.read()) )
+		else:
+			shutil.move( bin_filename, OUTPUT_DIR + "/" + f[:-4] + ".bin.png" )
+	if CONTAINER:
+		line_container.write_files( OUTPUT_DIR, bin_files, "ocropus", True )
+
+	shutil.rmtree( tmp_dir )
+	return ( errors, quarantine )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
 	""" MAIN 
 	"""
 	parser = argparse.ArgumentParser("Using OCROPY, this script binarizes the jpg images in a folder")
 	parser.add_argument('-if', '--input_folder', action="store", required=True, help="Directory with the jpg files to be binarized.")
-	parser.add_argument('-of', '--output_folder', action="store", required=True, help="Directory where the binarized images will be saved.")
+	parser.add_argument('-of', '--output_folder', action="store", required=True, help="Directory where the binarized images (<line>.bin.png) will be saved.")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=CORES_N, help="Maximum number of concurrent binarization processes.")
+	parser.add_argument('-sk', '--skip_list', action="store", default="", help="Skip list of the lines which are not binarized (see triage_lines.py).")
+	parser.add_argument('-ct', '--container', action="store_true", help="Save the binarized lines (<line>.bin.png) in the ocropus folder of the line containers of the output folder.")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=16, help="Number of lines sent to each process at once.")
+	parser.add_argument('-so', '--schedule_order', action="store", default="cost", choices=["cost", "walk"], help="cost: send the lines in decreasing order of width x height (read from their headers), in chunks of decreasing size (up to chunk_size lines); walk: in the order of the folders, in chunks of chunk_size lines.")
+	parser.add_argument('-ext', '--external', action="store_true", help="Run one ocropus-nlbin process per line, instead of binarizing the lines in a pool of processes.")
+	parser.add_argument('-tl', '--time_limit', action="store", type=float, default=TIME_LIMIT, help="Seconds a line may take before its process is killed and replaced (0: no limit).")
+	parser.add_argument('-rt', '--retries', action="store", type=int, default=1, help="Times a line over the time limit is tried again before it is quarantined.")
+	parser.add_argument('-qf', '--quarantine_file', action="store", default="", help="Path + Filename where the lines over the time limit are appended (with the format of the skip list).")
 	args = parser.parse_args()
 
 	# Arguments Validations
@@ -50,17 +146,50 @@ if __name__ == '__main__':
 			parser.print_help()
 			sys.exit(2)	
 
-	for root, dirs, filenames in os.walk( args.input_folder ):
-		files = list(f for f in filenames if f.endswith('.jpg'))
-		# commands = [DIR_OCROPY + "/ocropus-nlbin -n " + args.input_folder + "/" + f + " -o " + args.output_folder + "/" + f[:-4] for f in files]
-		commands = ["ocropus-nlbin -n " + args.input_folder + "/" + f + " -o " + args.output_folder + "/" + f[:-4] for f in files]
-
-		processes = (Popen(cmd, shell=True) for cmd in commands)
-		running_processes = list(islice(processes, CORES_N))  # start new processes
-		while running_processes:
-			for i, process in enumerate(running_processes):
-				if process.poll() is not None:  # the process has finished
-					running_processes[i] = next(processes, None)  # start new process
-					if running_processes[i] is None: # no new processes
-						del running_processes[i]
-						break
+	INPUT_DIR = args.input_folder
+	OUTPUT_DIR = args.output_folder
+	CONTAINER = args.container
+
+	# Lines of the folder, its subfolders, and its containers (the output keeps the same subfolders)
+	skip = triage_lines.load_skip_list( args.skip_list )
+	files = job_scheduler.walk_files( INPUT_DIR, '.jpg' ) + line_container.list_files( INPUT_DIR, '.jpg' )
+	files = sorted(set(f for f in files if os.path.basename(f)[:-4] not in skip))
+	if not CONTAINER:
+		for sub_dir in set( os.path.dirname(f) for f in files ):
+			if sub_dir != "" and not os.path.exists( OUTPUT_DIR + "/" + sub_dir ):
+				os.makedirs( OUTPUT_DIR + "/" + sub_dir )
+
+	if args.external:
+		errors, quarantine = binarize_external( files, args.jobs, args.time_limit, args.retries )
+	else:
+		# Each process imports the binarization once and receives the lines in chunks. The processes over the time limit
+		# are replaced, and their lines tried again one by one
+		errors = []
+		quarantine = []
+		bin_files = []
+		if args.schedule_order == "cost":
+			# Longest job first: the widest lines are sent first, and the chunks get smaller towards the end
+			chunks = job_scheduler.cost_chunks( files, [ image_access.line_cost( INPUT_DIR, f ) for f in files ], args.jobs, args.chunk_size )
+		else:
+			chunks = [ files[i:i + max(1, args.chunk_size)] for i in range( 0, len(files), max(1, args.chunk_size) ) ]
+		for chunk, results, error in job_scheduler.run_tasks( binarize_lines, chunks, args.jobs, args.time_limit, args.retries, init_worker, (INPUT_DIR, OUTPUT_DIR, CONTAINER) ):
+			if error != "":
+				errors.extend( chunk )
+				quarantine.extend( ( filename, error ) for filename in chunk )
+				continue
+			for filename, bin_png, error in results:
+				if error != "":
+					errors.append( filename )
+					print("Error: " + filename + ": " + error)
+				elif bin_png is not None:
+					# Store the binarized lines in the containers, under the name of their line
+					bin_files.append( (os.path.basename( filename[:-4] ) + ".bin.png", bin_png) )
+			if len(bin_files) >= FLUSH_N:
+				line_container.write_files( OUTPUT_DIR, bin_files, "ocropus", True )
+				bin_files = []
+		if len(bin_files) > 0:
+			line_container.write_files( OUTPUT_DIR, bin_files, "ocropus", True )
+
+	triage_lines.save_quarantine( args.quarantine_file, quarantine )
+	if len(errors) > 0:
+		print("Lines which could not be binarized: " + str(len(errors)) + " (quarantined: " + str(len(quarantine)) + ")")
@@ -23,6 +23,7 @@
 
 import argparse, os, sys
 import glob
+import line_container
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
@@ -31,6 +32,7 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser("Using the final .txt files, after executing the Text Extraction process, this program rebuilds the transcribed text for the images.")
 	parser.add_argument('-r', '--reference', action="store", required=True, help="Directory with the original .jpg files of the collection.")
 	parser.add_argument('-i', '--input', action="store", required=True, help="Directory where the .txt and .prob files are located.")
+	parser.add_argument('-e', '--engine', action="store", default="", help="Engine of the text files, when they are stored in line containers.")
 	parser.add_argument('-o', '--output', action="store", required=True, help="Destination directory where the labels will be copied.")
 	args = parser.parse_args()
 
@@ -58,11 +60,14 @@ if __name__ == '__main__':
 	for root, dirs, filenames in os.walk( args.reference ):
 		filename_list = list(f for f in filenames if f.endswith('.jpg'))
 
+	# Text files of the lines (plain files or stored in line containers)
+	txt_list = line_container.list_files( args.input, '.txt', args.engine )
+
 	# Execution
 	for filename in filename_list:
 		basename = filename[:-4]
 		# List of text files generated for the image
-		lines_list = glob.glob( args.input + "/" + basename + "*.txt")
+		lines_list = [ f for f in txt_list if f.startswith( basename ) ]
 		lines_list.sort()
 
 		# Construction of the label
@@ -70,7 +75,7 @@ if __name__ == '__main__':
 		i = 0  
 		while i<len(lines_list):
 			line_filename = lines_list[i]
-			with open(lines_list[i]) as f_line:
+			with line_container.open_text( args.input, lines_list[i], args.engine ) as f_line:
 				label += f_line.read() + "\n"
 			i = i + 1
 		if len(label)>0:
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Cascade of the OCR engines over the cropped lines of a folder, instead of running every
+# engine over every line. The engines run in the order of --order (the cheapest first; the
+# Google results are already computed by get_lines_google.py, so they cost nothing here):
+#   1. The first engine recognizes all the lines. A line whose mean per-symbol confidence
+#      (computed as getLinesAccepted.getConfidence) reaches the threshold is accepted.
+#   2. The second engine only recognizes the other lines. If both engines give the same
+#      text, the line is accepted when both confidences are over 0.9 (getLinesAccepted.py)
+#      and rejected otherwise.
+#   3. The third engine only recognizes the lines where the first two disagree, and the
+#      rules of getLinesAccepted.py decide over the three engines.
+#   OCRopus runs as ocropusDir_mt.py (binarization to a temporary folder, and one
+# ocropus-rpred process per line, or both in memory with -ip) and Tesseract as tessDir_mt.py, writing
+# their .txt and .prob files to their folders. The accepted lines
+# are written with the format of getLinesAccepted.py (-1 for the engines which did not run).
+#   The report shows the engine-seconds spent and saved per engine. With --compare, the
+# skipped engines are also run over the skipped lines (to measure the seconds saved, and
+# the accepted/rejected split of the full ensemble against the cascade).
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, sys, time
+import multiprocessing
+import worker_profile
+import getLinesAccepted, job_scheduler, line_container, ocropusDir_mt, ocropus_batch, tessDir_mt, triage_lines
+
+N_THREADS = worker_profile.jobs( "cascadeDir_mt", multiprocessing.cpu_count() )
+# Engines, in the order of the columns of the accepted lines (getLinesAccepted.py)
+ENGINES = [ "ocropus", "tesseract", "google" ]
+# Mean confidence of the first engine to accept a line by itself
+THRESHOLD = 0.95
+# Mean confidence of each of two matching engines to accept a line (getLinesAccepted.py)
+ACCEPT_CONF = 0.9
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def run_engine( engine, filenames, args, dirs, with_containers ):
+	""" Runs an engine over the lines, in args.jobs processes. Returns the engine-seconds (the elapsed time multiplied by the
+	number of concurrent processes). The Google results are read from their folder (0 seconds).
+	"""
+	if engine == "google" or len(filenames) == 0:
+		return 0.0
+
+	if engine == "ocropus" and not args.in_process:
+		start = time.time()
+		result_files, failed, quarantine = ocropusDir_mt.recognize_rpred( args.input_folder, filenames, args.model_folder, args.model_name, True, dirs[engine],
+			dirs[engine], dirs[engine], False, with_containers, False, args.jobs, args.time_limit, args.retries, "", args.chunk_size )
+		for filename in failed:
+			print("Error: " + engine + ": " + filename)
+		if len(result_files) > 0:
+			line_container.write_files( dirs[engine], result_files, engine, True )
+		return ( time.time() - start ) * min( max(1, args.jobs), len(filenames) )
+
+	if engine == "ocropus":
+		function, initializer = ocropusDir_mt.process_lines, ocropusDir_mt.init_worker
+		initargs = ( args.model_folder + "/" + args.model_name, args.input_folder, dirs[engine], dirs[engine], dirs[engine], True, False, with_containers, max(1, args.batch_size) )
+	else:
+		function, initializer = tessDir_mt.tesseract_lines, tessDir_mt.init_worker
+		initargs = ( args.input_folder, dirs[engine], dirs[engine], with_containers )
+
+	start = time.time()
+	result_files = []
+	chunks = [ filenames[i:i + max(1, args.chunk_size)] for i in range( 0, len(filenames), max(1, args.chunk_size) ) ]
+	for chunk, results, error in job_scheduler.run_tasks( function, chunks, args.jobs, args.time_limit, args.retries, initializer, initargs ):
+		if error != "":
+			print("Error: " + engine + ": " + ", ".join( chunk ) + ": " + error)
+			continue
+		# The list of (filename, result files, error message or "") of the lines (OCRopus)
+		for filename, files_list, error in ( results if results is not None else [] ):
+			if error != "":
+				print("Error: " + engine + ": " + filename)
+			else:
+				result_files.extend( files_list )
+	if len(result_files) > 0:
+		# In the containers of the folder of the engine, as Tesseract writes its results (read by read_results)
+		line_container.write_files( dirs[engine], result_files, engine, True )
+	return ( time.time() - start ) * min( max(1, args.jobs), len(filenames) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_results( engine, filenames, dirs, with_containers ):
+	""" Returns {filename: (text, number of symbols, mean confidence)} of the lines with a probabilities file of the engine.
+	"""
+	results = {}
+	for filename in filenames:
+		prob_filename = filename.split('.')[0] + ".prob"
+		try:
+			results[ filename ] = getLinesAccepted.getConfidence( dirs[engine], prob_filename, engine if with_containers else "" )
+		except IOError:
+			continue
+	return results
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def ensemble_decision( results ):
+	""" Rules of getLinesAccepted.py over the results {engine: (text, n, confidence)} of a line: two engines with the same
+	text and both confidences over ACCEPT_CONF, or the three engines with the same text. Returns the engine whose text is
+	accepted, or None.
+	"""
+	names = [ e for e in ENGINES if e in results ]
+	for i in range( len(names) ):
+		for j in range( i + 1, len(names) ):
+			ri, rj = results[ names[i] ], results[ names[j] ]
+			if ri[0] == rj[0] and ri[2] > ACCEPT_CONF and rj[2] > ACCEPT_CONF:
+				return names[i]
+	if len(names) == 3 and len( set( results[e][0] for e in names ) ) == 1:
+		return names[0]
+	return None
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def accepted_line( filename, results, engine ):
+	""" Line of the accepted lines file (getLinesAccepted.py format) of a line accepted with the text of the engine.
+	"""
+	confs = [ str( results[e][2] ) if e in results else "-1" for e in ENGINES ]
+	return filename.split('.')[0] + ".prob\t" + str( results[engine][1] ) + "\t" + "\t".join( confs ) + "\t" + results[engine][0] + "\n"
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" MAIN """
+	parser = argparse.ArgumentParser("Runs a cascade of the OCR engines over the cropped lines of a folder, and writes the accepted lines.")
+	parser.add_argument('-if', '--input_folder', action="store", required=True, help="Directory with the jpg files of the lines (or line containers).")
+	parser.add_argument('-eo', '--order', action="store", default="google,ocropus,tesseract", help="Order of the engines (comma separated), the cheapest first.")
+	parser.add_argument('-th', '--threshold', action="store", type=float, default=THRESHOLD, help="Mean confidence of the first engine to accept a line without running the others.")
+	parser.add_argument('-od', '--ocropus_dir', action="store", default="", help="Directory of the OCRopus text and probabilities files (default: the input folder).")
+	parser.add_argument('-td', '--tesseract_dir', action="store", default="", help="Directory of the Tesseract text and probabilities files (default: the input folder).")
+	parser.add_argument('-gd', '--google_dir', action="store", default="", help="Directory of the Google probabilities files (default: the input folder).")
+	parser.add_argument('-mf', '--model_folder', action="store", default="", help="Directory where the OCRopus model is stored.")
+	parser.add_argument('-mn', '--model_name', action="store", default="", help="Filename of the OCRopus model.")
+	parser.add_argument('-o', '--output', action="store", required=True, help="Path + Filename of the accepted lines (getLinesAccepted.py format).")
+	parser.add_argument('-c', '--compare', action="store_true", help="Also run the skipped engines over the skipped lines, and compare the cascade with the full ensemble.")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=N_THREADS, help="Maximum number of concurrent processes.")
+	parser.add_argument('-sk', '--skip_list', action="store", default="", help="Skip list of the lines which are not processed (see triage_lines.py).")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=16, help="Number of lines sent to each process at once.")
+	parser.add_argument('-ip', '--in_process', action="store_true", help="Recognize the OCRopus lines in processes which load the model once with ocrolib (it must be importable by this Python interpreter), instead of one ocropus-rpred process per line.")
+	parser.add_argument('-bs', '--batch_size', action="store", type=int, default=ocropus_batch.MAX_BATCH, help="Maximum number of lines of similar width recognized at once by OCRopus with -ip.")
+	parser.add_argument('-tl', '--time_limit', action="store", type=float, default=ocropusDir_mt.TIME_LIMIT, help="Seconds a line may take before its process is killed and replaced (0: no limit).")
+	parser.add_argument('-rt', '--retries', action="store", type=int, default=1, help="Times a line over the time limit is tried again.")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	order = [ e.strip() for e in args.order.split(',') ]
+	if sorted( order ) != sorted( ENGINES ):
+		print('Error: The order must contain the three engines: ' + ", ".join( ENGINES ) + '.\n')
+		parser.print_help()
+		sys.exit(1)
+	if ( not os.path.isdir( args.input_folder ) ):
+		print('Error: The directory of the jpg files was not found.\n')
+		parser.print_help()
+		sys.exit(2)
+	if ( not os.path.isfile( args.model_folder + "/" + args.model_name ) ):
+		print('Error: The OCRopus model file was not found.\n')
+		parser.print_help()
+		sys.exit(3)
+
+	dirs = {}
+	for engine, dir_name in [ ("ocropus", args.ocropus_dir), ("tesseract", args.tesseract_dir), ("google", args.google_dir) ]:
+		dirs[ engine ] = dir_name if dir_name != "" else args.input_folder
+		if not os.path.exists( dirs[engine] ):
+			try:
+				os.makedirs( dirs[engine] )
+			except:
+				print('Error: The directory of the ' + engine + ' files (' + dirs[engine] + ') was not found and could not be created.\n')
+				parser.print_help()
+				sys.exit(4)
+
+	with_containers = len( line_container.list_containers( args.input_folder ) ) > 0
+	skip = triage_lines.load_skip_list( args.skip_list )
+	files = job_scheduler.walk_files( args.input_folder, '.jpg' ) + line_container.list_files( args.input_folder, '.jpg' )
+	files = sorted(set(f for f in files if os.path.basename(f)[:-4] not in skip))
+	for sub_dir in set( os.path.dirname(f) for f in files ):
+		for engine in [ "ocropus", "tesseract" ]:
+			if sub_dir != "" and not os.path.exists( dirs[engine] + "/" + sub_dir ):
+				os.makedirs( dirs[engine] + "/" + sub_dir )
+
+	# Cascade: each engine only runs over the lines which the previous ones could not decide
+	seconds = {}
+	ran = {}
+	results = { f: {} for f in files }
+	pending = files
+	accepted = {}
+	for stage, engine in enumerate( order ):
+		seconds[ engine ] = run_engine( engine, pending, args, dirs, with_containers )
+		ran[ engine ] = set( pending )
+		for filename, result in read_results( engine, pending, dirs, with_containers ).items():
+			results[ filename ][ engine ] = result
+
+		undecided = []
+		for filename in pending:
+			line_results = results[ filename ]
+			if stage == 0:
+				if engine in line_results and line_results[engine][2] >= args.threshold:
+					accepted[ filename ] = engine
+				else:
+					undecided.append( filename )
+			elif stage == 1:
+				first, second = line_results.get( order[0] ), line_results.get( engine )
+				if first is not None and second is not None and first[0] == second[0]:
+					decision = ensemble_decision( line_results )
+					if decision is not None:
+						accepted[ filename ] = decision
+				else:
+					undecided.append( filename )
+			else:
+				decision = ensemble_decision( line_results )
+				if decision is not None:
+					accepted[ filename ] = decision
+		pending = undecided
+
+	with open( args.output, 'w' ) as f:
+		for filename in files:
+			if filename in accepted:
+				f.write( accepted_line( filename, results[filename], accepted[filename] ) )
+
+	# Report: seconds per engine, and seconds saved (estimated with the seconds per line, or measured with --compare)
+	print("Lines: " + str(len(files)) + ", accepted: " + str(len(accepted)) + ", rejected: " + str(len(files) - len(accepted)))
+	print("%-12s %10s %12s %10s %10s %16s" % ("engine", "lines", "seconds", "s/line", "skipped", "seconds saved"))
+	saved_total = 0.0
+	for engine in order:
+		skipped = [ f for f in files if f not in ran[engine] ]
+		per_line = seconds[engine] / len(ran[engine]) if len(ran[engine]) > 0 else 0.0
+		if args.compare:
+			saved = run_engine( engine, skipped, args, dirs, with_containers )
+			for filename, result in read_results( engine, skipped, dirs, with_containers ).items():
+				results[ filename ][ engine ] = result
+		else:
+			saved = per_line * len(skipped)
+		saved_total += saved
+		print("%-12s %10d %12.2f %10.4f %10d %16.2f" % (engine, len(ran[engine]), seconds[engine], per_line, len(skipped), saved))
+	print("Engine-seconds: " + ( "%.2f" % sum( seconds.values() ) ) + ", saved: " + ( "%.2f" % saved_total ) + ( "" if args.compare else " (estimated)" ))
+
+	if args.compare:
+		full = set( f for f in files if ensemble_decision( results[f] ) is not None )
+		cascade = set( accepted )
+		print("Full ensemble: accepted: " + str(len(full)) + ", rejected: " + str(len(files) - len(full)))
+		print("Accepted by both: " + str(len(full & cascade)) + ", only by the cascade: " + str(len(cascade - full)) + ", only by the full ensemble: " + str(len(full - cascade)))
+		different = [ f for f in full & cascade if results[f][ accepted[f] ][0] != results[f][ ensemble_decision( results[f] ) ][0] ]
+		print("Accepted by both with a different text: " + str(len(different)))
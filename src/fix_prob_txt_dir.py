@@ -23,6 +23,7 @@
 import argparse, os, sys
 import pandas as pd
 from Bio import pairwise2
+import line_container, prob_io
 
 # pip3 install biopython
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -74,6 +75,8 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser("Makes the probability file consistent with the text file.")
 	parser.add_argument('-sd', '--srcdir', action="store", required=True, help="Directory where the text and probability files are located.")
 	parser.add_argument('-dd', '--dstdir', action="store", required=True, help="Directory where the new or corrected text and probability files will be saved.")
+	parser.add_argument('-e', '--engine', action="store", default="", help="Engine of the text and probability files, when they are stored in line containers.")
+	parser.add_argument('-ce', '--container_engine', action="store", default="", help="Save the new files in this folder of the line containers of the destination directory (default: plain files).")
 	args = parser.parse_args()
 
 	# Arguments Validations
@@ -91,9 +94,7 @@ if __name__ == '__main__':
 			sys.exit(2)
 
 	# Create the lists of files to process
-	files_list = list()
-	for root, dirs, filenames in os.walk( args.srcdir ):
-		files_list = list(f for f in filenames if f.endswith('.txt'))
+	files_list = line_container.list_files( args.srcdir, '.txt', args.engine )
 
 	# Process each text file
 	j = 0
@@ -106,7 +107,7 @@ if __name__ == '__main__':
 		# Load the text file in a list
 		text_string = ""
 		f_text = None
-		with open( txt_path_filename ) as f_text:
+		with line_container.open_text( args.srcdir, filename, args.engine ) as f_text:
 			lines = [line.rstrip('\n').rstrip(' ') for line in f_text]
 
 		i = 0
@@ -125,23 +126,7 @@ if __name__ == '__main__':
 		text_list = list( text_string )
 		##########################################################
 		# Load the probability file in two lists
-		symbols_list = []
-		prob_list = []
-		f_prob = None
-		with open( prob_path_filename ) as f_prob: 
-			for line in f_prob:
-				try:
-					symbol, prob = line.rstrip('\n').split("\t")
-					if symbol != '':
-						if len(symbol) > 1:
-							for c in symbol:
-								symbols_list.append( c )
-								prob_list.append( float(prob) )
-						else:
-							symbols_list.append( symbol )
-							prob_list.append( float(prob) )
-				except:
-					break
+		symbols_list, prob_list = prob_io.characters( *prob_io.read_prob( args.srcdir, filename[:-4] + ".prob", args.engine ) )
 
 		size_text_list = len(text_list)
 		size_symbols_list = len(symbols_list)
@@ -240,9 +225,6 @@ if __name__ == '__main__':
 		# ----------------------------------------------------------------------------------
 		if not b_error_found:
 			# Save the new text and probability files
-			new_txt_path_filename = args.dstdir + "/" + filename
-			new_prob_path_filename = args.dstdir + "/" + (filename[:-4] + ".prob")
-
 			# Replace 2 spaces by one single space and create final strings
 			final_text = ""
 			final_prob = ""
@@ -261,11 +243,11 @@ if __name__ == '__main__':
 				i = i + 1
 
 			f_new_txt = None
-			with open( new_txt_path_filename, "w+" ) as f_new_txt:
+			with line_container.open_write( args.dstdir, filename, args.container_engine, args.container_engine != "" ) as f_new_txt:
 				f_new_txt.write( final_text )
 
 			f_new_prob = None
-			with open( new_prob_path_filename, "w+" ) as f_new_prob:
+			with line_container.open_write( args.dstdir, filename[:-4] + ".prob", args.container_engine, args.container_engine != "" ) as f_new_prob:
 				f_new_prob.write( final_prob )
 
 			j = j + 1
@@ -21,40 +21,27 @@
 ##########################################################################################
 
 import argparse, io, os, sys
+import prob_cache, prob_io
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
-def getConfidence( probPathFilename ):
+def getConfidence( probPath, probFilename, engine="" ):
 	""" Given a probabilities file: .prob, returns the number of symbols 
 	and their average confidence.
 
-	:type probPathFilename: string
-	:param probPathFilename: 
+	:type probPath: string
+	:param probPath: Directory of the file (or of the line container of its image)
+	:type probFilename: string
+	:param probFilename: 
+	:type engine: string
+	:param engine: Folder of the file inside the line container
 	"""
-	# Read file
-	lines = []		# List of lines of the file
-	with open( probPathFilename ) as f:
-		lines = [line.rstrip() for line in f]
-
-	# Compute the summation of the uncertainty
-	sum = 0.0
-	n = 0
-	text = ""
-	text_s = ""
-	for line in lines:
-		words = line.split('\t')
-		if words[0] != ' ':
-			text = text + words[0]
-			text_s = text_s + words[0]
-			if ( len(words) > 1 ):		
-				sum = sum + float(words[1])
-				n = n + 1
-		else:
-			text_s = text_s + " "
+	# Read the file (text or binary format) and compute the average probability of the non-space symbols
+	text, text_s, n, mean = prob_io.confidence( *prob_cache.read_prob( probPath, probFilename, engine ) )
 
 	if n == 0:
 		return "", "", 0, 0.0
 	else: 
-		return text, text_s, n, sum/n
+		return text, text_s, n, mean
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
@@ -64,6 +51,10 @@ if __name__ == '__main__':
 	parser.add_argument('-i1', '--input1', action="store", required=True, help="Directory where the first probability files are located.")
 	parser.add_argument('-i2', '--input2', action="store", required=True, help="Directory where the second group of probability files are located.")
 	parser.add_argument('-i3', '--input3', action="store", required=True, help="Directory where the third group of probability files are located.")
+	parser.add_argument('-e1', '--engine1', action="store", default="ocropus", help="Engine of the first probability files, when they are stored in line containers.")
+	parser.add_argument('-e2', '--engine2', action="store", default="tesseract", help="Engine of the second group of probability files, when they are stored in line containers.")
+	parser.add_argument('-e3', '--engine3', action="store", default="google", help="Engine of the third group of probability files, when they are stored in line containers.")
+	parser.add_argument('-pc', '--prob_cache', action="store", default="", help="Folder of the columnar caches of the probabilities files (see prob_cache.py); they are built the first time and rebuilt when the files change.")
 	parser.add_argument('-o', '--output', action="store", required=True, help="Path and filename of the text file which will store the result and confidence in both directories.")
 	args = parser.parse_args()
 
@@ -83,20 +74,18 @@ if __name__ == '__main__':
 		parser.print_help()
 		sys.exit(1)
 
+	# Columnar caches of the probabilities files (see prob_cache.py)
+	if args.prob_cache != "":
+		prob_cache.open_caches( [ (args.input1, args.engine1), (args.input2, args.engine2), (args.input3, args.engine3) ], args.prob_cache )
+
 	# Create the lists of files to process
-	files_list1 = list()
-	for root, dirs, filenames in os.walk( args.input1 ):
-		files_list1 = list(f for f in filenames if f.endswith('.prob'))
+	files_list1 = prob_cache.list_files( args.input1, args.engine1 )
 	n1 = len(files_list1)
 
-	files_list2 = list()
-	for root, dirs, filenames in os.walk( args.input2 ):
-		files_list2 = list(f for f in filenames if f.endswith('.prob'))
+	files_list2 = prob_cache.list_files( args.input2, args.engine2 )
 	n2 = len(files_list2)
 
-	files_list3 = list()
-	for root, dirs, filenames in os.walk( args.input3 ):
-		files_list3 = list(f for f in filenames if f.endswith('.prob'))
+	files_list3 = prob_cache.list_files( args.input3, args.engine3 )
 	n3 = len(files_list3)
 
 	files_set1 = set( files_list1 )
@@ -112,9 +101,9 @@ if __name__ == '__main__':
 		i = 0
 		while i<len(files_list123):
 			filename = files_list123[i]
-			s1, s1_s, l1, a1 = getConfidence( args.input1 + "/" + filename )
-			s2, s2_s, l2, a2 = getConfidence( args.input2 + "/" + filename )
-			s3, s3_s, l3, a3 = getConfidence( args.input3 + "/" + filename )
+			s1, s1_s, l1, a1 = getConfidence( args.input1, filename, args.engine1 )
+			s2, s2_s, l2, a2 = getConfidence( args.input2, filename, args.engine2 )
+			s3, s3_s, l3, a3 = getConfidence( args.input3, filename, args.engine3 )
 
 			if (s1 == s3) and (s2 == s3) and l1 > 1 and a1 > 0.7 and a2 > 0.7 and a3 > 0.7:
 				s = filename + "\t" + str(l1) + "\t" + str(a1) + "\t" + str(a2) + "\t" + str(a3) + "\t" + s2_s + "\n"
@@ -23,36 +23,27 @@
 ##########################################################################################
 
 import argparse, io, os, sys
+import line_container, prob_cache, prob_io, triage_lines
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
-def getConfidence( probPathFilename ):
+def getConfidence( probPath, probFilename, engine="" ):
 	""" Given a probabilities file: .prob, returns the number of symbols 
 	and their average confidence.
 
-	:type probPathFilename: string
-	:param probPathFilename: 
+	:type probPath: string
+	:param probPath: Directory of the file (or of the line container of its image)
+	:type probFilename: string
+	:param probFilename: 
+	:type engine: string
+	:param engine: Folder of the file inside the line container
 	"""
-	# Read file
-	lines = []		# List of lines of the file
-	with open( probPathFilename ) as f:
-		lines = [line.rstrip() for line in f]
-
-	# Compute the summation of the uncertainty
-	sum = 0.0
-	n = 0
-	text = ""
-	for line in lines:
-		words = line.split('\t')
-		if words[0] != ' ':
-			text = text + words[0]
-			if ( len(words) > 1 ):		
-				sum = sum + float(words[1])
-				n = n + 1
+	# Read the file (text or binary format) and compute the average probability of the non-space symbols
+	text, text_s, n, mean = prob_io.confidence( *prob_cache.read_prob( probPath, probFilename, engine ) )
 
 	if n == 0:
 		return "", 0, 0.0
 	else: 
-		return text, n, sum/n
+		return text, n, mean
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
@@ -63,6 +54,11 @@ if __name__ == '__main__':
 	parser.add_argument('-i1', '--input1', action="store", required=True, help="Directory where the first probability files are located.")
 	parser.add_argument('-i2', '--input2', action="store", required=True, help="Directory where the second group of probability files are located.")
 	parser.add_argument('-i3', '--input3', action="store", required=True, help="Directory where the third group of probability files are located.")
+	parser.add_argument('-e1', '--engine1', action="store", default="ocropus", help="Engine of the first probability files, when they are stored in line containers.")
+	parser.add_argument('-e2', '--engine2', action="store", default="tesseract", help="Engine of the second group of probability files, when they are stored in line containers.")
+	parser.add_argument('-e3', '--engine3', action="store", default="google", help="Engine of the third group of probability files, when they are stored in line containers.")
+	parser.add_argument('-pc', '--prob_cache', action="store", default="", help="Folder of the columnar caches of the probabilities files (see prob_cache.py); they are built the first time and rebuilt when the files change.")
+	parser.add_argument('-sk', '--skip_list', action="store", default="", help="Skip list of the lines which were not processed by the OCR engines (see triage_lines.py); they are always rejected.")
 	parser.add_argument('-o', '--output', action="store", required=True, help="Path and filename of the text file which will store the result and confidence in both directories.")
 	args = parser.parse_args()
 
@@ -87,25 +83,21 @@ if __name__ == '__main__':
 		parser.print_help()
 		sys.exit(1)
 
+	# Columnar caches of the probabilities files (see prob_cache.py)
+	if args.prob_cache != "":
+		prob_cache.open_caches( [ (args.input1, args.engine1), (args.input2, args.engine2), (args.input3, args.engine3) ], args.prob_cache )
+
 	# Create the lists of files to process
-	files_list0 = list()
-	for root, dirs, filenames in os.walk( args.input0 ):
-		files_list0 = list(f[:-4] + ".prob" for f in filenames if f.endswith('.jpg'))
+	files_list0 = list(f[:-4] + ".prob" for f in line_container.list_files( args.input0, '.jpg' ))
 	n0 = len(files_list0)
 
-	files_list1 = list()
-	for root, dirs, filenames in os.walk( args.input1 ):
-		files_list1 = list(f for f in filenames if f.endswith('.prob'))
+	files_list1 = prob_cache.list_files( args.input1, args.engine1 )
 	n1 = len(files_list1)
 
-	files_list2 = list()
-	for root, dirs, filenames in os.walk( args.input2 ):
-		files_list2 = list(f for f in filenames if f.endswith('.prob'))
+	files_list2 = prob_cache.list_files( args.input2, args.engine2 )
 	n2 = len(files_list2)
 
-	files_list3 = list()
-	for root, dirs, filenames in os.walk( args.input3 ):
-		files_list3 = list(f for f in filenames if f.endswith('.prob'))
+	files_list3 = prob_cache.list_files( args.input3, args.engine3 )
 	n3 = len(files_list3)
 
 	files_set0 = set( files_list0 )
@@ -113,6 +105,16 @@ if __name__ == '__main__':
 	files_set2 = set( files_list2 )
 	files_set3 = set( files_list3 )
 
+	# The lines of the skip list are rejected, whatever the engines that processed them
+	skip = triage_lines.load_skip_list( args.skip_list )
+	files_set_skipped = set( f for f in files_set0 if f[:-5] in skip )
+	files_list_skipped = sorted( files_set_skipped )
+	files_set_skipped3 = files_set3 & files_set_skipped
+	files_set0 = files_set0 - files_set_skipped
+	files_set1 = files_set1 - files_set_skipped
+	files_set2 = files_set2 - files_set_skipped
+	files_set3 = files_set3 - files_set_skipped
+
 	# Set of files with no value extracted in any OCR
 	files_set_no_file = files_set0 - files_set1 - files_set2 - files_set3
 	files_list_no_file = list(files_set_no_file)
@@ -141,10 +143,18 @@ if __name__ == '__main__':
 			f.write( s )
 			i = i + 1
 
+		# Skipped lines: with the text and confidence of Google, if available
+		for filename in files_list_skipped:
+			if filename in files_set_skipped3:
+				s3, l3, a3 = getConfidence( args.input3, filename, args.engine3 )
+				f.write( filename + "\t" + str(l3) + "\t-1\t-1\t" + str(a3) + "\t" + s3 + "\n" )
+			else:
+				f.write( filename + "\t0\t-1\t-1\t-1\t?\n" )
+
 		i = 0
 		while i<len(files_list_1_only):
 			filename = files_list_1_only[i]
-			s1, l1, a1 = getConfidence( args.input1 + "/" + filename )
+			s1, l1, a1 = getConfidence( args.input1, filename, args.engine1 )
 			if a1 < 0.7 or l1 < 4:
 				s = filename + "\t" + str(l1) + "\t" + str(a1) + "\t-1\t-1\t" + s1 + "\n"
 				f.write( s )
@@ -153,7 +163,7 @@ if __name__ == '__main__':
 		i = 0
 		while i<len(files_list_2_only):
 			filename = files_list_2_only[i]
-			s2, l2, a2 = getConfidence( args.input2 + "/" + filename )
+			s2, l2, a2 = getConfidence( args.input2, filename, args.engine2 )
 			if a2 < 0.7 or l2 < 4:
 				s = filename + "\t" + str(l2) + "\t-1\t" + str(a2) + "\t-1\t" + s2 + "\n"
 				f.write( s )
@@ -162,7 +172,7 @@ if __name__ == '__main__':
 		i = 0
 		while i<len(files_list_3_only):
 			filename = files_list_3_only[i]
-			s3, l3, a3 = getConfidence( args.input3 + "/" + filename )
+			s3, l3, a3 = getConfidence( args.input3, filename, args.engine3 )
 			if a3 < 0.7 or l3 < 4:
 				s = filename + "\t" + str(l3) + "\t-1\t-1\t" + str(a3) + "\t" + s3 + "\n"
 				f.write( s )
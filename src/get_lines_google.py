@@ -5,6 +5,9 @@
 #   Given an image, it uses the Google Cloud Vision API output to extract the text in lines. 
 # In a folder, the cropped lines in jpg format, as well as their correspond extracted text.
 # In a summary output file, the list of cropped lines and their coordinated are stored.
+# The Google responses can be kept in a cache directory (keyed by the SHA-256 of the image 
+# bytes), so later runs over the same images replay the stored response instead of calling 
+# the API. With --replay_only no API call is made at all.
 # PRE-REQUISITE: (Google Credentials). Run something like the following to indicate the user 
 # and project that will be used in the Google Cloud:
 #       export GOOGLE_APPLICATION_CREDENTIALS="/home/user/Google/credential_file.json"
@@ -26,59 +29,123 @@
 # limitations under the License.
 ##########################################################################################
 
-import argparse, io, os, sys
+import argparse, hashlib, io, math, os, sys, threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from google.cloud import vision
 from google.cloud.vision import types
 from PIL import Image
+import numpy as np
+import image_access, line_container, line_manifest
 breaks = vision.enums.TextAnnotation.DetectedBreak.BreakType
 
+ENCODE_THREADS = multiprocessing.cpu_count()
+# Images bigger than the limit of the Google API are sent in overlapping horizontal tiles (bands)
+MAX_CONTENT_BYTES = 10485760
+TILE_OVERLAP = 256
+TILE_QUALITY = 95
+# Lines of adjacent tiles are duplicates when their intersection covers this fraction of the smaller one
+DUPLICATE_RATIO = 0.5
+encoder = None
+encoder_lock = threading.Lock()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_encoder():
+	""" Returns the thread pool shared by all the images to encode the cropped lines (PIL releases the GIL while encoding).
+	"""
+	global encoder
+	with encoder_lock:
+		if encoder is None:
+			encoder = ThreadPoolExecutor( max_workers=ENCODE_THREADS )
+	return encoder
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def encode_line( img_cropped, line_filename, img_format, quality ):
+	""" Encodes and saves the cropped line (a numpy array). If line_filename is None, 
+	the encoded bytes are returned instead of saved.
+	"""
+	output = line_filename
+	if line_filename is None:
+		output = io.BytesIO()
+
+	pil_line = Image.fromarray( img_cropped )
+	if img_format == "png":
+		# Lossless grayscale
+		pil_line.convert('L').save( output, 'PNG', compress_level=1 )
+	else:
+		pil_line.save( output, 'JPEG', quality = quality )
+
+	if line_filename is None:
+		return output.getvalue()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def crop_rectangle( box, width, height ):
+	""" Rectangle [x1, y1, x2, y2] of the crop of a line: its bounding box with a margin, inside the image.
+	"""
+	# Left Upper Corner
+	x1 = box[0]
+	x1 = x1 - 8
+	if x1 < 0:
+		x1 = 0
+
+	y1 = box[1]
+	y1 = y1 - 1
+	if y1 < 0:
+		y1 = 0
+
+	# Right Lower Corner
+	x2 = box[2]
+	x2 = x2 + 10
+	if x2 > (width - 1):
+		x2 = width - 1
+
+	y2 = box[3]
+	y2 = y2 + 1
+	if y2 > (height - 1):
+		y2 = height - 1
+	return [ x1, y1, x2, y2 ]
+
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
-def crop_save(  img_path_filename, lines_boxes, lines_texts, lines_probs, filename, basename, output_dir_name ):
+def crop_save(  img_path_filename, lines_boxes, lines_texts, lines_probs, filename, basename, output_dir_name, img_format="jpg", quality=100, crops=None, container=False ):
 	""" Crop and save the image for each line, its text files, and its probabilities files. It also returns the bbox statistics.
+	The image is decoded once, and only down to the lowest line; the crops of the lines are copied from it, and encoded in parallel as jpg (with the given
+	quality), as grayscale png, or not at all ("none"). If a crops dictionary is given, the lines' arrays are also stored in it.
+	With "none" the lines only exist in memory: they are named <basename>_NNN, without an extension, in the crops dictionary,
+	the _lines.csv file, and the global text file (or manifest), so no row names a file that was not written.
+	With container=True all the files are stored in the line container of the image instead of in separated files.
 	"""
-	# Read the image
-	image = Image.open( img_path_filename )
-	# Get image's  size
-	width, height = image.size
+	# Read (decode) the image only once, without the rows below the lines: the crops of the lines (with their margins)
+	width, height = image_access.image_size( img_path_filename )
+	rectangles = [ crop_rectangle( box, width, height ) for box in lines_boxes ]
+	images, ( width, height ) = image_access.read_regions( img_path_filename, rectangles )
+
+	extension = { "png": ".png", "none": "" }.get( img_format, ".jpg" )
+	futures = []
+	# Files of the container: (name, future or content)
+	members = []
 
 	i = 0
 	text_local = ""
 	text_global = ""
 	while i < len(lines_boxes):
-		##################################################################################################
-		# Left Upper Corner
-		x1 = lines_boxes[i][0]
-		x1 = x1 - 8
-		if x1 < 0:
-			x1 = 0
-
-		y1 = lines_boxes[i][1]
-		y1 = y1 - 1
-		if y1 < 0:
-			y1 = 0
-
-		# Right Lower Corner
-		x2 = lines_boxes[i][2]
-		x2 = x2 + 10
-		if x2 > (width - 1):
-			x2 = width - 1
-
-		y2 = lines_boxes[i][3]
-		y2 = y2 + 1
-		if y2 > (height - 1):
-			y2 = height - 1
-
-		# Crop the block and save it
+		x1, y1, x2, y2 = rectangles[i]
+		# Save the crop of the line
 		n_line = "%03d" % (i+1)
-		line_filename = output_dir_name + "/" + basename + "_" + n_line + ".jpg"		
+		line_filename = output_dir_name + "/" + basename + "_" + n_line + extension
 
-		img_cropped = image.crop( (x1, y1, x2, y2) )
-		img_cropped.save( line_filename, 'JPEG', quality = 100 )
+		img_cropped = images[i]
+		if crops is not None:
+			crops[ basename + "_" + n_line + extension ] = img_cropped
+		if img_format != "none":
+			future = get_encoder().submit( encode_line, img_cropped, None if container else line_filename, img_format, quality )
+			futures.append( future )
+			if container:
+				members.append( (basename + "_" + n_line + extension, future) )
 
 		##################################################################################################
 		# Create the information about the cropped line for the local and global text files
-		text_line = basename + "_" + n_line + ".jpg\t" + str(x1) + "\t" + str(y1) + "\t" + str(x2) + "\t" + str(y2) + "\t" + ''.join(lines_texts[i]) + "\n"
+		text_line = basename + "_" + n_line + extension + "\t" + str(x1) + "\t" + str(y1) + "\t" + str(x2) + "\t" + str(y2) + "\t" + ''.join(lines_texts[i]) + "\n"
 		text_local += text_line
 		text_global += filename + "\t" + text_line
 
@@ -91,6 +158,12 @@ def crop_save(  img_path_filename, lines_boxes, lines_texts, lines_probs, filena
 			content_text_file += lines_texts[i][j]
 			content_prob_file += lines_texts[i][j] + '\t' + str(lines_probs[i][j]) + '\n'
 			j = j + 1
+		if container:
+			members.append( (line_container.member_name( basename + "_" + n_line + ".txt", "google" ), content_text_file) )
+			members.append( (line_container.member_name( basename + "_" + n_line + ".prob", "google" ), content_prob_file) )
+			i = i + 1
+			continue
+
 		# Write to disk the text file
 		text_filename = output_dir_name + "/" + basename + "_" + n_line + ".txt"
 		with open( text_filename, "w+" ) as f_text:
@@ -102,126 +175,320 @@ def crop_save(  img_path_filename, lines_boxes, lines_texts, lines_probs, filena
 
 		i = i + 1
 
+	# Wait for the encoding of all the lines (and raise its errors, if any)
+	for future in futures:
+		future.result()
+
+	# All the files of the lines are written at once in the container of the image
+	if container and len(members) > 0:
+		members = [ (name, content.result() if hasattr(content, 'result') else content) for name, content in members ]
+		line_container.write_members( line_container.container_path_filename( output_dir_name, basename ), members )
+
 	return( text_local, text_global )
 
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def document_paragraphs( document ):
+	""" Returns, in order, the paragraphs of all the blocks and pages of the document.
+	"""
+	for page in document.pages:
+		for block in page.blocks:
+			for paragraph in block.paragraphs:
+				yield paragraph
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def flatten_paragraphs( paragraphs ):
+	""" Walks the protobuf symbols only once and returns them as numpy arrays: vertices (n x 4 x 2), break types,
+	confidences, texts, and the number of paragraph each symbol belongs to.
+	"""
+	vertices = []
+	break_types = []
+	confidences = []
+	texts = []
+	paragraph_ids = []
+
+	n_paragraph = 0
+	for paragraph in paragraphs:
+		for word in paragraph.words:
+			for symbol in word.symbols:
+				v = symbol.bounding_box.vertices
+				vertices.append( ( (v[0].x, v[0].y), (v[1].x, v[1].y), (v[2].x, v[2].y), (v[3].x, v[3].y) ) )
+				break_types.append( symbol.property.detected_break.type )
+				confidences.append( symbol.confidence )
+				texts.append( symbol.text )
+				paragraph_ids.append( n_paragraph )
+		n_paragraph = n_paragraph + 1
+
+	vertices = np.array( vertices, dtype=np.int64 ).reshape( -1, 4, 2 )
+	texts_array = np.empty( len(texts), dtype=object )
+	texts_array[:] = texts
+	return( vertices, np.array( break_types, dtype=np.int64 ), np.array( confidences, dtype=np.float64 ), texts_array, np.array( paragraph_ids, dtype=np.int64 ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def assemble_lines( vertices, break_types, confidences, texts, paragraph_ids ):
+	""" Divides the flattened symbols in lines. A line ends in a symbol with an end of line break; the symbols at the end
+	of a paragraph which are not followed by such a break are discarded. The bounding boxes are computed with segmented 
+	min/max reductions and a blank space (probability 0.95) is added after the symbols followed by a space.
+	Returns lists of bounding boxes, lines' text, and lines' probabilities.
+	"""
+	# Last symbol of each line
+	ends = np.flatnonzero( np.isin( break_types, [ breaks.EOL_SURE_SPACE, breaks.HYPHEN, breaks.LINE_BREAK ] ) )
+	if len(ends) == 0:
+		return( [], [], [] )
+
+	# First symbol of each line: after the previous end, but never before the beginning of its paragraph
+	previous_ends = np.concatenate( ( [0], ends[:-1] + 1 ) )
+	paragraph_starts = np.searchsorted( paragraph_ids, paragraph_ids[ends], side='left' )
+	starts = np.maximum( previous_ends, paragraph_starts )
+	lengths = ends - starts + 1
+
+	# Indices of the symbols that belong to a line, and the offset of each line among them
+	offsets = np.concatenate( ( [0], np.cumsum( lengths )[:-1] ) )
+	kept = np.arange( lengths.sum() ) + np.repeat( starts - offsets, lengths )
+
+	# Bounding boxes: x1, y1 (left upper corner) and x2, y2 (right lower corner)
+	v = vertices[ kept ]
+	x1 = np.minimum( np.minimum.reduceat( np.minimum( v[:,0,0], v[:,3,0] ), offsets ), 100000 )
+	y1 = np.minimum( np.minimum.reduceat( np.minimum( v[:,0,1], v[:,1,1] ), offsets ), 100000 )
+	x2 = np.maximum( np.maximum.reduceat( np.maximum( v[:,2,0], v[:,1,0] ), offsets ), 0 )
+	y2 = np.maximum( np.maximum.reduceat( np.maximum( v[:,2,1], v[:,3,1] ), offsets ), 0 )
+	line_box_list = np.stack( ( x1, y1, x2, y2 ), axis=1 ).tolist()
+
+	# Texts and probabilities, with a blank space after the symbols followed by a space
+	is_space = np.isin( break_types[ kept ], [ breaks.SPACE, breaks.SURE_SPACE ] )
+	counts = 1 + is_space
+	line_texts = np.repeat( texts[ kept ], counts )
+	line_probs = np.repeat( confidences[ kept ], counts )
+	space_positions = ( np.cumsum( counts ) - 1 )[ is_space ]
+	line_texts[ space_positions ] = ' '
+	line_probs[ space_positions ] = 0.95
+
+	cuts = np.cumsum( np.add.reduceat( counts, offsets ) )[:-1]
+	line_text_list = [ t.tolist() for t in np.split( line_texts, cuts ) ]
+	line_prob_list = [ p.tolist() for p in np.split( line_probs, cuts ) ]
+
+	return( line_box_list, line_text_list, line_prob_list )
+
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 def process_paragraph( paragraph ):
 	""" The function will return lists of bounding boxes, lines' text, and lines' probabilities
 	"""
-	# Lists of bounding boxes, text, and probabilities
-	line_box_list = []
-	line_text_list = []
-	line_prob_list = []
-
-	# Line under processing
-	current_line_text = []
-	current_line_prob = []
-	# Bounding box temporary variables
-	x1 = 100000
-	y1 = 100000
-	x2 = 0
-	y2 = 0
-
-	for word in paragraph.words:
-		for symbol in word.symbols:
-			# x1, y1 (Left upper corner)
-			if symbol.bounding_box.vertices[0].x < x1:
-				x1 = symbol.bounding_box.vertices[0].x
-			if symbol.bounding_box.vertices[0].y < y1:
-				y1 = symbol.bounding_box.vertices[0].y
-			if symbol.bounding_box.vertices[1].y < y1: 
-				y1 = symbol.bounding_box.vertices[1].y
-			if symbol.bounding_box.vertices[3].x < x1:
-				x1 = symbol.bounding_box.vertices[3].x
-			# x2, y2 (right lower corner)
-			if symbol.bounding_box.vertices[2].x > x2:
-				x2 = symbol.bounding_box.vertices[2].x
-			if symbol.bounding_box.vertices[2].y > y2:
-				y2 = symbol.bounding_box.vertices[2].y
-			if symbol.bounding_box.vertices[1].x > x2:
-				x2 = symbol.bounding_box.vertices[1].x
-			if symbol.bounding_box.vertices[3].y > y2:
-				y2 = symbol.bounding_box.vertices[3].y
-
-			current_line_text.append( symbol.text )
-			current_line_prob.append( symbol.confidence )
-			# Check for blank spaces
-			if symbol.property.detected_break.type in [ breaks.SPACE, breaks.SURE_SPACE ]:
-				current_line_text.append( ' ' )
-				current_line_prob.append( 0.95 )
-			# Check for new lines
-			if symbol.property.detected_break.type in [ breaks.EOL_SURE_SPACE, breaks.HYPHEN, breaks.LINE_BREAK ]:
-				line_box_list.append( [x1, y1, x2, y2] )
-				line_text_list.append( current_line_text )
-				line_prob_list.append( current_line_prob )
-				# Line under processing
-				current_line_text = []
-				current_line_prob = []
-				# Bounding box temporary variables
-				x1 = 100000
-				y1 = 100000
-				x2 = 0
-				y2 = 0
+	return assemble_lines( *flatten_paragraphs( [ paragraph ] ) )
 
-	return( line_box_list, line_text_list, line_prob_list )
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def cache_path_filename( cache_dir, content ):
+	""" Returns the path + filename where the response for the image content is stored in the cache.
+	The key is the SHA-256 of the image bytes; the files are spread in 256 subdirectories.
+	"""
+	key = hashlib.sha256( content ).hexdigest()
+	return cache_dir + "/" + key[:2] + "/" + key + ".pb"
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
-def process_image( img_path_filename, output_dir_name, output_path_filename):
-	""" Crop the text paragraphs and save the information about the cropped files
+def load_response( cache_dir, content ):
+	""" Returns the cached AnnotateImageResponse of the image content, or None if it is not in the cache.
 	"""
-	########################### Google OCR #############################
-	client = vision.ImageAnnotatorClient()
+	if cache_dir == "":
+		return None
 
-	lines_boxes_img = []
-	lines_texts_img = []
-	lines_probs_img = []
+	response_path_filename = cache_path_filename( cache_dir, content )
+	if not os.path.isfile( response_path_filename ):
+		return None
 
-	# Path + Base name for the block files
-	filename = img_path_filename.split('/')[-1]
-	basename = filename.split('.')[0]
+	with open( response_path_filename, 'rb' ) as f:
+		return types.AnnotateImageResponse.FromString( f.read() )
 
-	content = None
-	with io.open( img_path_filename, 'rb' ) as image_file:
-		content = image_file.read()
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_response( cache_dir, content, response ):
+	""" Stores the serialized AnnotateImageResponse of the image content in the cache.
+	The file is written with a temporary name and then renamed, so concurrent runs never read a partial response.
+	"""
+	if cache_dir == "":
+		return
 
-	try:
-		# Process image and recognize its parts and text
-		image = types.Image( content=content )
-		response = client.document_text_detection(image=image)
-		document = response.full_text_annotation
+	response_path_filename = cache_path_filename( cache_dir, content )
+	response_dir = os.path.dirname( response_path_filename )
+	if not os.path.exists( response_dir ):
+		os.makedirs( response_dir, exist_ok=True )
+
+	tmp_path_filename = response_path_filename + "." + str(os.getpid()) + ".tmp"
+	with open( tmp_path_filename, 'wb' ) as f:
+		f.write( response.SerializeToString() )
+	os.replace( tmp_path_filename, response_path_filename )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_response( content, cache_dir="", replay_only=False, client=None ):
+	""" Returns the Google Cloud Vision response for the image content. The cache is checked first; 
+	the API is only called (and its answer stored) when the response is not cached.
+	"""
+	response = load_response( cache_dir, content )
+	if response is not None:
+		return response
+
+	if replay_only:
+		raise Exception("The response is not in the cache (replay only mode).")
+
+	if client is None:
+		client = vision.ImageAnnotatorClient()
+
+	image = types.Image( content=content )
+	response = client.document_text_detection(image=image)
+	# Failed requests are not cached, so they are retried in the next run
+	if response.error.code == 0:
+		save_response( cache_dir, content, response )
+
+	return response
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def make_tiles( img_path_filename, max_bytes=MAX_CONTENT_BYTES, overlap=TILE_OVERLAP ):
+	""" Splits an image in horizontal bands, of the full width and overlapping by overlap pixels (so every line is complete in
+	at least one band), whose jpg encoding fits in max_bytes. Returns a list of (content, x offset, y offset).
+	"""
+	image = Image.open( img_path_filename )
+	if image.mode not in [ 'RGB', 'L' ]:
+		image = image.convert('RGB')
+	image = np.asarray( image )
+	height = image.shape[0]
+
+	n_tiles = max( 2, int( math.ceil( os.stat( img_path_filename ).st_size / float(max_bytes) ) ) )
+	while True:
+		band = int( math.ceil( (height + (n_tiles - 1) * overlap) / float(n_tiles) ) )
+		if band <= 2 * overlap:
+			raise Exception("The image cannot be split in tiles smaller than " + str(max_bytes) + " bytes.")
+		offsets = [ i * (band - overlap) for i in range(n_tiles) ]
+		futures = [ get_encoder().submit( encode_line, image[ y:min(height, y + band) ], None, "jpg", TILE_QUALITY ) for y in offsets ]
+		contents = [ future.result() for future in futures ]
+		largest = max( len(content) for content in contents )
+		if largest <= max_bytes:
+			return [ (content, 0, y) for content, y in zip( contents, offsets ) ]
+		n_tiles = max( n_tiles + 1, int( math.ceil( n_tiles * largest / float(max_bytes) ) ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_tiled_response( img_path_filename, cache_dir="", replay_only=False, client=None, max_bytes=MAX_CONTENT_BYTES, overlap=TILE_OVERLAP ):
+	""" Returns the Google responses of the tiles of an oversized image as a list of (response, x offset, y offset).
+	The tiles are sent concurrently (and cached individually).
+	"""
+	tiles = make_tiles( img_path_filename, max_bytes, overlap )
+	if client is None and not replay_only:
+		client = vision.ImageAnnotatorClient()
+
+	with ThreadPoolExecutor( max_workers=len(tiles) ) as executor:
+		futures = [ executor.submit( get_response, content, cache_dir, replay_only, client ) for content, x, y in tiles ]
+		responses = [ future.result() for future in futures ]
+
+	for response in responses:
+		if response.error.code != 0:
+			raise Exception( response.error.message )
+	return [ (response, x, y) for response, (content, x, y) in zip( responses, tiles ) ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def merge_tiles( tiles ):
+	""" Assembles the lines of each tile, in the coordinates of the full image, and removes the duplicated lines of the
+	overlapping regions: of two lines of adjacent tiles that overlap, the one with more symbols (or the bigger one) is kept.
+	Only the lines inside the overlapping band of two adjacent tiles are compared. Returns the full text and the lists of
+	bounding boxes, lines' text, and lines' probabilities, in the reading order of each tile (tile after tile).
+	"""
+	boxes, texts, probs, tile_lines = [], [], [], []
+	for response, x, y in tiles:
+		vertices, break_types, confidences, symbols, paragraph_ids = flatten_paragraphs( document_paragraphs( response.full_text_annotation ) )
+		tile_boxes, tile_texts, tile_probs = assemble_lines( vertices + np.array( [x, y] ), break_types, confidences, symbols, paragraph_ids )
+		tile_lines.append( np.arange( len(boxes), len(boxes) + len(tile_boxes) ) )
+		boxes.extend( tile_boxes )
+		texts.extend( tile_texts )
+		probs.extend( tile_probs )
+	if len(boxes) == 0:
+		return( "", [], [], [] )
+
+	b = np.array( boxes, dtype=np.float64 ).reshape( -1, 4 )
+	areas = np.maximum( (b[:,2] - b[:,0]) * (b[:,3] - b[:,1]), 1.0 )
+	n_symbols = np.array( [ len(t) for t in texts ] )
+	keep = np.ones( len(boxes), dtype=bool )
+	for n_tile in range( len(tiles) - 1 ):
+		upper, lower = tile_lines[ n_tile ], tile_lines[ n_tile + 1 ]
+		if len(upper) == 0 or len(lower) == 0:
+			continue
+		# The lines of each tile inside the band shared by both tiles (the lower tile starts at its y offset)
+		upper = upper[ b[upper,3] > tiles[ n_tile + 1 ][2] ]
+		lower = lower[ b[lower,1] < b[ tile_lines[ n_tile ], 3 ].max() ]
+		if len(upper) == 0 or len(lower) == 0:
+			continue
+		# Overlap of the pairs of lines (intersection over the area of the smaller line)
+		bu, bl = b[upper], b[lower]
+		inter_w = np.maximum( 0, np.minimum( bu[:,None,2], bl[None,:,2] ) - np.maximum( bu[:,None,0], bl[None,:,0] ) )
+		inter_h = np.maximum( 0, np.minimum( bu[:,None,3], bl[None,:,3] ) - np.maximum( bu[:,None,1], bl[None,:,1] ) )
+		duplicated = inter_w * inter_h / np.minimum( areas[upper][:,None], areas[lower][None,:] ) > DUPLICATE_RATIO
+		# A line is dropped if it duplicates a better one (more symbols, then bigger; the one of the upper tile on ties)
+		upper_better = ( n_symbols[upper][:,None] > n_symbols[lower][None,:] ) | ( ( n_symbols[upper][:,None] == n_symbols[lower][None,:] ) & ( areas[upper][:,None] >= areas[lower][None,:] ) )
+		keep[ upper[ ( duplicated & ~upper_better ).any( axis=1 ) ] ] = False
+		keep[ lower[ ( duplicated & upper_better ).any( axis=0 ) ] ] = False
 
-		fulltext_path_filename = output_dir_name + "/" + basename + ".txt"	
-		# Save all the extracted text in a text file
+	kept = np.flatnonzero( keep )
+	boxes = [ boxes[i] for i in kept ]
+	texts = [ texts[i] for i in kept ]
+	probs = [ probs[i] for i in kept ]
+	fulltext = ''.join( ''.join( t ) + "\n" for t in texts )
+	return( fulltext, boxes, texts, probs )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_lines( img_path_filename, response, output_dir_name, img_format="jpg", quality=100, crops=None, container=False ):
+	""" Divide the Google response of an image in lines, crop and save them with their text and probabilities files
+	(in the line container of the image if container is True). The response can also be the list of (response, x offset,
+	y offset) of the tiles of an oversized image.
+	Returns the information of the lines for the global text file ("" if no line was found).
+	"""
+	# Path + Base name for the block files
+	filename = os.path.basename( img_path_filename )
+	basename = os.path.splitext( filename )[0]
+
+	# Collect the lines, their probabilities, and their bounding boxes (the symbols of all the paragraphs are flattened once)
+	if isinstance( response, list ):
+		fulltext, lines_boxes_img, lines_texts_img, lines_probs_img = merge_tiles( response )
+	else:
+		fulltext = response.full_text_annotation.text
+		lines_boxes_img, lines_texts_img, lines_probs_img = assemble_lines( *flatten_paragraphs( document_paragraphs( response.full_text_annotation ) ) )
+
+	fulltext_path_filename = output_dir_name + "/" + basename + ".txt"	
+	# Save all the extracted text in a text file
+	if container:
+		line_container.write_members( line_container.container_path_filename( output_dir_name, basename ), [ (basename + ".txt", fulltext) ] )
+	else:
 		with open( fulltext_path_filename,'w') as f:
-			f.write( response.full_text_annotation.text )
-
-		# Collect the lines, their probabilities, and their bounding boxes
-		for page in document.pages:
-			for block in page.blocks:
-				for paragraph in block.paragraphs:
-					# Divide the paragraph in lines and get its lines, bounding boxes, and symbols' probabilities
-					lines_boxes_par, lines_texts_par, lines_probs_par = process_paragraph( paragraph )
-					# Extend the line lists
-					lines_boxes_img.extend( lines_boxes_par )
-					lines_texts_img.extend( lines_texts_par )
-					lines_probs_img.extend( lines_probs_par )
-	except Exception as e:
-		print("Error: " + img_path_filename + ", " + str(e))
-		return
+			f.write( fulltext )
 
 	# Crop and save the image for each paragraph, its text files, and its probabilities files. It also returns the bbox statistics.
 	text_local, text_global = "", ""
-	text_local, text_global = crop_save( img_path_filename, lines_boxes_img, lines_texts_img, lines_probs_img, filename, basename, output_dir_name )
+	text_local, text_global = crop_save( img_path_filename, lines_boxes_img, lines_texts_img, lines_probs_img, filename, basename, output_dir_name, img_format, quality, crops, container )
 
-	# Save the bounding box information in the local and in the global file
-	if text_global != "":
-		# Save the data of the lines in the local text file
+	# Save the data of the lines in the local text file
+	if text_global != "" and container:
+		line_container.write_members( line_container.container_path_filename( output_dir_name, basename ), [ (basename + "_lines.csv", text_local) ] )
+	elif text_global != "":
 		with open(output_dir_name + "/" + basename + "_lines.csv", "w+") as f:
 			f.write( text_local )
 
-		# Save the data of the lines in the global text file
-		with open(output_path_filename, "a+") as f:
-			f.write( text_global )
+	return text_global
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def process_image( img_path_filename, output_dir_name, output_path_filename, cache_dir="", replay_only=False, client=None, img_format="jpg", quality=100, container=False, max_bytes=MAX_CONTENT_BYTES, overlap=TILE_OVERLAP ):
+	""" Crop the text paragraphs and save the information about the cropped files. Images bigger than max_bytes (if it is not 0)
+	are sent in tiles.
+	"""
+	content = None
+	with io.open( img_path_filename, 'rb' ) as image_file:
+		content = image_file.read()
+
+	try:
+		########################### Google OCR #############################
+		# Process image and recognize its parts and text (or replay the cached response)
+		if max_bytes > 0 and len(content) > max_bytes:
+			response = get_tiled_response( img_path_filename, cache_dir, replay_only, client, max_bytes, overlap )
+		else:
+			response = get_response( content, cache_dir, replay_only, client )
+		text_global = save_lines( img_path_filename, response, output_dir_name, img_format, quality, None, container )
+	except Exception as e:
+		print("Error: " + img_path_filename + ", " + str(e))
+		return
+
+	# Save the data of the lines in the global text file (or in the manifest)
+	line_manifest.save_global( output_path_filename, text_global )
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
@@ -230,7 +497,14 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser("Extract the lines from a image (jpg) file using Google Cloud Text Detection.")
 	parser.add_argument('-if', '--input_file', action="store", required=True, help="Path + Filename of the jpg image to crop in blocks.")
 	parser.add_argument('-od', '--output_dir', action="store", required=True, help="Directory where the images of the cropped blocks will be saved.")
-	parser.add_argument('-of', '--output_file', action="store", required=True, help="Path + Filename of the text file which will save the coordinates of the cropped lines.")
+	parser.add_argument('-of', '--output_file', action="store", required=True, help="Path + Filename of the text file which will save the coordinates of the cropped lines (a .sqlite or .db extension saves them in a line manifest).")
+	parser.add_argument('-cd', '--cache_dir', action="store", default="", help="Directory where the Google responses are cached (keyed by the hash of the image bytes).")
+	parser.add_argument('-ro', '--replay_only', '--replay-only', action="store_true", help="Only use the cached responses; the Google API is never called.")
+	parser.add_argument('-lf', '--line_format', action="store", default="jpg", choices=["jpg", "png", "none"], help="Format of the cropped lines: jpg, lossless grayscale png, or none. With none no line image is written: only their coordinates (and texts) in the text files or manifest, which tessDir_mt.py --lines crops again from the specimen images.")
+	parser.add_argument('-jq', '--jpeg_quality', action="store", type=int, default=100, help="Quality of the jpg cropped lines (1 to 100).")
+	parser.add_argument('-ct', '--container', action="store_true", help="Store the lines' files in a single per-image line container (<basename>.lines.zip).")
+	parser.add_argument('-mb', '--max_bytes', action="store", type=int, default=MAX_CONTENT_BYTES, help="Images bigger than this size are sent in overlapping tiles (0: never).")
+	parser.add_argument('-to', '--tile_overlap', action="store", type=int, default=TILE_OVERLAP, help="Overlap, in pixels, of the tiles.")
 	args = parser.parse_args()
 
 	# Arguments Validations
@@ -247,5 +521,10 @@ if __name__ == '__main__':
 			parser.print_help()
 			sys.exit(2)
 
+	if args.replay_only and args.cache_dir == "":
+		print('Error: The replay only mode requires a cache directory.\n')
+		parser.print_help()
+		sys.exit(3)
+
 	# Crop the blocks and save the information about the cropped files
-	process_image(args.input_file, args.output_dir, args.output_file)
+	process_image(args.input_file, args.output_dir, args.output_file, args.cache_dir, args.replay_only, None, args.line_format, args.jpeg_quality, args.container, args.max_bytes, args.tile_overlap)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Directory version of get_lines_google.py. A single Google Cloud Vision client is shared
+# by a pool of threads, which keep several batch_annotate_images requests in flight (several
+# images per request). The requests are rate limited (images per second) and retried with
+# exponential backoff. Every processed image is registered in a journal file, so an
+# interrupted run resumes where it stopped.
+# PRE-REQUISITE: The same Google credentials as get_lines_google.py. With --endpoint, the
+# requests are sent, without credentials, to a local (stub) endpoint instead.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, random, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from google.cloud import vision
+from google.cloud.vision import types
+import get_lines_google, job_scheduler, line_manifest
+
+# Maximum number of images per batch_annotate_images request accepted by the API
+MAX_BATCH_SIZE = 16
+# Error codes (google.rpc.Code) of the per-image responses worth retrying
+RETRY_CODES = [ 4, 8, 13, 14 ]  # DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED, INTERNAL, UNAVAILABLE
+
+QPS = 0.0
+N_RETRIES = 5
+BACKOFF = 1.0
+CACHE_DIR = ""
+REPLAY_ONLY = False
+OUTPUT_DIR = ""
+OUTPUT_FILE = ""
+LINE_FORMAT = "jpg"
+JPEG_QUALITY = 100
+CONTAINER = False
+MAX_BYTES = get_lines_google.MAX_CONTENT_BYTES
+TILE_OVERLAP = get_lines_google.TILE_OVERLAP
+
+rate_lock = threading.Lock()
+next_slot = 0.0
+output_lock = threading.Lock()
+f_journal = None
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def wait_rate( n_images ):
+	""" Blocks the calling thread until n_images more images can be sent without exceeding QPS images per second.
+	"""
+	global next_slot
+	if QPS <= 0:
+		return
+
+	with rate_lock:
+		now = time.time()
+		start = max( now, next_slot )
+		next_slot = start + n_images / QPS
+	if start > now:
+		time.sleep( start - now )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def annotate_batch( client, contents ):
+	""" Sends the images' contents in one batch_annotate_images request and returns their responses (same order).
+	The whole request is retried with exponential backoff when it fails, and so are the images with transient errors.
+	"""
+	feature = types.Feature( type=vision.enums.Feature.Type.DOCUMENT_TEXT_DETECTION )
+	responses = [ None ] * len(contents)
+	pending = list( range(len(contents)) )
+
+	attempt = 0
+	while True:
+		wait_rate( len(pending) )
+		requests = [ types.AnnotateImageRequest( image=types.Image(content=contents[i]), features=[feature] ) for i in pending ]
+		try:
+			batch_response = client.batch_annotate_images( requests )
+			still_pending = []
+			for i, response in zip( pending, batch_response.responses ):
+				responses[i] = response
+				if response.error.code in RETRY_CODES:
+					still_pending.append( i )
+			pending = still_pending
+		except Exception as e:
+			if attempt >= N_RETRIES:
+				raise
+			print("Warning: batch request failed (" + str(e) + "), retrying.")
+
+		if len(pending) == 0 or attempt >= N_RETRIES:
+			return responses
+
+		# Exponential backoff with jitter
+		time.sleep( BACKOFF * (2 ** attempt) * (0.5 + random.random()) )
+		attempt = attempt + 1
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_responses( client, contents ):
+	""" Returns the Google responses of a list of images' contents (None for the failed ones), from the cache when possible.
+	The images not found in the cache are sent to the API in batch requests.
+	"""
+	responses = [ get_lines_google.load_response( CACHE_DIR, content ) for content in contents ]
+
+	missing = [ i for i in range(len(contents)) if responses[i] is None ]
+	if len(missing) > 0 and not REPLAY_ONLY:
+		try:
+			new_responses = []
+			for j in range( 0, len(missing), MAX_BATCH_SIZE ):
+				new_responses.extend( annotate_batch( client, [ contents[i] for i in missing[j:j+MAX_BATCH_SIZE] ] ) )
+		except Exception as e:
+			print("Error: batch of " + str(len(missing)) + " images failed, " + str(e))
+			new_responses = [ None ] * len(missing)
+		for i, response in zip( missing, new_responses ):
+			if response is not None and response.error.code == 0:
+				get_lines_google.save_response( CACHE_DIR, contents[i], response )
+			responses[i] = response
+
+	return responses
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_tiled_response( client, img_path_filename ):
+	""" Returns the list of (response, x offset, y offset) of the tiles of an oversized image, or a failed response.
+	Each tile is sent in its own request (a batch of tiles would exceed the size limit of a request), concurrently.
+	"""
+	tiles = get_lines_google.make_tiles( img_path_filename, MAX_BYTES, TILE_OVERLAP )
+	with ThreadPoolExecutor( max_workers=len(tiles) ) as executor:
+		futures = [ executor.submit( get_responses, client, [ content ] ) for content, x, y in tiles ]
+		responses = [ future.result()[0] for future in futures ]
+	for response in responses:
+		if response is None or response.error.code != 0:
+			return response
+	return [ (response, x, y) for response, (content, x, y) in zip( responses, tiles ) ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def process_batch( client, filenames ):
+	""" Gets the Google responses of a batch of images (from the cache when possible) and saves their lines.
+	Oversized images are sent in tiles. Returns the list of images which could not be processed.
+	"""
+	contents = []
+	for filename in filenames:
+		with open( filenames[filename], 'rb' ) as f:
+			contents.append( f.read() )
+
+	# The images of the usual size are requested together; the tiles of each oversized image, in their own requests
+	regular = [ i for i in range(len(contents)) if MAX_BYTES <= 0 or len(contents[i]) <= MAX_BYTES ]
+	responses = [ None ] * len(contents)
+	for i, response in zip( regular, get_responses( client, [ contents[i] for i in regular ] ) ):
+		responses[i] = response
+	for i, filename in enumerate( filenames ):
+		if i not in regular:
+			try:
+				responses[i] = get_tiled_response( client, filenames[filename] )
+			except Exception as e:
+				print("Error: " + filenames[filename] + ", " + str(e))
+
+	failed = []
+	done = []
+	text_batch = ""
+	for filename, response in zip( filenames, responses ):
+		img_path_filename = filenames[filename]
+		if response is None:
+			print("Error: " + img_path_filename + ", no response was obtained.")
+			failed.append( filename )
+			continue
+		if not isinstance( response, list ) and response.error.code != 0:
+			print("Error: " + img_path_filename + ", " + response.error.message)
+			failed.append( filename )
+			continue
+
+		# The lines of all the images are saved in the output directory, as get_lines_google.py does (or in their containers)
+		try:
+			text_batch += get_lines_google.save_lines( img_path_filename, response, OUTPUT_DIR, LINE_FORMAT, JPEG_QUALITY, None, CONTAINER )
+		except Exception as e:
+			print("Error: " + img_path_filename + ", " + str(e))
+			failed.append( filename )
+			continue
+		done.append( filename )
+
+	# The global file (or manifest) and the journal are shared by all the threads. The lines of the whole batch
+	# are saved at once (a single transaction in the manifest), before registering its images in the journal.
+	with output_lock:
+		line_manifest.save_global( OUTPUT_FILE, text_batch )
+		for filename in done:
+			f_journal.write( filename + "\n" )
+		f_journal.flush()
+
+	return failed
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def create_client( endpoint ):
+	""" Creates the Google Cloud Vision client shared by all the threads. If an endpoint (host:port) is given,
+	an insecure channel to it is used, which allows testing the script against a local stub server.
+	"""
+	if endpoint == "":
+		return vision.ImageAnnotatorClient()
+
+	import grpc
+	from google.cloud.vision_v1.gapic.transports import image_annotator_grpc_transport
+	channel = grpc.insecure_channel( endpoint )
+	transport = image_annotator_grpc_transport.ImageAnnotatorGrpcTransport( channel=channel )
+	return vision.ImageAnnotatorClient( transport=transport )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Extract the lines from the images (jpg) of a directory using Google Cloud Text Detection.
+	"""
+	parser = argparse.ArgumentParser("Extract the lines from the images (jpg) of a directory using Google Cloud Text Detection.")
+	parser.add_argument('-id', '--input_dir', action="store", required=True, help="Directory with the jpg images to crop in lines.")
+	parser.add_argument('-od', '--output_dir', action="store", required=True, help="Directory where the cropped lines of all the images will be saved (named after their image, as get_lines_google.py).")
+	parser.add_argument('-of', '--output_file', action="store", required=True, help="Path + Filename of the text file which will save the coordinates of the cropped lines (a .sqlite or .db extension saves them in a line manifest).")
+	parser.add_argument('-cd', '--cache_dir', action="store", default="", help="Directory where the Google responses are cached (keyed by the hash of the image bytes).")
+	parser.add_argument('-ro', '--replay_only', '--replay-only', action="store_true", help="Only use the cached responses; the Google API is never called.")
+	parser.add_argument('-lf', '--line_format', action="store", default="jpg", choices=["jpg", "png", "none"], help="Format of the cropped lines: jpg, lossless grayscale png, or none. With none no line image is written: only their coordinates (and texts) in the text files or manifest, which tessDir_mt.py --lines crops again from the specimen images.")
+	parser.add_argument('-jq', '--jpeg_quality', action="store", type=int, default=100, help="Quality of the jpg cropped lines (1 to 100).")
+	parser.add_argument('-ct', '--container', action="store_true", help="Store the lines' files of each image in a line container (<basename>.lines.zip) of the output directory.")
+	parser.add_argument('-mb', '--max_bytes', action="store", type=int, default=get_lines_google.MAX_CONTENT_BYTES, help="Images bigger than this size are sent in overlapping tiles (0: never).")
+	parser.add_argument('-to', '--tile_overlap', action="store", type=int, default=get_lines_google.TILE_OVERLAP, help="Overlap, in pixels, of the tiles.")
+	parser.add_argument('-t', '--threads', action="store", type=int, default=8, help="Number of batch requests in flight (threads).")
+	parser.add_argument('-b', '--batch_size', action="store", type=int, default=8, help="Number of images per batch_annotate_images request (1 to 16).")
+	parser.add_argument('-q', '--qps', action="store", type=float, default=0.0, help="Maximum number of images sent per second (0: unlimited).")
+	parser.add_argument('-r', '--retries', action="store", type=int, default=5, help="Number of retries of a failed request.")
+	parser.add_argument('-jf', '--journal', action="store", default="", help="Path + Filename of the progress journal (default: <output_dir>/journal.txt).")
+	parser.add_argument('-ep', '--endpoint', action="store", default="", help="host:port of a local (stub) endpoint to use instead of the Google API.")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if ( not os.path.isdir( args.input_dir ) ):
+		print('Error: The directory of the jpg files was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	if not os.path.exists( args.output_dir ):
+		try:
+			os.makedirs( args.output_dir )
+		except:
+			print('Error: The destination directory was not found and could not be created.\n')
+			parser.print_help()
+			sys.exit(2)
+
+	if args.replay_only and args.cache_dir == "":
+		print('Error: The replay only mode requires a cache directory.\n')
+		parser.print_help()
+		sys.exit(3)
+
+	if args.batch_size < 1 or args.batch_size > MAX_BATCH_SIZE or args.threads < 1:
+		print('Error: The batch size must be between 1 and ' + str(MAX_BATCH_SIZE) + ', and at least one thread is needed.\n')
+		parser.print_help()
+		sys.exit(4)
+
+	QPS = args.qps
+	N_RETRIES = args.retries
+	CACHE_DIR = args.cache_dir
+	REPLAY_ONLY = args.replay_only
+	OUTPUT_DIR = args.output_dir
+	OUTPUT_FILE = args.output_file
+	LINE_FORMAT = args.line_format
+	JPEG_QUALITY = args.jpeg_quality
+	CONTAINER = args.container
+	MAX_BYTES = args.max_bytes
+	TILE_OVERLAP = args.tile_overlap
+
+	# Images already processed in a previous (interrupted) run
+	journal_path_filename = args.journal
+	if journal_path_filename == "":
+		journal_path_filename = args.output_dir + "/journal.txt"
+	done_set = set()
+	if os.path.isfile( journal_path_filename ):
+		with open( journal_path_filename ) as f:
+			done_set = set( line.rstrip('\n') for line in f )
+
+	# Create the list of files to process
+	filename_list = list(f for f in job_scheduler.walk_files( args.input_dir, '.jpg' ) if f not in done_set)
+	print("Images to process: " + str(len(filename_list)) + " (" + str(len(done_set)) + " already done).")
+
+	# Batches of images: {filename: path + filename}
+	batches = []
+	i = 0
+	while i < len(filename_list):
+		batches.append( dict( (f, args.input_dir + "/" + f) for f in filename_list[i:i+args.batch_size] ) )
+		i = i + args.batch_size
+
+	client = None
+	if not REPLAY_ONLY:
+		client = create_client( args.endpoint )
+
+	failed_list = []
+	f_journal = open( journal_path_filename, "a+" )
+	try:
+		with ThreadPoolExecutor( max_workers=args.threads ) as executor:
+			futures = [ executor.submit( process_batch, client, batch ) for batch in batches ]
+			for future in as_completed( futures ):
+				failed_list.extend( future.result() )
+	finally:
+		f_journal.close()
+
+	print("Processed images: " + str(len(filename_list) - len(failed_list)) + ", failed images: " + str(len(failed_list)) + ".")
+	if len(failed_list) > 0:
+		sys.exit(5)
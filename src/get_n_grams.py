@@ -23,6 +23,7 @@
 import argparse, os, sys
 import pandas as pd
 import numpy as np
+import line_container
 
 def get_ngrams( s, n):
 	""" Returns a list with the possible concatenation of words with a size of n
@@ -42,6 +43,7 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser("Generates the n-gram of words for the .txt files in a directory. ")
 	parser.add_argument('-d', '--dir', action="store", required=True, help="Directory where the text files are located.")
 	parser.add_argument('-n', '--n', action="store", required=True, help="Number of words in the grams.")
+	parser.add_argument('-e', '--engine', action="store", default="", help="Engine of the text files, when they are stored in line containers.")
 	parser.add_argument('-o', '--output', action="store", required=True, help="Path and filename of the tsv file which will store the n-grams.")
 	args = parser.parse_args()
 
@@ -64,15 +66,11 @@ if __name__ == '__main__':
 		sys.exit(2)
 
 	# Create the lists of files to process
-	files_list = list()
-	for root, dirs, filenames in os.walk( args.dir ):
-		files_list = list(f for f in filenames if f.endswith('.txt'))
+	files_list = line_container.list_files( args.dir, '.txt', args.engine )
 
 	ngrams_dict = {}
 	for filename in files_list:
-		path_filename = args.dir + "/" + filename
-
-		with open( path_filename ) as f: 
+		with line_container.open_text( args.dir, filename, args.engine ) as f: 
 			lines = [line.rstrip('\n') for line in f]
 			for line in lines:
 				ngrams_list = get_ngrams( line, n )
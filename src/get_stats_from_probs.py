@@ -21,9 +21,9 @@
 # limitations under the License.
 ##########################################################################################
 
-import argparse, os, sys, csv
-import pandas as pd
+import argparse, os, sys
 import numpy as np
+import line_container, prob_io
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
@@ -31,6 +31,7 @@ if __name__ == '__main__':
 	"""
 	parser = argparse.ArgumentParser("Generates basic statistics about the probability value of each symbol found in all the .prob files of a directory. ")
 	parser.add_argument('-d', '--dir', action="store", required=True, help="Directory where the probability files are located.")
+	parser.add_argument('-e', '--engine', action="store", default="", help="Engine of the probability files, when they are stored in line containers.")
 	parser.add_argument('-o', '--output', action="store", required=True, help="Path and filename of the text file which will store the statistics of each symbol.")
 	args = parser.parse_args()
 
@@ -41,25 +42,22 @@ if __name__ == '__main__':
 		sys.exit(1)
 
 	# Create the lists of files to process
-	files_list = list()
-	for root, dirs, filenames in os.walk( args.dir ):
-		files_list = list(f for f in filenames if f.endswith('.prob'))
+	files_list = line_container.list_files( args.dir, '.prob', args.engine )
 
 	symbol_dict = {} 
 	for filename in files_list:
 		path_filename = args.dir + "/" + filename
-		# Dataframe of the probability file
-		df = None
+		# Symbols and probabilities of the file (text or binary format)
 		try:
-			df = pd.read_csv( path_filename, sep="\t", header=None, engine='python', encoding='utf8', quoting=csv.QUOTE_NONE )
-			df.fillna(' ')
-		except:
+			symbols_list, prob_list = prob_io.entries( *prob_io.read_prob( args.dir, filename, args.engine ) )
+		except (UnicodeDecodeError, ValueError):
 			print("Encoding error at: " + path_filename)
 			sys.exit(2)
 
-		for index, row in df.iterrows():
-			symbol = str(row[0])[0]
-			probability = float(row[1])
+		for symbol, probability in zip( symbols_list, prob_list ):
+			if symbol == '':
+				continue
+			symbol = symbol[0]
 			
 			try:
 				list_values = symbol_dict[ symbol ]
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Reduced-resolution and region-limited decoding of (very large) jpg images. Instead of
+# decoding the full resolution image:
+#   - read_reduced() lets libjpeg downscale while decoding (DCT scaling by 1/2, 1/4, or 1/8,
+#     through PIL's draft()), when only a smaller copy of the image is needed.
+#   - read_regions() stops decoding after the last row used by a set of bounding boxes, so
+#     the memory of the rows below them is never allocated nor decoded, and returns copies
+#     of the crops of the boxes (the decoded rows are released). The rows above the lowest
+#     box are still decoded at full width: libjpeg's row skipping and cropping are not
+#     available through PIL, so the saving depends on how high the lowest box is.
+#   Both produce exactly the same pixels as the full decode followed by the resize/crop.
+# The partial decode uses the jpeg decoder of PIL directly; with a PIL which does not
+# provide it, the full image is decoded instead.
+#   share_regions() decodes an image once and copies the crops of a set of bounding boxes
+# to a shared memory segment, which other processes read (region_view) without files.
+#   line_cost() estimates the cost of processing a cropped line (width x height) from the
+# header of its image, without decoding it.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import io, os
+from multiprocessing import resource_tracker, shared_memory
+from PIL import Image
+import numpy as np
+import line_container
+
+# Bytes read from the file in each call to the decoder
+READ_BLOCK = 65536
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def open_image( path_filename, scale=1.0, mode=None ):
+	""" Opens (without decoding) the image. For jpg files, the decoder is configured to produce the smallest DCT scaled
+	version not smaller than scale, in the mode ('RGB' or 'L', converted by libjpeg). Returns (image, factor), where factor is
+	the reduction applied (1, 2, 4, or 8).
+	"""
+	im = Image.open( path_filename )
+	width = im.size[0]
+	if im.format == "JPEG" and im.mode in [ 'RGB', 'L' ] and (scale < 1.0 or (mode is not None and mode != im.mode)):
+		im.draft( mode if mode is not None else im.mode, ( max(1, int(im.size[0] * scale)), max(1, int(im.size[1] * scale)) ) )
+	return ( im, int(round( width / float(im.size[0]) )) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def decode_rows( im, n_rows ):
+	""" Decodes only the first n_rows of an opened jpg image and returns them as a numpy array (the whole image for other
+	formats). The partial decode drives the jpeg decoder of PIL directly; if this PIL does not provide it, the whole image
+	is decoded and its first n_rows returned.
+	"""
+	width, height = im.size
+	if n_rows >= height or im.format != "JPEG" or len(im.tile) != 1:
+		return np.asarray( im )
+
+	n_rows = max( 1, n_rows )
+	rows = Image.new( im.mode, (width, n_rows) )
+	try:
+		codec, extents, offset, args = im.tile[0][:4]
+		decoder = Image._getdecoder( im.mode, codec, args, im.decoderconfig )
+		# The decoder stops (n < 0) as soon as the n_rows of the smaller destination image are filled
+		decoder.setimage( rows.im, (0, 0, width, n_rows) )
+	except (AttributeError, TypeError, ValueError):
+		return np.asarray( im )[:n_rows]
+
+	complete = False
+	try:
+		im.fp.seek( offset )
+		data = b""
+		while True:
+			block = im.fp.read( READ_BLOCK )
+			if not block:
+				break
+			data = data + block
+			n, err_code = decoder.decode( data )
+			if n < 0:
+				complete = True
+				break
+			data = data[n:]
+	finally:
+		decoder.cleanup()
+		im.close()
+
+	if not complete:
+		raise IOError( "The image is truncated before row " + str(n_rows) + "." )
+	return np.asarray( rows )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def image_size( path_filename ):
+	""" (width, height) of the image, read from its header.
+	"""
+	with Image.open( path_filename ) as im:
+		return im.size
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def line_cost( dir_name, filename, engine="" ):
+	""" Estimated cost of processing a line: width x height of its image (a file of the directory, or a member of the line
+	container of its image), read from the header. Returns 0 if the image cannot be read.
+	"""
+	path_filename = dir_name + "/" + filename
+	try:
+		if os.path.isfile( path_filename ):
+			width, height = image_size( path_filename )
+		else:
+			width, height = image_size( io.BytesIO( line_container.read_bytes( dir_name, filename, engine ) ) )
+	except (IOError, OSError, SyntaxError):
+		return 0
+	return width * height
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_reduced( path_filename, scale, mode=None ):
+	""" Decodes the image at the smallest DCT scale (1, 1/2, 1/4, 1/8) not smaller than scale. Returns (array, factor); the
+	caller resizes the array by scale * factor to get the requested size.
+	"""
+	im, factor = open_image( path_filename, scale, mode )
+	if mode is not None and im.mode != mode:
+		im = im.convert( mode )
+	return ( np.asarray( im ), factor )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_regions( path_filename, boxes, mode=None ):
+	""" Crops of the bounding boxes ([x1, y1, x2, y2], full resolution coordinates, clipped to the image). Only the rows from
+	the top to the bottom of the lowest box are decoded (the jpeg decoder cannot skip rows nor columns); the crops are copied
+	from them and the decoded rows are released before returning. Returns (list of arrays, (width, height)).
+	"""
+	im, factor = open_image( path_filename, 1.0, mode )
+	width, height = im.size
+	boxes = [ [ min( max(0, int(v)), limit ) for v, limit in zip( box[:4], [ width, height, width, height ] ) ] for box in boxes ]
+	if im.mode not in [ 'RGB', 'L' ]:
+		image = np.asarray( im.convert( 'RGB' if mode is None else mode ) )
+	else:
+		image = decode_rows( im, max( [ box[3] for box in boxes ] + [ 1 ] ) )
+	crops = [ image[ y1:max(y1, y2), x1:max(x1, x2) ].copy() for x1, y1, x2, y2 in boxes ]
+	del image
+	return ( crops, (width, height) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def share_regions( path_filename, boxes, mode=None ):
+	""" Decodes the image once (read_regions) and copies the crops of the bounding boxes ([x1, y1, x2, y2]) to a new
+	shared memory segment. Returns (segment, list of (offset, width, height, channels) of the crops). The caller closes
+	the segment, and unlinks it when the readers have finished.
+	"""
+	crops, size = read_regions( path_filename, boxes, mode )
+	regions = []
+	n_bytes = 0
+	for crop in crops:
+		regions.append( ( n_bytes, crop.shape[1], crop.shape[0], 1 if crop.ndim == 2 else crop.shape[2] ) )
+		n_bytes = n_bytes + crop.size
+
+	segment = shared_memory.SharedMemory( create=True, size=max(1, n_bytes) )
+	buffer = np.ndarray( (max(1, n_bytes),), dtype=np.uint8, buffer=segment.buf )
+	for ( offset, width, height, channels ), crop in zip( regions, crops ):
+		buffer[ offset:offset + crop.size ] = crop.reshape(-1)
+	del buffer
+	return ( segment, regions )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def attach_segment( name ):
+	""" Opens a shared memory segment created by another process, which is the only one that unlinks it.
+	"""
+	try:
+		return shared_memory.SharedMemory( name=name, track=False )
+	except TypeError:
+		segment = shared_memory.SharedMemory( name=name )
+		resource_tracker.unregister( segment._name, "shared_memory" )
+		return segment
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def region_view( segment, region ):
+	""" Array (without copy) of a crop (offset, width, height, channels) of a shared memory segment.
+	"""
+	offset, width, height, channels = region
+	shape = ( height, width ) if channels == 1 else ( height, width, channels )
+	return np.ndarray( shape, dtype=np.uint8, buffer=segment.buf, offset=offset )
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Job scheduler of the *_mt.py scripts. It runs shell commands with a limited number of
+# concurrent processes, blocking (selectors on the children's output pipes, or on a pipe
+# they inherit and close when they end) instead of polling them. The stdout/stderr and exit code of every
+# job are collected, and the failed jobs are reported.
+#   run_tasks() runs a Python function over a list of tasks in a pool of worker processes
+# with a wall-clock budget per task: a worker which exceeds it (e.g. Tesseract looping on a
+# pathological crop) or dies is killed and replaced, the task is retried a bounded number
+# of times, and then it is reported so it can be quarantined. The functions which process a
+# list of lines call next_item() before each one (with the results of the lines finished),
+# so the budget applies to every line of the list instead of to the whole list, and only the
+# failing line and the ones after it are run again. run_commands() also kills the commands
+# which exceed their budget.
+#   It also provides walk_files(), which lists the files of a directory and of all its
+# subdirectories, and cost_chunks(), which orders the lines by decreasing estimated cost
+# (longest job first) and splits them in chunks of decreasing size (guided scheduling), so
+# the expensive lines do not arrive at the end of a run and leave most workers idle.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, collections, os, selectors, signal, sys, time
+import multiprocessing
+from multiprocessing import connection
+from subprocess import Popen, PIPE
+
+CORES_N = multiprocessing.cpu_count()
+# Bytes read from a pipe each time it is ready
+READ_SIZE = 65536
+# Exit code of the commands killed for exceeding their time limit (not a real one: a command killed by a signal gets
+# -signal, e.g. -9 when the kernel kills it for lack of memory), and errors of the tasks of run_tasks
+TIMEOUT_CODE = -1000
+TIMEOUT = "time limit exceeded"
+CRASHED = "worker died"
+# Guided chunking: each chunk has at most 1/(GUIDED_FACTOR * n_jobs) of the remaining cost
+GUIDED_FACTOR = 2
+# Connection of a worker process of run_tasks to the scheduler (only in the workers)
+PROGRESS_CONN = None
+# First element of the messages of next_item (the answers of the tasks are (result, error message))
+PROGRESS = "next_item"
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def walk_files( dir_name, extension ):
+	""" Sorted list of the files with the extension in the directory and its subdirectories, relative to the directory
+	(dir_name + "/" + name is the path + filename of each one).
+	"""
+	files_list = []
+	for root, dirs, filenames in os.walk( dir_name ):
+		dirs.sort()
+		rel_dir = os.path.relpath( root, dir_name )
+		for f in filenames:
+			if f.endswith( extension ):
+				files_list.append( f if rel_dir == "." else rel_dir + "/" + f )
+	files_list.sort()
+	return files_list
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def cost_chunks( items, costs, n_jobs=CORES_N, max_chunk=16 ):
+	""" Splits the items in chunks for the workers, in decreasing order of cost (longest job first). Each chunk takes items
+	until it has 1/(GUIDED_FACTOR * n_jobs) of the remaining cost, with 1 to max_chunk items, so the chunks get smaller
+	(finer load balancing) towards the end of the run.
+	"""
+	order = sorted( range(len(items)), key=lambda i: -costs[i] )
+	remaining = float( sum( costs ) )
+	chunks = []
+	chunk, chunk_cost = [], 0.0
+	target = remaining / ( GUIDED_FACTOR * max(1, n_jobs) )
+	for i in order:
+		chunk.append( items[i] )
+		chunk_cost += costs[i]
+		if len(chunk) >= max(1, max_chunk) or chunk_cost >= target:
+			chunks.append( chunk )
+			remaining -= chunk_cost
+			chunk, chunk_cost = [], 0.0
+			target = remaining / ( GUIDED_FACTOR * max(1, n_jobs) )
+	if len(chunk) > 0:
+		chunks.append( chunk )
+	return chunks
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def run_commands( commands, n_jobs=CORES_N, capture=True, verbose=True, timeout=0, retries=0 ):
+	""" Runs the shell commands, at most n_jobs at the same time. With capture, the stdout and stderr of each job are
+	collected (they are None otherwise). With timeout > 0, a command running for more than timeout seconds is killed
+	(with its children; exit code TIMEOUT_CODE), and started again up to retries times.
+	Returns (results, failed): the list of (command, exit code, stdout, stderr) in the order of the commands, and the
+	list of the commands which failed (exit code != 0 or not started).
+	"""
+	n_jobs = max( 1, n_jobs )
+	results = [ None ] * len(commands)
+	running = {}			# pid -> ( index, process, output buffers, open pipes, deadline )
+	selector = selectors.DefaultSelector()
+	pending = collections.deque( ( i, 0 ) for i in range( len(commands) ) )		# ( index, attempt )
+	attempts = {}
+
+	while len(pending) > 0 or len(running) > 0:
+		# Start new jobs up to the limit
+		while len(pending) > 0 and len(running) < n_jobs:
+			index, attempt = pending.popleft()
+			# Without capture, the end of each job is detected through a pipe it inherits (closed when it ends). With a
+			# budget, the job runs in its own process group, to be killed with its children
+			end_r, end_w = os.pipe() if not capture else ( None, None )
+			try:
+				process = Popen( commands[index], shell=True, stdout=PIPE if capture else None, stderr=PIPE if capture else None,
+					start_new_session=timeout > 0, pass_fds=() if end_w is None else (end_w,) )
+			except OSError as e:
+				if end_r is not None:
+					os.close( end_r )
+				results[index] = ( commands[index], -1, b"", str(e).encode() )
+				continue
+			finally:
+				if end_w is not None:
+					os.close( end_w )
+			attempts[ index ] = attempt
+			job = [ index, process, { 'stdout': [], 'stderr': [] }, 0, time.time() + timeout if timeout > 0 else None ]
+			pipes = []
+			if capture:
+				pipes = [ ('stdout', process.stdout), ('stderr', process.stderr) ]
+			elif end_r is not None:
+				pipes = [ ('end', os.fdopen( end_r, 'rb' )) ]
+			for name, pipe in pipes:
+				os.set_blocking( pipe.fileno(), False )
+				selector.register( pipe, selectors.EVENT_READ, ( process.pid, name ) )
+				job[3] = job[3] + 1
+			running[ process.pid ] = job
+
+		if len(running) == 0:
+			continue
+		# Block until a child writes or closes its pipes (it closes them when it ends), or until the next deadline. Only the
+		# children started here are waited for (Popen.wait on their pid)
+		finished = []			# ( pid, exit code, True if it was killed for exceeding its time limit )
+		deadlines = [ job[4] for job in running.values() if job[4] is not None ]
+		wait = max( 0.0, min( deadlines ) - time.time() ) if len(deadlines) > 0 else None
+		for key, mask in selector.select( wait ):
+			pid, name = key.data
+			job = running[ pid ]
+			data = os.read( key.fd, READ_SIZE )
+			if data:
+				if name in job[2]:
+					job[2][name].append( data )
+			else:
+				selector.unregister( key.fileobj )
+				key.fileobj.close()
+				job[3] = job[3] - 1
+				if job[3] == 0:
+					finished.append( ( pid, job[1].wait(), False ) )
+
+		# Kill the jobs over their budget (their pipes are closed here)
+		now = time.time()
+		for pid, job in list( running.items() ):
+			if job[4] is not None and now >= job[4] and job[3] > 0:
+				try:
+					os.killpg( pid, signal.SIGKILL )
+				except OSError:
+					pass
+				job[1].wait()
+				for key in list( selector.get_map().values() ):
+					if key.data[0] == pid:
+						selector.unregister( key.fileobj )
+						key.fileobj.close()
+				job[3] = 0
+				finished.append( ( pid, TIMEOUT_CODE, True ) )
+
+		for pid, returncode, timed_out in finished:
+			index, process, output, n_pipes, deadline = running.pop( pid )
+			stdout = b"".join( output['stdout'] ) if capture else None
+			stderr = b"".join( output['stderr'] ) if capture else None
+			if timed_out and attempts[index] < retries:
+				if verbose:
+					print("Error: time limit exceeded, retrying: " + commands[index])
+				pending.append( ( index, attempts[index] + 1 ) )
+				continue
+			results[ index ] = ( commands[index], returncode, stdout, stderr )
+			if verbose and timed_out:
+				print("Error: time limit exceeded in: " + commands[index])
+			elif verbose and returncode != 0:
+				print("Error: exit code " + str(returncode) + " in: " + commands[index])
+
+	selector.close()
+	failed = [ command for command, returncode, stdout, stderr in results if returncode != 0 ]
+	return ( results, failed )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def next_item( n=1, results=None ):
+	""" Called by a function of run_tasks before each item (line) of its task, or before n items which are processed at
+	once (e.g. a batch of lines): the items before them are finished, and the time limit of the task starts again, for n
+	items. If the task fails later, its finished items are not run again. results is the part of the result of the
+	function (a list) of the items finished since the previous call: it is sent to run_tasks, which puts it before the
+	list the function returns. Returns the results which were not sent (all of them outside the workers of run_tasks),
+	to be returned by the function: results = next_item( 1, results ).
+	"""
+	if results is None:
+		results = []
+	if PROGRESS_CONN is None:
+		return results
+	PROGRESS_CONN.send( ( PROGRESS, n, results ) )
+	return []
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def task_worker( function, conn, initializer, initargs ):
+	""" Loop of a worker process of run_tasks: runs the function over the tasks received through the connection, and
+	sends back (result, error message or ""), and (PROGRESS, number of items, results) each time the function calls
+	next_item.
+	"""
+	global PROGRESS_CONN
+	PROGRESS_CONN = conn
+	if initializer is not None:
+		initializer( *initargs )
+	while True:
+		try:
+			task = conn.recv()
+		except EOFError:
+			break
+		if task is None:
+			break
+		try:
+			result = ( function( task ), "" )
+		except Exception as e:
+			result = ( None, str(e) )
+		conn.send( result )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def start_worker( function, initializer, initargs ):
+	""" Starts a worker process of run_tasks. Returns [process, connection, current job].
+	"""
+	parent_conn, child_conn = multiprocessing.Pipe()
+	process = multiprocessing.Process( target=task_worker, args=( function, child_conn, initializer, initargs ) )
+	process.daemon = True
+	process.start()
+	child_conn.close()
+	return [ process, parent_conn, None ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def run_tasks( function, tasks, n_jobs=CORES_N, timeout=0, retries=1, initializer=None, initargs=(), verbose=True ):
+	""" Runs function(task) for each task (an iterable, consumed as the workers become free) in n_jobs worker processes,
+	which run initializer(*initargs) when they start. Yields (task, result, error) as the tasks finish, where error is ""
+	if the task ended, the message of the exception it raised, TIMEOUT if it ran for more than timeout seconds (when
+	timeout > 0), or CRASHED if its worker died. The workers which exceed the budget are killed and replaced, and the task
+	is run again up to retries times before it is reported.
+	A task which is a list (e.g. of lines) gets timeout seconds per item when the function calls next_item() before each
+	one, or before each group of items processed at once (otherwise, timeout seconds in total). If it fails, its finished
+	items are yielded as a task with the results they sent, the failing item is run again (up to retries times) or
+	reported, each item of a failing group is run again alone, and the items after them are run again as a list; without
+	next_item(), all its items are run again one by one. So only the items which hit the limit (or raise the exception)
+	are reported.
+	"""
+	n_jobs = max( 1, n_jobs )
+	tasks = iter( tasks )
+	pending = collections.deque()			# ( task, attempt ) to run again
+	workers = [ start_worker( function, initializer, initargs ) for i in range( n_jobs ) ]
+	exhausted = False
+
+	try:
+		while True:
+			# Send a task to each free worker
+			for worker in workers:
+				if worker[2] is not None:
+					continue
+				if len(pending) > 0:
+					task, attempt = pending.popleft()
+				elif not exhausted:
+					try:
+						task, attempt = next( tasks ), 0
+					except StopIteration:
+						exhausted = True
+						continue
+				else:
+					continue
+				worker[1].send( task )
+				# ( task, attempt, deadline, items started, items of the last group, results of the finished items )
+				worker[2] = ( task, attempt, time.time() + timeout if timeout > 0 else None, 0, 0, [] )
+
+			busy = [ worker for worker in workers if worker[2] is not None ]
+			if len(busy) == 0:
+				break
+
+			# Block until a worker answers or dies, or until the next deadline
+			deadlines = [ worker[2][2] for worker in busy if worker[2][2] is not None ]
+			wait = max( 0.0, min( deadlines ) - time.time() ) if len(deadlines) > 0 else None
+			ready = connection.wait( [ worker[1] for worker in busy ] + [ worker[0].sentinel for worker in busy ], wait )
+
+			now = time.time()
+			for i, worker in enumerate( workers ):
+				if worker[2] is None:
+					continue
+				task, attempt, deadline, started, group, partial = worker[2]
+				error = None
+				if worker[1] in ready:
+					try:
+						answer = worker[1].recv()
+						while len(answer) == 3:
+							# The function started the next items of the task: the previous ones are finished (with their
+							# results), and a new time limit, for that number of items
+							started, group = started + answer[1], answer[1]
+							partial.extend( answer[2] )
+							deadline = now + group * timeout if timeout > 0 else None
+							if not worker[1].poll():
+								break
+							answer = worker[1].recv()
+						if len(answer) == 3:
+							worker[2] = ( task, attempt, deadline, started, group, partial )
+							continue
+						result, message = answer
+						worker[2] = None
+						if len(partial) > 0:
+							result = partial + list( result if result is not None else [] )
+						if message == "" or not isinstance( task, list ) or len(task) == 1:
+							yield ( task, result, message )
+							continue
+						error = message
+					except ( EOFError, OSError ):
+						error = CRASHED
+				elif worker[0].sentinel in ready:
+					error = CRASHED
+				elif deadline is not None and now >= deadline:
+					error = TIMEOUT
+				if error is None:
+					continue
+
+				if error in [ TIMEOUT, CRASHED ]:
+					# Replace the worker
+					worker[0].kill()
+					worker[0].join()
+					worker[1].close()
+					workers[i] = start_worker( function, initializer, initargs )
+				if isinstance( task, list ) and len(task) > 1:
+					if started == 0:
+						# No progress of the items: all of them one by one
+						pending.extend( ( [ item ], attempt ) for item in task )
+						continue
+					# The finished items are reported, the items after the failing one (or group) are run again as a list,
+					# and the items of a failing group one by one
+					started = min( started, len(task) )
+					first = max( 0, started - group )
+					if first > 0:
+						yield ( task[:first], partial, "" )
+					if started < len(task):
+						pending.append( ( task[started:], attempt ) )
+					if started - first > 1:
+						pending.extend( ( [ item ], attempt ) for item in task[first:started] )
+						continue
+					task = task[first:started]
+				if error not in [ TIMEOUT, CRASHED ]:
+					yield ( task, None, error )
+				elif attempt < retries:
+					if verbose:
+						print("Error: " + error + ", retrying: " + str(task))
+					pending.append( ( task, attempt + 1 ) )
+				else:
+					if verbose:
+						print("Error: " + error + ": " + str(task))
+					yield ( task, None, error )
+	finally:
+		for worker in workers:
+			try:
+				worker[1].send( None )
+			except ( EOFError, OSError ):
+				pass
+		for worker in workers:
+			worker[0].join( 1 )
+			if worker[0].is_alive():
+				worker[0].kill()
+				worker[0].join()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Runs the commands of a file (one per line) with a limited number of concurrent processes.
+	"""
+	parser = argparse.ArgumentParser("Runs the commands of a file (one per line) with a limited number of concurrent processes.")
+	parser.add_argument('-cf', '--commands_file', action="store", required=True, help="Text file with one shell command per line.")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=CORES_N, help="Maximum number of concurrent processes.")
+	parser.add_argument('-ld', '--log_dir', action="store", default="", help="Directory where the stdout and stderr of each job are saved (<n>.out, <n>.err).")
+	parser.add_argument('-ff', '--failed_file', action="store", default="", help="Path + Filename where the failed commands are saved.")
+	parser.add_argument('-tl', '--time_limit', action="store", type=float, default=0, help="Seconds a command may run before it is killed (0: no limit).")
+	parser.add_argument('-rt', '--retries', action="store", type=int, default=0, help="Times a command killed for exceeding the time limit is run again.")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if ( not os.path.isfile( args.commands_file ) ):
+		print('Error: The file of commands was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	if args.log_dir != "" and not os.path.exists( args.log_dir ):
+		try:
+			os.makedirs( args.log_dir )
+		except:
+			print('Error: The log directory was not found and could not be created.\n')
+			parser.print_help()
+			sys.exit(2)
+
+	with open( args.commands_file ) as f:
+		commands = [ line.strip() for line in f if line.strip() != "" ]
+
+	results, failed = run_commands( commands, args.jobs, args.log_dir != "", True, args.time_limit, args.retries )
+
+	if args.log_dir != "":
+		for n, ( command, returncode, stdout, stderr ) in enumerate( results ):
+			with open( args.log_dir + "/" + str(n) + ".out", "wb" ) as f:
+				f.write( stdout )
+			with open( args.log_dir + "/" + str(n) + ".err", "wb" ) as f:
+				f.write( stderr )
+
+	if args.failed_file != "":
+		with open( args.failed_file, "w+" ) as f:
+			for command in failed:
+				f.write( command + "\n" )
+
+	print("Jobs: " + str(len(commands)) + ", failed: " + str(len(failed)))
+	if len(failed) > 0:
+		sys.exit(3)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Per-image line containers. Instead of thousands of tiny files per directory (.jpg, .txt,
+# and .prob for each line and OCR engine), all the files of the lines of one image are
+# stored in a single uncompressed zip file: <dir>/<basename>.lines.zip. The central
+# directory of the zip works as the offset table, so any member can be read directly.
+#   Layout of a container:
+#       <basename>_NNN.jpg (or .png)        Cropped lines
+#       <basename>.txt                      Full text of the image (Google)
+#       <basename>_lines.csv                Coordinates of the lines
+#       <engine>/<basename>_NNN.txt         Text of the line for each engine (google, ocropus, tesseract, ...)
+#       <engine>/<basename>_NNN.prob        Probabilities of the line's symbols for each engine
+#       <engine>/<basename>_NNN.bin.png     Binarized lines (ocropus)
+#   The functions of this module accept directories with plain files, containers, or both,
+# so the scripts of the pipeline can read their inputs from either layout. Used as a
+# script, it packs a directory of line files into containers or unpacks them.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, fcntl, io, os, re, sys, zipfile
+
+CONTAINER_EXT = ".lines.zip"
+ENGINES = [ "google", "ocropus", "tesseract" ]
+
+# Line files: <basename>_NNN.<extension>, where the extension may be double (.bin.png)
+line_regex = re.compile( r'^(.+)_(\d{3,})(\..+)$' )
+
+# Open (read only) containers of this process: path -> (mtime, size, ZipFile), least recently used first
+MAX_READERS = 64
+readers = {}
+readers_pid = os.getpid()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def container_path_filename( dir_name, basename ):
+	""" Path + filename of the container of the image basename in the directory.
+	"""
+	return dir_name + "/" + basename + CONTAINER_EXT
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def own_basename( filename ):
+	""" Basename of the image of a file that is not a line (fulltext and _lines.csv files): its own name.
+	"""
+	if filename.endswith( "_lines.csv" ):
+		return filename[:-len("_lines.csv")]
+	return filename.split('.')[0]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def image_basename( filename, basenames=None ):
+	""" Returns the basename of the image a line file belongs to (EMEC609939_Stigmus_sp_006.prob -> EMEC609939_Stigmus_sp).
+	Files that are not lines (fulltext and _lines.csv files) belong to the image with their own name. A fulltext file
+	whose name ends in digits (MCZ_ENT_00012345.txt) looks like a line file: with basenames, the set of the known image
+	basenames, a file whose own name is one of them belongs to that image.
+	"""
+	if basenames is not None and own_basename( filename ) in basenames:
+		return own_basename( filename )
+	m = line_regex.match( filename )
+	if m is not None:
+		return m.group(1)
+	return own_basename( filename )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def container_basename( dir_name, filename ):
+	""" Basename of the container of the directory a file is written to: the image of its own name if that container
+	exists (see image_basename), otherwise the image of the line.
+	"""
+	basename = image_basename( filename )
+	if basename != own_basename( filename ) and os.path.isfile( container_path_filename( dir_name, own_basename( filename ) ) ):
+		return own_basename( filename )
+	return basename
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def member_name( filename, engine="" ):
+	""" Name of a file inside a container: the engine files are stored in their own folder.
+	"""
+	if engine == "":
+		return filename
+	return engine + "/" + filename
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_reader( container_path ):
+	""" Returns an open ZipFile for reading the container; it is reopened if the container was modified.
+	"""
+	global readers_pid
+	if readers_pid != os.getpid():
+		# The readers inherited from the parent process (fork) share its file offsets: open new ones
+		readers.clear()
+		readers_pid = os.getpid()
+	st = os.stat( container_path )
+	cached = readers.pop( container_path, None )
+	if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+		readers[ container_path ] = cached
+		return cached[2]
+	if cached is not None:
+		cached[2].close()
+
+	# Limit the number of open files: close the least recently used container
+	if len(readers) >= MAX_READERS:
+		oldest = next( iter(readers) )
+		readers.pop( oldest )[2].close()
+
+	# The shared lock avoids reading a central directory that is being rewritten
+	with open( container_path, 'rb' ) as f_lock:
+		fcntl.flock( f_lock, fcntl.LOCK_SH )
+		zf = zipfile.ZipFile( container_path )
+		fcntl.flock( f_lock, fcntl.LOCK_UN )
+	readers[ container_path ] = ( st.st_mtime_ns, st.st_size, zf )
+	return zf
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def list_members( container_path ):
+	""" Names of the files stored in the container.
+	"""
+	return get_reader( container_path ).namelist()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_member( container_path, name ):
+	""" Content (bytes) of a file of the container.
+	"""
+	return get_reader( container_path ).read( name )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_line( container_path, n_line, engine="" ):
+	""" Random access by line number: returns a dictionary {extension: content} with the files of the line
+	(the cropped image when engine is "", or the text, probabilities, ... of the engine).
+	"""
+	basename = os.path.basename( container_path )[:-len(CONTAINER_EXT)]
+	prefix = member_name( basename + "_" + ("%03d" % n_line), engine )
+	line_files = {}
+	for name in list_members( container_path ):
+		if name.startswith( prefix + "." ):
+			line_files[ name[len(prefix):] ] = read_member( container_path, name )
+	return line_files
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def write_members( container_path, members ):
+	""" Stores (uncompressed) the list of (name, content) files in the container, creating it if needed.
+	Concurrent writers are serialized with an exclusive lock. If a member already exists, the container is rebuilt
+	without its old version.
+	"""
+	members = [ (name, content.encode('utf-8') if isinstance(content, str) else content) for name, content in members ]
+	new_names = set( name for name, content in members )
+
+	while True:
+		fd = os.open( container_path, os.O_RDWR | os.O_CREAT, 0o644 )
+		f = os.fdopen( fd, 'r+b' )
+		fcntl.flock( f, fcntl.LOCK_EX )
+		# The container could have been replaced (rebuilt) while we were waiting for the lock
+		if os.path.exists( container_path ) and os.fstat( f.fileno() ).st_ino == os.stat( container_path ).st_ino:
+			break
+		f.close()
+
+	try:
+		old_names = []
+		if os.fstat( f.fileno() ).st_size > 0:
+			with zipfile.ZipFile( f, 'r' ) as zf:
+				old_names = zf.namelist()
+
+		if len( new_names.intersection( old_names ) ) == 0:
+			# Common case: append the new members
+			f.seek( 0 )
+			with zipfile.ZipFile( f, 'a', zipfile.ZIP_STORED ) as zf:
+				for name, content in members:
+					zf.writestr( name, content )
+		else:
+			# Rebuild the container, replacing the old versions of the members
+			tmp_path = container_path + "." + str(os.getpid()) + ".tmp"
+			with zipfile.ZipFile( f, 'r' ) as zf_old, zipfile.ZipFile( tmp_path, 'w', zipfile.ZIP_STORED ) as zf_new:
+				for name in old_names:
+					if name not in new_names:
+						zf_new.writestr( zf_old.getinfo( name ), zf_old.read( name ) )
+				for name, content in members:
+					zf_new.writestr( name, content )
+			os.replace( tmp_path, container_path )
+	finally:
+		f.close()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def list_containers( dir_name ):
+	""" Paths + filenames of the containers of a directory.
+	"""
+	return sorted( dir_name + "/" + f for f in os.listdir( dir_name ) if f.endswith( CONTAINER_EXT ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def list_files( dir_name, extension, engine="" ):
+	""" Names of the files with the extension in the directory: plain files, and files of the engine stored in the
+	containers of the directory (without the engine folder). The names are the same in both layouts.
+	"""
+	files_list = []
+	containers = False
+	for f in os.listdir( dir_name ):
+		if f.endswith( CONTAINER_EXT ):
+			containers = True
+		elif f.endswith( extension ) and os.path.isfile( dir_name + "/" + f ):
+			files_list.append( f )
+
+	if containers:
+		prefix = member_name( "", engine )
+		for container_path in list_containers( dir_name ):
+			for name in list_members( container_path ):
+				if name.startswith( prefix ) and name.endswith( extension ) and '/' not in name[len(prefix):]:
+					files_list.append( name[len(prefix):] )
+
+	return files_list
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_bytes( dir_name, filename, engine="" ):
+	""" Content (bytes) of a file, from the directory or, if it is not there, from the container of its image.
+	"""
+	path_filename = dir_name + "/" + filename
+	if os.path.isfile( path_filename ):
+		with open( path_filename, 'rb' ) as f:
+			return f.read()
+	# The container of the line, or of the image with its own name (see image_basename)
+	for basename in [ image_basename( filename ), own_basename( filename ) ]:
+		try:
+			return read_member( container_path_filename( dir_name, basename ), member_name( filename, engine ) )
+		except (OSError, KeyError):
+			pass
+	raise IOError( "File " + filename + " was not found in " + dir_name + "." )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def open_text( dir_name, filename, engine="" ):
+	""" Opens for reading a text file from the directory or from the container of its image.
+	It can be used like open(): "with open_text(d, f) as f_text: for line in f_text: ..."
+	"""
+	path_filename = dir_name + "/" + filename
+	if os.path.isfile( path_filename ):
+		return open( path_filename )
+	return io.TextIOWrapper( io.BytesIO( read_bytes( dir_name, filename, engine ) ), encoding='utf-8' )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+class ContainerWriter( io.StringIO ):
+	""" Text file which is stored in the container of its image when it is closed.
+	"""
+	def __init__( self, container_path, name ):
+		io.StringIO.__init__( self )
+		self.container_path = container_path
+		self.name = name
+
+	def close( self ):
+		if not self.closed:
+			write_members( self.container_path, [ (self.name, self.getvalue()) ] )
+		io.StringIO.close( self )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def open_write( dir_name, filename, engine="", container=False, basename="" ):
+	""" Opens a text file for writing: a plain file of the directory, or (container=True) a file of the engine
+	inside the container of its image in the directory (basename, or see container_basename).
+	"""
+	if not container:
+		return open( dir_name + "/" + filename, "w+" )
+	if basename == "":
+		basename = container_basename( dir_name, filename )
+	return ContainerWriter( container_path_filename( dir_name, basename ), member_name( filename, engine ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def write_files( dir_name, files, engine="", container=False, basename="" ):
+	""" Writes a list of (filename, content) files: as plain files of the directory or, with container=True,
+	grouped in the containers of their images (one write per container): the container of basename, when the files
+	belong to one image, or see container_basename.
+	"""
+	if not container:
+		for filename, content in files:
+			with open( dir_name + "/" + filename, "wb" if isinstance(content, bytes) else "w+" ) as f:
+				f.write( content )
+		return
+
+	groups = {}
+	for filename, content in files:
+		groups.setdefault( basename if basename != "" else container_basename( dir_name, filename ), [] ).append( (member_name( filename, engine ), content) )
+	for image in groups:
+		write_members( container_path_filename( dir_name, image ), groups[ image ] )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def extract_files( dir_name, extension, engine, dst_dir ):
+	""" Copies the files with the extension of the engine, stored in the containers of dir_name, as plain files
+	of dst_dir (for tools that only work with files). Returns the list of extracted filenames.
+	"""
+	files_list = []
+	for container_path in list_containers( dir_name ):
+		prefix = member_name( "", engine )
+		for name in list_members( container_path ):
+			filename = name[len(prefix):]
+			if name.startswith( prefix ) and name.endswith( extension ) and '/' not in filename:
+				with open( dst_dir + "/" + filename, 'wb' ) as f:
+					f.write( read_member( container_path, name ) )
+				files_list.append( filename )
+	return files_list
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Packs the line files of a directory in per-image containers, or unpacks the containers in plain files.
+	"""
+	parser = argparse.ArgumentParser("Packs the line files of a directory in per-image containers, or unpacks the containers in plain files.")
+	parser.add_argument('-a', '--action', action="store", required=True, choices=["pack", "unpack"], help="pack: files -> containers, unpack: containers -> files.")
+	parser.add_argument('-sd', '--srcdir', action="store", required=True, help="Source directory.")
+	parser.add_argument('-dd', '--dstdir', action="store", required=True, help="Destination directory (it can be the source directory).")
+	parser.add_argument('-e', '--engine', action="store", default="", help="Engine folder of the files inside the containers (empty for the cropped lines).")
+	parser.add_argument('-x', '--extensions', action="store", default=".jpg,.png,.txt,.prob,_lines.csv", help="Comma separated extensions of the files to pack or unpack.")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if ( not os.path.isdir( args.srcdir ) ):
+		print('Error: The source directory was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	if not os.path.exists( args.dstdir ):
+		try:
+			os.makedirs( args.dstdir )
+		except:
+			print('Error: The destination directory was not found and could not be created.\n')
+			parser.print_help()
+			sys.exit(2)
+
+	extensions = tuple( args.extensions.split(',') )
+	n = 0
+	if args.action == "pack":
+		filename_list = sorted( f for f in os.listdir( args.srcdir ) if f.endswith( extensions ) and os.path.isfile( args.srcdir + "/" + f ) )
+		# The images of the lines and _lines.csv files (their fulltext files can look like line files)
+		basenames = set( own_basename( f ) for f in filename_list if f.endswith( "_lines.csv" ) )
+		basenames.update( m.group(1) for m in map( line_regex.match, filename_list ) if m is not None )
+		# One write per container
+		groups = {}
+		for filename in filename_list:
+			groups.setdefault( image_basename( filename, basenames ), [] ).append( filename )
+		for basename in groups:
+			members = []
+			for filename in groups[ basename ]:
+				with open( args.srcdir + "/" + filename, 'rb' ) as f:
+					members.append( (member_name( filename, args.engine ), f.read()) )
+			write_members( container_path_filename( args.dstdir, basename ), members )
+			n = n + len(members)
+	else:
+		for extension in extensions:
+			n = n + len( extract_files( args.srcdir, extension, args.engine, args.dstdir ) )
+
+	print("Files " + args.action + "ed: " + str(n))
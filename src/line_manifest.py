@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Indexed line manifest. The information of the cropped lines (image, line number, line
+# file, bounding box, and Google text), which get_lines_google.py appends to a global text
+# file, is stored in a SQLite database in WAL mode instead. Several extraction processes
+# can write to it at the same time (each image is one transaction, so the records are never
+# torn or interleaved), and the lines are found by specimen or line file through indexes.
+#   Used as a script, it imports a global text file of lines, exports the manifest in the
+# same text format, or looks up the lines of a specimen or a line file.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, sqlite3, sys, threading
+
+MANIFEST_EXT = ( ".sqlite", ".db" )
+# Milliseconds a writer waits for the lock of the database before failing
+BUSY_TIMEOUT = 60000
+
+SCHEMA = [
+	"CREATE TABLE IF NOT EXISTS lines ( specimen TEXT NOT NULL, line INTEGER NOT NULL, image TEXT NOT NULL, filename TEXT NOT NULL, "
+	"x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER, text TEXT, PRIMARY KEY (specimen, line) ) WITHOUT ROWID",
+	"CREATE INDEX IF NOT EXISTS lines_filename ON lines (filename)"
+]
+
+# One connection per thread and database
+connections = threading.local()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def is_manifest( path_filename ):
+	""" True if the output file is a manifest (by its extension), False if it is a plain text file.
+	"""
+	return path_filename.endswith( MANIFEST_EXT )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def connect( manifest_path ):
+	""" Returns the connection of the calling thread to the manifest, creating the database if needed.
+	"""
+	if not hasattr( connections, "dbs" ):
+		connections.dbs = {}
+	db = connections.dbs.get( manifest_path )
+	if db is None:
+		db = sqlite3.connect( manifest_path, timeout=BUSY_TIMEOUT / 1000.0 )
+		db.execute( "PRAGMA busy_timeout = " + str(BUSY_TIMEOUT) )
+		db.execute( "PRAGMA journal_mode = WAL" )
+		db.execute( "PRAGMA synchronous = NORMAL" )
+		with db:
+			for statement in SCHEMA:
+				db.execute( statement )
+		connections.dbs[ manifest_path ] = db
+	return db
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def parse_lines( text_global ):
+	""" Converts the lines of the global text file (image, line file, x1, y1, x2, y2, text; separated by tabs) into
+	the records of the manifest: (specimen, line, image, filename, x1, y1, x2, y2, text).
+	"""
+	records = []
+	for text_line in text_global.split('\n'):
+		if text_line == "":
+			continue
+		fields = text_line.split('\t', 6)
+		image, filename = fields[0], fields[1]
+		specimen = image.split('.')[0]
+		n_line = int( filename[len(specimen)+1:].split('.')[0] )
+		records.append( (specimen, n_line, image, filename, int(fields[2]), int(fields[3]), int(fields[4]), int(fields[5]), fields[6]) )
+	return records
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def add_lines( manifest_path, records ):
+	""" Inserts a batch of records in a single transaction. The previous lines of the specimens in the batch are
+	replaced, so processing an image again does not duplicate its lines.
+	"""
+	if len(records) == 0:
+		return
+	db = connect( manifest_path )
+	with db:
+		db.executemany( "DELETE FROM lines WHERE specimen = ?", [ (s,) for s in sorted( set( r[0] for r in records ) ) ] )
+		db.executemany( "INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", records )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_global( output_path_filename, text_global ):
+	""" Saves the information of the lines of one or several images: in the manifest, or appended to the global text file.
+	"""
+	if text_global == "":
+		return
+	if is_manifest( output_path_filename ):
+		add_lines( output_path_filename, parse_lines( text_global ) )
+	else:
+		with open( output_path_filename, "a+" ) as f:
+			f.write( text_global )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_specimen( manifest_path, specimen ):
+	""" Records of the lines of a specimen (image basename), in order.
+	"""
+	return connect( manifest_path ).execute( "SELECT * FROM lines WHERE specimen = ? ORDER BY line", (specimen,) ).fetchall()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_line( manifest_path, filename ):
+	""" Record of a line given the name of its file (EMEC609939_Stigmus_sp_006.jpg), or None.
+	"""
+	return connect( manifest_path ).execute( "SELECT * FROM lines WHERE filename = ?", (filename,) ).fetchone()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_records( path_filename ):
+	""" Records of all the lines, ordered by specimen and line: from a manifest, or from a global text file.
+	"""
+	if is_manifest( path_filename ):
+		return connect( path_filename ).execute( "SELECT * FROM lines ORDER BY specimen, line" ).fetchall()
+	with open( path_filename ) as f:
+		return sorted( parse_lines( f.read() ), key=lambda r: ( r[0], r[1] ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def format_record( record ):
+	""" Line of the global text file for a record of the manifest.
+	"""
+	return '\t'.join( [ record[2], record[3] ] + [ str(v) for v in record[4:8] ] + [ record[8] ] ) + "\n"
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Imports, exports, or queries a line manifest.
+	"""
+	parser = argparse.ArgumentParser("Imports, exports, or queries a line manifest.")
+	parser.add_argument('-m', '--manifest', action="store", required=True, help="Path + Filename of the manifest (.sqlite or .db).")
+	parser.add_argument('-a', '--action', action="store", required=True, choices=["import", "export", "specimen", "line"], help="import/export: from/to a global text file of lines; specimen/line: print the lines of a specimen or a line file.")
+	parser.add_argument('-f', '--file', action="store", default="", help="Global text file of lines to import or export.")
+	parser.add_argument('-v', '--value', action="store", default="", help="Specimen (image basename) or line filename to look up.")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if not is_manifest( args.manifest ):
+		print('Error: The manifest must have one of the extensions ' + ', '.join(MANIFEST_EXT) + '.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	if args.action in [ "import", "export" ] and args.file == "":
+		print('Error: The ' + args.action + ' action requires a text file.\n')
+		parser.print_help()
+		sys.exit(2)
+
+	if args.action == "import" and not os.path.isfile( args.file ):
+		print('Error: The text file (' + args.file + ') was not found.\n')
+		parser.print_help()
+		sys.exit(3)
+
+	if args.action in [ "specimen", "line" ] and args.value == "":
+		print('Error: The ' + args.action + ' to look up is required.\n')
+		parser.print_help()
+		sys.exit(4)
+
+	if args.action == "import":
+		with open( args.file ) as f:
+			records = parse_lines( f.read() )
+		add_lines( args.manifest, records )
+		print("Imported lines: " + str(len(records)))
+	elif args.action == "export":
+		n = 0
+		with open( args.file, "w+" ) as f:
+			for record in connect( args.manifest ).execute( "SELECT * FROM lines ORDER BY specimen, line" ):
+				f.write( format_record( record ) )
+				n = n + 1
+		print("Exported lines: " + str(n))
+	elif args.action == "specimen":
+		for record in get_specimen( args.manifest, args.value ):
+			sys.stdout.write( format_record( record ) )
+	else:
+		record = get_line( args.manifest, args.value )
+		if record is None:
+			print("Error: The line " + args.value + " was not found.")
+			sys.exit(5)
+		sys.stdout.write( format_record( record ) )
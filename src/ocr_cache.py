@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Content-addressed cache of the OCR results of the lines. The result of an engine for a
+# line (the text and the characters with their probabilities) is stored under the SHA-256
+# of the pixels given to the engine, the engine, its model (the SHA-256 of the model file),
+# and its parameters. So the identical crops (e.g. the same printed label in several
+# specimens, or the lines of a collection which is processed again) are only recognized
+# once, and a change of the model or of the parameters does not use the old results.
+#   The results are stored as small JSON files (in 256 subdirectories), written with a
+# temporary name and renamed, so concurrent processes never read a partial result. The
+# hits and misses of all the worker processes are counted in shared counters (new_stats),
+# reported at the end of the runs of recognizeDir_mt.py, ocropusDir_mt.py, and tessDir_mt.py.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import hashlib, json, os
+import multiprocessing
+import numpy as np
+
+# Shared counters of the lookups (see new_stats): hits, misses
+STATS = None
+HIT, MISS = 0, 1
+# SHA-256 of the model files already read by this process
+MODEL_IDS = {}
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def pixel_hash( image ):
+	""" SHA-256 (hex) of the pixels of an image (numpy array), including its shape and type.
+	"""
+	image = np.ascontiguousarray( image )
+	h = hashlib.sha256( ( str(image.shape) + str(image.dtype) ).encode('utf-8') )
+	h.update( image.data )
+	return h.hexdigest()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def model_id( path_filename ):
+	""" SHA-256 (hex) of the content of a model file (computed once per process), or "" if the file does not exist.
+	"""
+	if path_filename not in MODEL_IDS:
+		if not os.path.isfile( path_filename ):
+			return ""
+		h = hashlib.sha256()
+		with open( path_filename, 'rb' ) as f:
+			for block in iter( lambda: f.read( 1 << 20 ), b"" ):
+				h.update( block )
+		MODEL_IDS[ path_filename ] = h.hexdigest()
+	return MODEL_IDS[ path_filename ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def result_key( pixels, engine, model, params ):
+	""" Key of the result of an engine for a line: the SHA-256 of the hash of its pixels, the engine name, the model id, and
+	the parameters (string).
+	"""
+	return hashlib.sha256( "\0".join( [ pixels, engine, model, params ] ).encode('utf-8') ).hexdigest()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def cache_path_filename( cache_dir, key ):
+	""" Returns the path + filename where the result of the key is stored in the cache.
+	"""
+	return cache_dir + "/" + key[:2] + "/" + key + ".json"
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def count( index ):
+	""" Increments a shared counter (HIT or MISS), if the process has them.
+	"""
+	if STATS is not None:
+		with STATS.get_lock():
+			STATS[ index ] += 1
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def load_result( cache_dir, key ):
+	""" Returns the cached result (a dictionary) of the key, or None if it is not in the cache.
+	"""
+	if cache_dir == "":
+		return None
+
+	result_path_filename = cache_path_filename( cache_dir, key )
+	try:
+		with open( result_path_filename, 'r', encoding='utf-8' ) as f:
+			result = json.load( f )
+	except (OSError, ValueError):
+		count( MISS )
+		return None
+	count( HIT )
+	return result
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_result( cache_dir, key, result ):
+	""" Stores the result (a dictionary which can be serialized as JSON) of the key in the cache.
+	"""
+	if cache_dir == "":
+		return
+
+	result_path_filename = cache_path_filename( cache_dir, key )
+	result_dir = os.path.dirname( result_path_filename )
+	if not os.path.exists( result_dir ):
+		os.makedirs( result_dir, exist_ok=True )
+
+	tmp_path_filename = result_path_filename + "." + str(os.getpid()) + ".tmp"
+	with open( tmp_path_filename, 'w', encoding='utf-8' ) as f:
+		json.dump( result, f, ensure_ascii=False )
+	os.replace( tmp_path_filename, result_path_filename )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def new_stats():
+	""" Shared counters of the lookups (hits, misses), given to the worker processes with set_stats.
+	"""
+	return multiprocessing.Array( 'q', 2 )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def set_stats( stats ):
+	""" Sets the shared counters of the lookups of this process.
+	"""
+	global STATS
+	STATS = stats
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def report( stats ):
+	""" Text with the statistics of the shared counters.
+	"""
+	hits, misses = stats[ HIT ], stats[ MISS ]
+	rate = 100.0 * hits / ( hits + misses ) if hits + misses > 0 else 0.0
+	return "OCR cache: " + str(hits) + " hits, " + str(misses) + " misses (hit rate: " + ( "%.1f" % rate ) + "%)"
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   OCRopus stage in one command: binarizes the cropped lines (jpg) of a folder
+# (ocropus_nlbin.py) and recognizes them (recognizeDir_mt.py). Only the text and
+# probabilities files are saved in the destination folders, plus the binarized lines
+# (<line>.bin.png) with -sb.
+#   By default the stage is not in memory: a pool of processes binarizes the lines into a
+# temporary folder, and one ocropus-rpred process per line reads them back and recognizes
+# them (see recognizeDir_mt.py), as binarizeDir_mt.py and recognizeDir_mt.py do, but without
+# keeping the binarized lines. Only with -ip (ocrolib must be importable by this interpreter)
+# is the stage fused in memory: the processes of the pool load the model once, and each line
+# is binarized and recognized without writing or reading back its binarized image. If the
+# folder holds per-image line containers (see line_container.py), the results are stored in
+# the ocropus folder of the containers.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, shutil, sys, tempfile
+import multiprocessing
+import worker_profile
+import image_access, job_scheduler, line_container, ocr_cache, ocropus_batch, ocropus_nlbin, preprocess_cache, prob_io, recognizeDir_mt, triage_lines
+
+N_THREADS = worker_profile.jobs( "ocropusDir_mt", multiprocessing.cpu_count() )
+# Results stored in the containers at once
+FLUSH_N = 256
+# Seconds a line may take before its process is killed
+TIME_LIMIT = 60
+
+# State of the worker processes (see init_worker)
+INPUT_DIR = ""
+BIN_DIR = ""
+SAVE_BIN = False
+PREPROCESS_CACHE = ""
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def init_worker( model_path_filename, input_dir, txt_dir, prob_dir, bin_dir, with_prob, save_bin, container, batch_size, cache_dir="", ocr_cache_dir="", stats=None, prob_binary=False ):
+	""" Loads (once per process) the model and sets the folders (and the caches) of the worker processes of the pool.
+	"""
+	global INPUT_DIR, BIN_DIR, SAVE_BIN, PREPROCESS_CACHE
+	recognizeDir_mt.init_worker( model_path_filename, input_dir, txt_dir, prob_dir, with_prob, container, batch_size, ocr_cache_dir, stats, prob_binary )
+	INPUT_DIR, BIN_DIR, SAVE_BIN, PREPROCESS_CACHE = input_dir, bin_dir, save_bin, cache_dir
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def init_binarizer( input_dir, bin_dir, cache_dir="" ):
+	""" Sets the folders (and the preprocessing cache) of the binarization processes of recognize_rpred (no model).
+	"""
+	global INPUT_DIR, BIN_DIR, PREPROCESS_CACHE
+	INPUT_DIR, BIN_DIR, PREPROCESS_CACHE = input_dir, bin_dir, cache_dir
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def binarize( filename ):
+	""" Binarized line (uint8 array), or None if it is empty, of a cropped line (jpg) of INPUT_DIR.
+	"""
+	content = line_container.read_bytes( INPUT_DIR, filename )
+	if PREPROCESS_CACHE != "":
+		# The binarized variant of the shared preprocessing (computed once for all the engines)
+		return preprocess_cache.get_variants( content, PREPROCESS_CACHE ).get( 'bin' )
+	binary, flat = ocropus_nlbin.binarize( ocropus_nlbin.read_image_gray( content ) )
+	return binary
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def binarize_lines( filenames ):
+	""" Binarizes a list of cropped lines (jpg) of INPUT_DIR and writes them to BIN_DIR/<line>.bin.png. An empty line gets
+	no file (and no results, as ocropus-rpred). Returns the list of (filename, error message or "").
+	"""
+	results = []
+	for filename in filenames:
+		results = job_scheduler.next_item( 1, results )
+		try:
+			binary = binarize( filename )
+			if binary is not None:
+				with open( BIN_DIR + "/" + filename[:-4] + ".bin.png", "wb" ) as f:
+					f.write( ocropus_nlbin.encode_png( binary ) )
+		except Exception as e:
+			results.append( ( filename, str(e) ) )
+			continue
+		results.append( ( filename, "" ) )
+	return results
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def recognize_rpred( input_dir, files, model_folder, model_name, with_prob, txt_dir, prob_dir, bin_dir, save_bin, container, prob_binary=False,
+		n_jobs=N_THREADS, time_limit=0, retries=0, cache_dir="", chunk_size=16 ):
+	""" Binarizes the lines in a pool of processes, in a temporary folder, and recognizes them running one ocropus-rpred
+	process per line (recognizeDir_mt.txtRecognize_folder): not in memory, the binarized lines are written and read back.
+	The text and probabilities files (and the binarized lines with save_bin) are moved to their folders or, in container
+	mode, returned. Returns (result files, failed lines, list of (line, reason) of the lines over the time limit).
+	"""
+	tmp_dir = tempfile.mkdtemp()
+	for sub_dir in set( os.path.dirname(f) for f in files ):
+		if sub_dir != "" and not os.path.exists( tmp_dir + "/" + sub_dir ):
+			os.makedirs( tmp_dir + "/" + sub_dir )
+	failed = []
+	quarantine = []
+	chunks = [ files[i:i + max(1, chunk_size)] for i in range( 0, len(files), max(1, chunk_size) ) ]
+	for chunk, results, error in job_scheduler.run_tasks( binarize_lines, chunks, n_jobs, time_limit, retries, init_binarizer, ( input_dir, tmp_dir, cache_dir ) ):
+		if error != "":
+			failed.extend( chunk )
+			quarantine.extend( ( filename, error ) for filename in chunk )
+			continue
+		for filename, error in results:
+			if error != "":
+				failed.append( filename )
+				print("Error: " + filename + ": " + error)
+
+	# The empty lines have no .bin.png (and no results)
+	rpred_failed, rpred_quarantine = recognizeDir_mt.txtRecognize_folder( tmp_dir, model_folder, model_name, with_prob, {}, n_jobs, time_limit, retries )
+	quarantine.extend( ( filename[:-8] + ".jpg", reason ) for filename, reason in rpred_quarantine )
+	recognized = [ f for f in files if f not in failed and os.path.isfile( tmp_dir + "/" + f[:-4] + ".bin.png" ) ]
+	result_files, missing = recognizeDir_mt.collect_results( tmp_dir, recognized, txt_dir, prob_dir, container, prob_binary )
+	failed.extend( missing )
+	if save_bin:
+		for f in recognized:
+			bin_filename = f[:-4] + ".bin.png"
+			if not os.path.isfile( tmp_dir + "/" + bin_filename ):
+				continue
+			if container:
+				with open( tmp_dir + "/" + bin_filename, 'rb' ) as f_bin:
+					result_files.append( (os.path.basename( bin_filename ), f_bin.read()) )
+			else:
+				shutil.move( tmp_dir + "/" + bin_filename, bin_dir + "/" + bin_filename )
+	shutil.rmtree( tmp_dir )
+	return ( result_files, failed, quarantine )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def load_line( filename ):
+	""" Binarizes a cropped line (jpg) of INPUT_DIR for recognizeDir_mt.recognize_images: returns (binarized line as a
+	grayscale array in [0, 1], or None if it is empty, other result files). With SAVE_BIN, the binarized line is written
+	to BIN_DIR/<line>.bin.png or, in container mode, returned as a result file.
+	"""
+	binary = binarize( filename )
+	if binary is None:
+		# Empty line: no result files, as ocropus-rpred
+		return ( None, [] )
+	other_files = []
+	if SAVE_BIN:
+		bin_png = ocropus_nlbin.encode_png( binary )
+		if recognizeDir_mt.CONTAINER:
+			other_files = [ ( os.path.basename( filename[:-4] ) + ".bin.png", bin_png ) ]
+		else:
+			with open( BIN_DIR + "/" + filename[:-4] + ".bin.png", "wb" ) as f:
+				f.write( bin_png )
+	# The same values as reading the .bin.png back
+	return ( binary / 255.0, other_files )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def process_lines( filenames ):
+	""" Binarizes and recognizes a list of cropped lines (jpg) of INPUT_DIR. Returns the list of (filename, result files,
+	error message or ""); the result files ([(name, bytes)] of the .txt, .prob, and .bin.png files) are only returned in
+	container mode, otherwise they are written to their folders.
+	"""
+	return recognizeDir_mt.recognize_images( filenames, load_line )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" MAIN """
+	parser = argparse.ArgumentParser("Using OCROPY, binarizes and recognizes the cropped lines of a folder in one command (in memory with -ip)")
+	parser.add_argument('-if', '--input_folder', action="store", required=True, help="Directory with the jpg files of the lines (or line containers).")
+	parser.add_argument('-mf', '--model_folder', action="store", required=True, help="Directory where the OCR model is stored.")
+	parser.add_argument('-mn', '--model_name', action="store", required=True, help="Filename of the OCR model to use during the recognition process.")
+	parser.add_argument('-p', '--probabilities', action="store", required=True, help="Include the probabilities file or not: True or False.")
+	parser.add_argument('-td', '--txt_dir', action="store", default="", help="Directory where the text files are saved (default: the input folder). Not used with line containers.")
+	parser.add_argument('-pd', '--prob_dir', action="store", default="", help="Directory where the probabilities files are saved (default: the input folder). Not used with line containers.")
+	parser.add_argument('-sb', '--save_bin', action="store_true", help="Save also the binarized lines (<line>.bin.png).")
+	parser.add_argument('-bd', '--bin_dir', action="store", default="", help="Directory where the binarized lines are saved with -sb (default: the input folder). Not used with line containers.")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=N_THREADS, help="Maximum number of concurrent processes.")
+	parser.add_argument('-sk', '--skip_list', action="store", default="", help="Skip list of the lines which are not processed (see triage_lines.py).")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=64, help="Number of lines sent to each process at once.")
+	parser.add_argument('-so', '--schedule_order', action="store", default="cost", choices=["cost", "walk"], help="cost: send the lines in decreasing order of width x height (read from their headers), in chunks of decreasing size (up to chunk_size lines); walk: in the order of the folders, in chunks of chunk_size lines.")
+	parser.add_argument('-ip', '--in_process', action="store_true", help="Binarize and recognize the lines in memory, in the processes of the pool, which load the model once with ocrolib (it must be importable by this Python interpreter), instead of writing the binarized lines to a temporary folder and running one ocropus-rpred process per line.")
+	parser.add_argument('-bs', '--batch_size', action="store", type=int, default=ocropus_batch.MAX_BATCH, help="Maximum number of lines of similar width recognized at once with -ip (1: one by one, with ocrolib).")
+	parser.add_argument('-pc', '--preprocess_cache', action="store", default="", help="Cache folder of the preprocessed lines (see preprocess_cache.py), shared with tessDir_mt.py.")
+	parser.add_argument('-oc', '--ocr_cache', action="store", default="", help="Cache folder of the OCR results (see ocr_cache.py), shared with recognizeDir_mt.py. Only used with -ip.")
+	parser.add_argument('-pf', '--prob_format', action="store", default="text", choices=prob_io.FORMATS, help="Format of the probabilities files (see prob_io.py).")
+	parser.add_argument('-tl', '--time_limit', action="store", type=float, default=TIME_LIMIT, help="Seconds a line may take before its process is killed and replaced (0: no limit).")
+	parser.add_argument('-rt', '--retries', action="store", type=int, default=1, help="Times a line over the time limit is tried again before it is quarantined.")
+	parser.add_argument('-qf', '--quarantine_file', action="store", default="", help="Path + Filename where the lines over the time limit are appended (with the format of the skip list).")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if ( not os.path.isdir( args.input_folder ) ):
+		print('Error: The directory of the jpg files was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+	if ( not os.path.isfile( args.model_folder + "/" + args.model_name) ):
+		print('Error: The model file was not found.\n')
+		parser.print_help()
+		sys.exit(2)
+	if ( args.probabilities != "True" ) and ( args.probabilities != "False" ):
+		print('Error: The probabilities values must be True or False.\n')
+		parser.print_help()
+		sys.exit(3)
+
+	txt_dir = args.txt_dir if args.txt_dir != "" else args.input_folder
+	prob_dir = args.prob_dir if args.prob_dir != "" else args.input_folder
+	bin_dir = args.bin_dir if args.bin_dir != "" else args.input_folder
+	for dst_dir in [ txt_dir, prob_dir, bin_dir ]:
+		if not os.path.exists( dst_dir ):
+			try:
+				os.makedirs( dst_dir )
+			except:
+				print('Error: The destination directory (' + dst_dir + ') was not found and could not be created.\n')
+				parser.print_help()
+				sys.exit(4)
+
+	with_prob = args.probabilities == "True"
+	with_containers = len( line_container.list_containers( args.input_folder ) ) > 0
+
+	# Lines of the folder, its subfolders, and its containers (the outputs keep the same subfolders)
+	skip = triage_lines.load_skip_list( args.skip_list )
+	files = job_scheduler.walk_files( args.input_folder, '.jpg' ) + line_container.list_files( args.input_folder, '.jpg' )
+	files = sorted(set(f for f in files if os.path.basename(f)[:-4] not in skip))
+	for sub_dir in set( os.path.dirname(f) for f in files ):
+		for dst_dir in [ txt_dir, prob_dir, bin_dir ]:
+			if sub_dir != "" and not os.path.exists( dst_dir + "/" + sub_dir ):
+				os.makedirs( dst_dir + "/" + sub_dir )
+
+	if not args.in_process:
+		result_files, failed, quarantine = recognize_rpred( args.input_folder, files, args.model_folder, args.model_name, with_prob, txt_dir, prob_dir, bin_dir,
+			args.save_bin, with_containers, args.prob_format == "binary", args.jobs, args.time_limit, args.retries, args.preprocess_cache, args.chunk_size )
+		if len(result_files) > 0:
+			line_container.write_files( args.input_folder, result_files, "ocropus", True )
+	else:
+		# Each process loads the model once and receives the lines in chunks. The processes over the time limit are replaced,
+		# and their lines tried again one by one
+		failed = []
+		quarantine = []
+		result_files = []
+		stats = ocr_cache.new_stats()
+		initargs = ( args.model_folder + "/" + args.model_name, args.input_folder, txt_dir, prob_dir, bin_dir, with_prob, args.save_bin, with_containers, max(1, args.batch_size), args.preprocess_cache, args.ocr_cache, stats, args.prob_format == "binary" )
+		if args.schedule_order == "cost":
+			# Longest job first: the widest lines are sent first, and the chunks get smaller towards the end
+			chunks = job_scheduler.cost_chunks( files, [ image_access.line_cost( args.input_folder, f ) for f in files ], args.jobs, args.chunk_size )
+		else:
+			chunks = [ files[i:i + max(1, args.chunk_size)] for i in range( 0, len(files), max(1, args.chunk_size) ) ]
+		for chunk, results, error in job_scheduler.run_tasks( process_lines, chunks, args.jobs, args.time_limit, args.retries, init_worker, initargs ):
+			if error != "":
+				failed.extend( chunk )
+				quarantine.extend( ( filename, error ) for filename in chunk )
+				continue
+			for filename, files_list, error in results:
+				if error != "":
+					failed.append( filename )
+					print("Error: " + filename + ": " + error)
+				else:
+					result_files.extend( files_list )
+			if len(result_files) >= FLUSH_N:
+				line_container.write_files( args.input_folder, result_files, "ocropus", True )
+				result_files = []
+		if len(result_files) > 0:
+			line_container.write_files( args.input_folder, result_files, "ocropus", True )
+
+	triage_lines.save_quarantine( args.quarantine_file, quarantine )
+	if args.in_process and args.ocr_cache != "":
+		print( ocr_cache.report( stats ) )
+	print("Lines: " + str(len(files)) + ", failed: " + str(len(failed)) + ", quarantined: " + str(len(quarantine)))
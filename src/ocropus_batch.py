@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Batched forward pass of the bidirectional LSTM of the OCRopus models (ocrolib
+# SeqRecognizer: Stacked([Parallel(LSTM, Reversed(LSTM)), Softmax])). The normalized lines
+# are grouped in buckets of similar width and each bucket is computed at once: the input
+# weights of all the timesteps in one matrix product, and the recurrent weights of each
+# timestep as a (lines x hidden) matrix product, instead of one matrix-vector product per
+# line and timestep. The reversed LSTM reads every line from its own end, so the padding
+# does not change the outputs: they match the recognition of the lines one by one.
+#   The CTC decoding (translate_back) and the per-character probabilities are computed
+# afterwards for each line.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import numpy as np
+from scipy import ndimage
+
+# Maximum number of lines per batch, and maximum ratio between the widest and the narrowest line of a bucket
+MAX_BATCH = 16
+BUCKET_RATIO = 1.25
+# Threshold of the blank class in the CTC decoding (ocrolib.lstm.translate_back)
+THRESHOLD = 0.7
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def sigmoid( x ):
+	""" Logistic function (ocrolib.lstm.sigmoid), with the argument clipped to avoid overflows.
+	"""
+	return 1.0 / ( 1.0 + np.exp( -np.clip( x, -200, 200 ) ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def lstm_weights( lstm ):
+	""" Weights of an ocrolib LSTM: (W, peepholes), where W stacks the input, forget, output, and cell weights
+	(4*Ns x 1+Ni+Ns), and peepholes are (WIP, WFP, WOP).
+	"""
+	W = np.vstack( [ lstm.WGI, lstm.WGF, lstm.WGO, lstm.WCI ] ).astype( np.float64 )
+	return ( W, ( np.asarray(lstm.WIP, np.float64), np.asarray(lstm.WFP, np.float64), np.asarray(lstm.WOP, np.float64) ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def load_weights( network ):
+	""" Weights of an ocrolib SeqRecognizer (e.g. en-default.pyrnn.gz): {'forward', 'backward': LSTM weights, 'softmax': W2}.
+	"""
+	bidi, softmax = network.lstm.nets
+	forward, backward = bidi.nets
+	return { 'forward': lstm_weights( forward ), 'backward': lstm_weights( backward.net ), 'softmax': np.asarray( softmax.W2, np.float64 ) }
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def lstm_line( weights, xs ):
+	""" Reference forward pass of an LSTM over one line (timesteps x Ni), one matrix-vector product per timestep, as
+	ocrolib.lstm.forward_py. Returns the outputs (timesteps x Ns).
+	"""
+	W, ( WIP, WFP, WOP ) = weights
+	ns = len( WIP )
+	n = len( xs )
+	output = np.zeros( (n, ns) )
+	state = np.zeros( (n, ns) )
+	for t in range( n ):
+		prev = np.zeros( ns ) if t == 0 else output[t-1]
+		gix, gfx, gox, cix = np.split( np.dot( W, np.concatenate( [ [1.0], xs[t], prev ] ) ), 4 )
+		if t > 0:
+			gix = gix + WIP * state[t-1]
+			gfx = gfx + WFP * state[t-1]
+		gi = sigmoid( gix )
+		gf = sigmoid( gfx )
+		ci = np.tanh( cix )
+		state[t] = ci * gi
+		if t > 0:
+			state[t] = state[t] + gf * state[t-1]
+			gox = gox + WOP * state[t]
+		output[t] = np.tanh( state[t] ) * sigmoid( gox )
+	return output
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def lstm_batch( weights, X ):
+	""" Forward pass of an LSTM over a padded batch X (timesteps x lines x Ni). The lines start at timestep 0, so the
+	padding at their end does not change their outputs. Returns the outputs (timesteps x lines x Ns).
+	"""
+	W, ( WIP, WFP, WOP ) = weights
+	ns = len( WIP )
+	n, b, ni = X.shape
+	# Bias and input weights of all the timesteps in one product; the recurrent weights per timestep
+	Wx = W[ :, :1+ni ]
+	Wh = W[ :, 1+ni: ].T.copy()
+	G = np.dot( X.reshape( n * b, ni ), Wx[ :, 1: ].T ).reshape( n, b, 4 * ns )
+	G += Wx[ :, 0 ]
+
+	output = np.zeros( (n, b, ns) )
+	state = np.zeros( (b, ns) )
+	for t in range( n ):
+		g = G[t] if t == 0 else G[t] + np.dot( output[t-1], Wh )
+		gix, gfx, gox, cix = g[:, :ns], g[:, ns:2*ns], g[:, 2*ns:3*ns], g[:, 3*ns:]
+		if t > 0:
+			gix = gix + WIP * state
+			gfx = gfx + WFP * state
+		gi = sigmoid( gix )
+		ci = np.tanh( cix )
+		if t > 0:
+			state = ci * gi + sigmoid( gfx ) * state
+			gox = gox + WOP * state
+		else:
+			state = ci * gi
+		output[t] = np.tanh( state ) * sigmoid( gox )
+	return output
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def softmax( W2, ys ):
+	""" Softmax layer (ocrolib.lstm.Softmax) over the rows of ys (... x 2*Ns).
+	"""
+	z = np.dot( ys, W2[ :, 1: ].T ) + W2[ :, 0 ]
+	z = np.exp( np.clip( z, -100, 100 ) )
+	return z / np.sum( z, axis=-1, keepdims=True )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def forward_line( weights, xs ):
+	""" Outputs (timesteps x classes) of the network for one prepared line, one timestep at a time (reference).
+	"""
+	ys_f = lstm_line( weights['forward'], xs )
+	ys_b = lstm_line( weights['backward'], xs[::-1] )[::-1]
+	return softmax( weights['softmax'], np.hstack( [ ys_f, ys_b ] ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def forward_batch( weights, lines ):
+	""" Outputs (timesteps x classes) of the network for each prepared line (timesteps x Ni) of a batch.
+	"""
+	lengths = [ len(xs) for xs in lines ]
+	n = max( lengths )
+	X = np.zeros( (n, len(lines), lines[0].shape[1]) )
+	X_rev = np.zeros( X.shape )
+	for i, xs in enumerate( lines ):
+		X[ :len(xs), i ] = xs
+		X_rev[ :len(xs), i ] = xs[::-1]
+
+	Y = lstm_batch( weights['forward'], X )
+	Y_rev = lstm_batch( weights['backward'], X_rev )
+	outputs = []
+	for i, length in enumerate( lengths ):
+		ys = np.hstack( [ Y[ :length, i ], Y_rev[ :length, i ][::-1] ] )
+		outputs.append( softmax( weights['softmax'], ys ) )
+	return outputs
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def buckets( lengths, max_batch=MAX_BATCH, ratio=BUCKET_RATIO ):
+	""" Groups the indices of the lines in batches of at most max_batch lines of similar width (the widest line is at
+	most ratio times the narrowest one), to limit the padding.
+	"""
+	batches = []
+	batch = []
+	for i in sorted( range(len(lengths)), key=lambda i: lengths[i] ):
+		if len(batch) > 0 and ( len(batch) >= max_batch or lengths[i] > ratio * lengths[ batch[0] ] ):
+			batches.append( batch )
+			batch = []
+		batch.append( i )
+	if len(batch) > 0:
+		batches.append( batch )
+	return batches
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def forward_lines( weights, lines, max_batch=MAX_BATCH, ratio=BUCKET_RATIO ):
+	""" Outputs of the network for a list of prepared lines, computed in width buckets. The outputs are in the order of
+	the lines.
+	"""
+	outputs = [ None ] * len(lines)
+	for batch in buckets( [ len(xs) for xs in lines ], max_batch, ratio ):
+		for i, ys in zip( batch, forward_batch( weights, [ lines[i] for i in batch ] ) ):
+			outputs[i] = ys
+	return outputs
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def translate_back( outputs, threshold=THRESHOLD ):
+	""" CTC decoding of the outputs of a line (ocrolib.lstm.translate_back with pos=2): the most probable class of each
+	region between blanks. Returns the list of (class, probability).
+	"""
+	labels, n = ndimage.label( outputs[:,0] < threshold )
+	if n == 0:
+		return []
+	mask = np.tile( labels.reshape(-1,1), (1, outputs.shape[1]) )
+	maxima = ndimage.maximum_position( outputs, mask, np.arange( 1, n + 1 ) )
+	return [ ( c, outputs[r,c] ) for ( r, c ) in maxima ]
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   In-process version of the binarization of OCRopus (ocropus-nlbin): background flattening
+# with percentile filters, skew correction, and thresholding between the low and high
+# percentiles of the regions with variance. It is imported once by the processes of
+# binarizeDir_mt.py, instead of starting one ocropus-nlbin process (interpreter plus SciPy
+# imports) for each line.
+#   The parameters are the defaults of ocropus-nlbin.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import io
+from PIL import Image
+import numpy as np
+from scipy import ndimage
+
+# Parameters of ocropus-nlbin
+THRESHOLD = 0.5     # threshold, determines lightness
+ZOOM = 0.5          # zoom for page background estimation, smaller=faster
+ESCALE = 1.0        # scale for estimating a mask over the text region
+BIGNORE = 0.1       # ignore this much of the border for threshold estimation
+PERC = 80           # percentage for filters
+RANGE = 20          # range for filters
+MAXSKEW = 2.0       # skew angle estimation parameters (degrees)
+LO = 5              # percentile for black estimation
+HI = 90             # percentile for white estimation
+SKEWSTEPS = 8       # steps for skew angle estimation (per degree)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_image_gray( content ):
+	""" Decodes an image (bytes) as a grayscale float array in [0, 1], like ocrolib.read_image_gray.
+	"""
+	image = np.asarray( Image.open( io.BytesIO( content ) ) )
+	if image.dtype == np.uint8:
+		image = image / 255.0
+	if image.ndim == 3:
+		image = np.mean( image[:,:,:3], axis=2 )
+	return image.astype( np.float64 )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def estimate_skew_angle( image, angles ):
+	""" Angle (of the candidates) which maximizes the variance of the mean of the rows of the rotated image.
+	"""
+	estimates = []
+	for a in angles:
+		v = np.mean( ndimage.rotate( image, a, order=0, mode='constant' ), axis=1 )
+		estimates.append( ( np.var(v), a ) )
+	return max( estimates )[1]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def binarize( image ):
+	""" Binarizes a grayscale image in [0, 1] (ocropus-nlbin -n). Returns (binary image as uint8 0/255, normalized
+	grayscale image), or (None, None) if the image is empty.
+	"""
+	image = image - np.amin( image )
+	if np.amax( image ) == 0:
+		return ( None, None )
+	image = image / np.amax( image )
+
+	# Flatten the background (unless the image is already almost binary)
+	extreme = ( np.sum( image < 0.05 ) + np.sum( image > 0.95 ) ) * 1.0 / np.prod( image.shape )
+	if extreme > 0.95:
+		flat = image
+	else:
+		m = ndimage.zoom( image, ZOOM )
+		m = ndimage.percentile_filter( m, PERC, size=(RANGE, 2) )
+		m = ndimage.percentile_filter( m, PERC, size=(2, RANGE) )
+		m = ndimage.zoom( m, 1.0 / ZOOM )
+		w, h = np.minimum( np.array(image.shape), np.array(m.shape) )
+		flat = np.clip( image[:w,:h] - m[:w,:h] + 1, 0, 1 )
+
+	# Estimate and correct the skew
+	if MAXSKEW > 0:
+		d0, d1 = flat.shape
+		o0, o1 = int(BIGNORE * d0), int(BIGNORE * d1)
+		flat = np.amax( flat ) - flat
+		flat -= np.amin( flat )
+		est = flat[ o0:d0-o0, o1:d1-o1 ]
+		ms = int( 2 * MAXSKEW * SKEWSTEPS )
+		angle = estimate_skew_angle( est, np.linspace( -MAXSKEW, MAXSKEW, ms + 1 ) )
+		flat = ndimage.rotate( flat, angle, mode='constant', reshape=0 )
+		flat = np.amax( flat ) - flat
+
+	# Estimate the low and high thresholds, only in the regions with significant variance
+	d0, d1 = flat.shape
+	o0, o1 = int(BIGNORE * d0), int(BIGNORE * d1)
+	est = flat[ o0:d0-o0, o1:d1-o1 ]
+	if ESCALE > 0:
+		e = ESCALE
+		v = est - ndimage.gaussian_filter( est, e * 20.0 )
+		v = ndimage.gaussian_filter( v ** 2, e * 20.0 ) ** 0.5
+		v = ( v > 0.3 * np.amax(v) )
+		v = ndimage.binary_dilation( v, structure=np.ones( (int(e * 50), 1) ) )
+		v = ndimage.binary_dilation( v, structure=np.ones( (1, int(e * 50)) ) )
+		if np.any( v ):
+			est = est[ v ]
+	lo = np.percentile( est.ravel(), LO )
+	hi = np.percentile( est.ravel(), HI )
+	flat -= lo
+	flat /= max( hi - lo, 1e-6 )
+	flat = np.clip( flat, 0, 1 )
+
+	binary = 255 * ( flat > THRESHOLD ).astype( np.uint8 )
+	return ( binary, flat )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def encode_png( image ):
+	""" PNG encoding (bytes) of a grayscale uint8 image.
+	"""
+	output = io.BytesIO()
+	Image.fromarray( image, 'L' ).save( output, 'PNG' )
+	return output.getvalue()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def binarize_content( content, with_gray=False ):
+	""" Binarizes an encoded image. Returns the PNG encodings of the binarized image (.bin.png) and, with with_gray, of the
+	normalized grayscale image (.nrm.png, None otherwise); (None, None) if the image is empty.
+	"""
+	binary, flat = binarize( read_image_gray( content ) )
+	if binary is None:
+		return ( None, None )
+	gray_png = encode_png( ( 255 * flat ).astype( np.uint8 ) ) if with_gray else None
+	return ( encode_png( binary ), gray_png )
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Shared preprocessing of the cropped lines for the OCR engines. Each crop is decoded and
+# preprocessed once, and its variants are stored in a cache folder:
+#   - gray: grayscale (uint8), the image given to Tesseract (which thresholds it itself). It is
+#           not deskewed, so Tesseract gets the same image as without the cache.
+#   - bin:  binarized and deskewed (uint8 0/255), as ocropus-nlbin (ocropus_nlbin.py); the
+#           input of the OCRopus recognition.
+#   - nrm:  normalized and deskewed grayscale (uint8), as the .nrm.png of ocropus-nlbin.
+#   The key of a crop is the SHA-256 of its encoded bytes plus the preprocessing parameters,
+# so a crop changed or preprocessed with other parameters is not taken from the cache. The
+# variants of a crop are stored in one compressed .npz file (in 256 subdirectories), written with a
+# temporary name and renamed, so concurrent processes never read a partial file.
+#   Run as a script, it fills the cache for the lines of a folder, to
+# be used later with the -pc option of ocropusDir_mt.py and tessDir_mt.py.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, hashlib, io, os, sys
+import multiprocessing
+import numpy as np
+import job_scheduler, line_container, ocropus_nlbin, triage_lines
+
+CORES_N = multiprocessing.cpu_count()
+INPUT_DIR = ""
+CACHE_DIR = ""
+# Version of the preprocessing (changed when the computation of the variants changes)
+VERSION = "1"
+
+# Cache lookups of this process
+HITS = 0
+MISSES = 0
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def params_key():
+	""" Returns the string with the version and the ocropus-nlbin parameters of the preprocessing (part of the cache key).
+	"""
+	params = [ VERSION, ocropus_nlbin.THRESHOLD, ocropus_nlbin.ZOOM, ocropus_nlbin.ESCALE, ocropus_nlbin.BIGNORE, ocropus_nlbin.PERC,
+		ocropus_nlbin.RANGE, ocropus_nlbin.MAXSKEW, ocropus_nlbin.LO, ocropus_nlbin.HI, ocropus_nlbin.SKEWSTEPS ]
+	return ",".join( str(p) for p in params )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def cache_path_filename( cache_dir, content ):
+	""" Returns the path + filename where the variants of the crop (encoded bytes) are stored in the cache.
+	"""
+	key = hashlib.sha256( content + b"\0" + params_key().encode('utf-8') ).hexdigest()
+	return cache_dir + "/" + key[:2] + "/" + key + ".npz"
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def preprocess( content ):
+	""" Decodes the crop (encoded bytes) and computes its variants: {'gray', 'bin', 'nrm'} (uint8 arrays). Only 'bin' and 'nrm'
+	are deskewed; they are missing if the crop is empty (no ink).
+	"""
+	image = ocropus_nlbin.read_image_gray( content )
+	variants = { 'gray': np.round( 255 * image ).astype( np.uint8 ) }
+	binary, flat = ocropus_nlbin.binarize( image )
+	if binary is not None:
+		variants['bin'] = binary
+		variants['nrm'] = ( 255 * flat ).astype( np.uint8 )
+	return variants
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def load_variants( cache_dir, content ):
+	""" Returns the cached variants of the crop (encoded bytes), or None if they are not in the cache.
+	"""
+	if cache_dir == "":
+		return None
+
+	variants_path_filename = cache_path_filename( cache_dir, content )
+	if not os.path.isfile( variants_path_filename ):
+		return None
+
+	with np.load( variants_path_filename ) as data:
+		return { name: data[name] for name in data.files }
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_variants( cache_dir, content, variants ):
+	""" Stores the variants of the crop (encoded bytes) in the cache.
+	"""
+	if cache_dir == "":
+		return
+
+	variants_path_filename = cache_path_filename( cache_dir, content )
+	variants_dir = os.path.dirname( variants_path_filename )
+	if not os.path.exists( variants_dir ):
+		os.makedirs( variants_dir, exist_ok=True )
+
+	output = io.BytesIO()
+	np.savez_compressed( output, **variants )
+	tmp_path_filename = variants_path_filename + "." + str(os.getpid()) + ".tmp"
+	with open( tmp_path_filename, 'wb' ) as f:
+		f.write( output.getvalue() )
+	os.replace( tmp_path_filename, variants_path_filename )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def get_variants( content, cache_dir="" ):
+	""" Returns the variants of the crop (encoded bytes). The cache is checked first; the crop is only preprocessed (and its
+	variants stored) when it is not cached.
+	"""
+	global HITS, MISSES
+	variants = load_variants( cache_dir, content )
+	if variants is not None:
+		HITS += 1
+		return variants
+
+	MISSES += 1
+	variants = preprocess( content )
+	save_variants( cache_dir, content, variants )
+	return variants
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def init_worker( input_dir, cache_dir ):
+	""" Sets the folders of the worker processes of the pool.
+	"""
+	global INPUT_DIR, CACHE_DIR
+	INPUT_DIR, CACHE_DIR = input_dir, cache_dir
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def fill_lines( filenames ):
+	""" Preprocesses (if they are not cached) a list of cropped lines of INPUT_DIR. Returns (hits, misses, errors).
+	"""
+	hits, misses = HITS, MISSES
+	errors = 0
+	for filename in filenames:
+		try:
+			get_variants( line_container.read_bytes( INPUT_DIR, filename ), CACHE_DIR )
+		except Exception as e:
+			print("Error: " + filename + ": " + str(e))
+			errors += 1
+	return ( HITS - hits, MISSES - misses, errors )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" MAIN """
+	parser = argparse.ArgumentParser("Preprocesses the cropped lines of a folder once, and stores their variants (grayscale, binarized, normalized) in a cache.")
+	parser.add_argument('-if', '--input_folder', action="store", required=True, help="Directory with the jpg files of the lines (or line containers).")
+	parser.add_argument('-pc', '--preprocess_cache', action="store", required=True, help="Cache folder of the preprocessed variants.")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=CORES_N, help="Maximum number of concurrent processes.")
+	parser.add_argument('-sk', '--skip_list', action="store", default="", help="Skip list of the lines which are not processed (see triage_lines.py).")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=64, help="Number of lines sent to each process at once.")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if ( not os.path.isdir( args.input_folder ) ):
+		print('Error: The directory of the jpg files was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	skip = triage_lines.load_skip_list( args.skip_list )
+	files = job_scheduler.walk_files( args.input_folder, '.jpg' ) + line_container.list_files( args.input_folder, '.jpg' )
+	files = sorted(set(f for f in files if os.path.basename(f)[:-4] not in skip))
+
+	hits, misses, errors = 0, 0, 0
+	chunks = [ files[i:i + max(1, args.chunk_size)] for i in range( 0, len(files), max(1, args.chunk_size) ) ]
+	p = multiprocessing.Pool( max(1, args.jobs), init_worker, (args.input_folder, args.preprocess_cache) )
+	for h, m, e in p.imap_unordered( fill_lines, chunks ):
+		hits, misses, errors = hits + h, misses + m, errors + e
+	p.close()
+	p.join()
+
+	print("Lines: " + str(len(files)) + ", cached: " + str(hits) + ", preprocessed: " + str(misses) + ", failed: " + str(errors))
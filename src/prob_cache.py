@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Columnar cache of the parsed probabilities files (.prob) of a directory of an OCR engine
+# (plain files and/or the engine folder of its line containers). The first time, all the
+# files are read (text or binary format, see prob_io.py) and packed in three arrays: the
+# concatenated code points of the symbols (uint32), their probabilities (float64), and the
+# offset of each file in them (int64), plus the list of the filenames. The arrays are stored
+# as .npy files and memory-mapped by the later runs, so the voting and consensus scripts
+# (getLinesAccepted.py, getLinesAccepted_Match3.py, getLinesRejected.py, and
+# accept_from_ngrams.py, option -pc) do not open every probabilities file again.
+#   A cache is identified by the directory and the engine, plus a digest of the names,
+# modification times, and sizes of the .prob files and line containers of the directory.
+# When any of them changes, the digest does not match and the cache is built again (the old
+# one is removed). The cache is written with a temporary name and renamed.
+#   Used as a script, it builds (or checks) the caches of a list of directories.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, hashlib, json, os, shutil, sys, time
+import numpy as np
+import line_container, prob_io
+
+VERSION = 2
+# Caches opened by this process: (absolute directory, engine) -> {'index', 'offsets', 'codes', 'probs', 'errors'}
+CACHES = {}
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def cache_key( dir_name, engine="" ):
+	""" Name of the caches of a directory of an engine (the digest of its sources is appended).
+	"""
+	return hashlib.sha1( ( os.path.abspath( dir_name ) + "\0" + engine ).encode('utf-8') ).hexdigest()[:16]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def source_digest( dir_name, engine="" ):
+	""" Digest of the names, modification times (ns), and sizes of the .prob files and line containers of the directory.
+	"""
+	sources = []
+	with os.scandir( dir_name ) as entries:
+		for entry in entries:
+			if ( entry.name.endswith( '.prob' ) or entry.name.endswith( line_container.CONTAINER_EXT ) ) and entry.is_file():
+				st = entry.stat()
+				sources.append( entry.name + "\t" + str(st.st_mtime_ns) + "\t" + str(st.st_size) )
+	sources.sort()
+	h = hashlib.sha1( ( str(VERSION) + "\0" + engine + "\0" ).encode('utf-8') )
+	h.update( "\n".join( sources ).encode('utf-8', 'surrogateescape') )
+	return h.hexdigest()[:16]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def build_cache( dir_name, engine, cache_path ):
+	""" Reads all the probabilities files of the directory and stores their arrays in cache_path. Returns the number of files.
+	"""
+	names, codes_list, probs_list, errors = [], [], [], []
+	for filename in sorted( line_container.list_files( dir_name, '.prob', engine ) ):
+		try:
+			codes, probs = prob_io.read_prob( dir_name, filename, engine )
+		except (IOError, ValueError, UnicodeDecodeError) as e:
+			# Not cached: the scripts read it from the directory (and get the same error)
+			print("Warning: " + filename + " was not cached: " + str(e))
+			errors.append( filename )
+			continue
+		names.append( filename )
+		codes_list.append( codes.astype( np.uint32 ) )
+		probs_list.append( probs.astype( np.float64 ) )
+
+	offsets = np.zeros( len(names) + 1, dtype=np.int64 )
+	offsets[1:] = np.cumsum( [ len(c) for c in codes_list ], dtype=np.int64 )
+	tmp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+	os.makedirs( tmp_path )
+	np.save( tmp_path + "/codes.npy", np.concatenate( codes_list ) if len(names) > 0 else np.zeros( 0, dtype=np.uint32 ) )
+	np.save( tmp_path + "/probs.npy", np.concatenate( probs_list ) if len(names) > 0 else np.zeros( 0, dtype=np.float64 ) )
+	np.save( tmp_path + "/offsets.npy", offsets )
+	with open( tmp_path + "/files.json", 'w' ) as f:
+		json.dump( { "dir": os.path.abspath( dir_name ), "engine": engine, "files": names, "errors": errors }, f )
+	try:
+		os.rename( tmp_path, cache_path )
+	except OSError:
+		# Built at the same time by another process
+		shutil.rmtree( tmp_path, ignore_errors=True )
+	return len(names)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def load_array( path_filename ):
+	""" Memory-mapped array of a .npy file (read into memory if it is empty, since an empty file cannot be mapped).
+	"""
+	try:
+		return np.asarray( np.load( path_filename, mmap_mode='r' ) )
+	except ValueError:
+		return np.load( path_filename )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def open_cache( dir_name, engine, cache_dir ):
+	""" Opens the cache of the probabilities files of the directory of the engine (it is built, or built again if the files
+	changed). Returns (number of files, True if it was built).
+	"""
+	key = cache_key( dir_name, engine )
+	cache_path = cache_dir + "/" + key + "_" + source_digest( dir_name, engine )
+	built = False
+	if not os.path.isfile( cache_path + "/files.json" ):
+		if not os.path.exists( cache_dir ):
+			os.makedirs( cache_dir, exist_ok=True )
+		build_cache( dir_name, engine, cache_path )
+		built = True
+		# The caches of previous versions of the directory are removed
+		for name in os.listdir( cache_dir ):
+			if name.startswith( key + "_" ) and cache_dir + "/" + name != cache_path and not name.endswith( ".tmp" ):
+				shutil.rmtree( cache_dir + "/" + name, ignore_errors=True )
+
+	with open( cache_path + "/files.json", 'r' ) as f:
+		files = json.load( f )
+	names = files["files"]
+	CACHES[ ( os.path.abspath( dir_name ), engine ) ] = { 'index': { name: i for i, name in enumerate( names ) },
+		'offsets': load_array( cache_path + "/offsets.npy" ).tolist(), 'codes': load_array( cache_path + "/codes.npy" ),
+		'probs': load_array( cache_path + "/probs.npy" ), 'errors': files["errors"] }
+	return ( len(names), built )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def list_files( dir_name, engine="" ):
+	""" Names of the probabilities files of the directory of the engine: from its cache if it was opened, otherwise as
+	line_container.list_files.
+	"""
+	cache = CACHES.get( ( os.path.abspath( dir_name ), engine ) )
+	if cache is not None:
+		return list( cache['index'] ) + cache['errors']
+	return line_container.list_files( dir_name, '.prob', engine )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_prob( dir_name, filename, engine="" ):
+	""" Code points and probabilities of a probabilities file (as prob_io.read_prob): views of the arrays of the cache of the
+	directory if it was opened and holds the file, otherwise read from the directory.
+	"""
+	cache = CACHES.get( ( os.path.abspath( dir_name ), engine ) )
+	if cache is not None:
+		i = cache['index'].get( filename )
+		if i is not None:
+			start, end = cache['offsets'][i], cache['offsets'][i + 1]
+			return ( cache['codes'][start:end], cache['probs'][start:end] )
+	return prob_io.read_prob( dir_name, filename, engine )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def open_caches( dirs_engines, cache_dir ):
+	""" Opens the caches of a list of (directory, engine), reporting the time taken by each one.
+	"""
+	for dir_name, engine in dirs_engines:
+		start = time.time()
+		n, built = open_cache( dir_name, engine, cache_dir )
+		print("Probabilities cache of " + dir_name + ( " (" + engine + ")" if engine != "" else "" ) + ": " + str(n) + " files, " + ( "built" if built else "loaded" ) + " in " + ( "%.3f" % (time.time() - start) ) + " s")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Builds (or checks) the caches of the probabilities files of a list of directories.
+	"""
+	parser = argparse.ArgumentParser("Builds the columnar caches of the probabilities files (.prob) of a list of directories, used by the voting and consensus scripts with -pc.")
+	parser.add_argument('-d', '--dirs', action="store", required=True, help="Directories of the probabilities files (comma separated).")
+	parser.add_argument('-e', '--engines', action="store", default="", help="Engine of each directory, when the files are stored in line containers (comma separated).")
+	parser.add_argument('-pc', '--prob_cache', action="store", required=True, help="Folder of the caches.")
+	args = parser.parse_args()
+
+	dirs = [ d for d in args.dirs.split(',') if d != "" ]
+	engines = args.engines.split(',') if args.engines != "" else [ "" ] * len(dirs)
+	# Arguments Validations
+	if len(engines) != len(dirs):
+		print('Error: The number of engines must be the number of directories.\n')
+		parser.print_help()
+		sys.exit(1)
+	for dir_name in dirs:
+		if ( not os.path.isdir( dir_name ) ):
+			print('Error: The directory ' + dir_name + ' was not found.\n')
+			parser.print_help()
+			sys.exit(2)
+
+	open_caches( zip( dirs, engines ), args.prob_cache )
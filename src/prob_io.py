@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Reader and writer of the probabilities files (.prob) of the lines, in their two formats:
+#   - text: one "<symbol>\t<probability>\n" line per symbol (the format of the OCR engines).
+#   - binary (version 1): a 12 bytes header, the array of the Unicode code points of the
+#     symbols, and the float32 array of their probabilities:
+#           0   magic "HPRB"
+#           4   version (uint8)
+#           5   bytes per code point (uint8): 2 (uint16) or 4 (uint32, UTF-32)
+#           6   reserved (uint16)
+#           8   number of code points (uint32)
+#          12   code points, padded with zeros to a multiple of 4 bytes
+#               probabilities (float32)
+#     All the values are little-endian. A symbol of several characters (e.g. a ligature)
+#     is stored as its characters: the first one with the probability of the symbol and the
+#     others with NaN. An empty symbol is stored as the code point 0. The binary files only
+#     hold such plain code points and probabilities.
+#   The text files are read as the scripts always did: the loaders of the symbols
+# (accept_from_ngrams.py, fix_prob_txt_dir.py, augment_prob_ngrams.py) stop at the first line
+# which is not "<symbol>\t<probability>", while the confidence of the voting scripts
+# (getConfidence) takes every line: the text before its first tab, and its probability if it
+# has one. The text reader keeps such lines with flags in the high bits of their first code
+# point (above the Unicode range), in the arrays it returns only: LOOSE (not "<symbol>\t<probability>"), NO_PROB (no probability),
+# BAD_PROB (a probability which is not a number, getConfidence raises ValueError), PARTIAL
+# (two fields, the loaders keep the symbol without its probability before they stop), and
+# ENTRY (the first character of a symbol whose probability is NaN). A file with any of them
+# cannot be stored in the binary format, so it is kept as text.
+#   Both formats use the .prob extension; the readers recognize the format by its magic, so
+# the scripts accept either one. The binary arrays are read without copies
+# (numpy.frombuffer). Used as a script, it converts the .prob files of a directory (or of
+# its line containers) to the other format.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, math, os, struct, sys
+import numpy as np
+import line_container
+
+MAGIC = b"HPRB"
+VERSION = 1
+HEADER = struct.Struct( "<4sBBHI" )
+FORMATS = [ "text", "binary" ]
+# Flags of the first code point of a symbol (see above)
+PARTIAL = 0x08000000
+ENTRY = 0x10000000
+NO_PROB = 0x20000000
+BAD_PROB = 0x40000000
+LOOSE = 0x80000000
+CODE_MASK = 0x001FFFFF
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def is_binary( content ):
+	""" True if the content (bytes) of a probabilities file is in the binary format.
+	"""
+	return content[:len(MAGIC)] == MAGIC
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def text_lines( content ):
+	""" Lines of the content (bytes) of a text file, as a file opened in text mode returns them (universal newlines).
+	"""
+	text = content.decode('utf-8')
+	if '\r' in text:
+		text = text.replace( '\r\n', '\n' ).replace( '\r', '\n' )
+	lines = text.split('\n')
+	if lines[-1] == '':
+		lines.pop()
+	return lines
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def parse_line( line ):
+	""" (symbol, probability, flags) of a line of a text probabilities file.
+	"""
+	fields = line.split('\t')
+	flags = LOOSE
+	if len(fields) == 2:
+		try:
+			p = float( fields[1] )
+			return ( fields[0], p, ENTRY if p != p else 0 )
+		except ValueError:
+			flags = LOOSE | PARTIAL
+	# As getConfidence: the text before the first tab and the probability after it
+	words = line.rstrip().split('\t')
+	if len(words) == 1:
+		# The loaders keep the symbol with its trailing blanks (getConfidence removes them)
+		return ( fields[0] if flags & PARTIAL else words[0], math.nan, flags | NO_PROB | ENTRY )
+	try:
+		p = float( words[1] )
+		return ( words[0], p, flags | ENTRY if p != p else flags )
+	except ValueError:
+		return ( words[0], math.nan, flags | BAD_PROB | ENTRY )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def parse_text( content ):
+	""" Code points (uint32) and probabilities (float64) of a text probabilities file. Every line is kept (see above).
+	"""
+	lines = text_lines( content )
+	fields = [ line.split('\t') for line in lines ]
+	if all( len(f) == 2 for f in fields ):
+		symbols = [ f[0] for f in fields ]
+		chars = ''.join( symbols )
+		if len(chars) == len(symbols) and '' not in symbols:
+			try:
+				probs = np.array( list( map( float, [ f[1] for f in fields ] ) ), dtype=np.float64 )
+			except ValueError:
+				probs = None
+			if probs is not None and not np.isnan( probs ).any():
+				# One character and one probability per line (the usual case)
+				return ( np.frombuffer( chars.encode('utf-32-le'), dtype='<u4' ), probs )
+	return from_records( [ parse_line( line ) for line in lines ], np.float64 )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def from_records( records, dtype=np.float32 ):
+	""" Code points (uint32) and probabilities of a list of (symbol, probability, flags): the characters of a symbol after
+	the first one get NaN.
+	"""
+	codes, values = [], []
+	for symbol, p, flags in records:
+		if p != p:
+			flags = flags | ENTRY
+		codes.append( ( ord( symbol[0] ) if symbol != '' else 0 ) | flags )
+		values.append( p )
+		for c in symbol[1:]:
+			codes.append( ord(c) )
+			values.append( np.nan )
+	return ( np.array( codes, dtype=np.uint32 ), np.array( values, dtype=dtype ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def from_symbols( symbols, probs, dtype=np.float32 ):
+	""" Code points (uint32) and probabilities of lists of symbols and probabilities: the characters of a symbol after the
+	first one get NaN.
+	"""
+	return from_records( [ (symbol, p, 0) for symbol, p in zip( symbols, probs ) ], dtype )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def parse_binary( content ):
+	""" Code points (uint16 or uint32) and probabilities (float32) of a binary probabilities file. The arrays are views of
+	the content (read only).
+	"""
+	if len(content) < HEADER.size:
+		raise ValueError( "Truncated binary probabilities file." )
+	magic, version, width, reserved, n = HEADER.unpack_from( content )
+	if magic != MAGIC or version != VERSION or width not in [2, 4]:
+		raise ValueError( "Unknown binary probabilities format (version " + str(version) + ")." )
+	probs_offset = HEADER.size + ( n * width + 3 ) // 4 * 4
+	if len(content) < probs_offset + 4 * n:
+		raise ValueError( "Truncated binary probabilities file." )
+	codes = np.frombuffer( content, dtype='<u2' if width == 2 else '<u4', count=n, offset=HEADER.size )
+	probs = np.frombuffer( content, dtype='<f4', count=n, offset=probs_offset )
+	return ( codes, probs )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def decode( content ):
+	""" Code points and probabilities of the content (bytes) of a probabilities file in either format.
+	"""
+	if is_binary( content ):
+		return parse_binary( content )
+	return parse_text( content )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_prob( dir_name, filename, engine="" ):
+	""" Code points and probabilities of a probabilities file of the directory (or of the line container of its image).
+	"""
+	return decode( line_container.read_bytes( dir_name, filename, engine ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def encode_binary( codes, probs ):
+	""" Binary probabilities file of the arrays of code points and probabilities (without flags).
+	"""
+	codes = np.asarray( codes, dtype=np.uint32 )
+	if not has_binary( codes ):
+		raise ValueError( "Flagged lines (see prob_io.py) can only be stored in the text format." )
+	width = 2 if len(codes) == 0 or codes.max() < 0x10000 else 4
+	code_bytes = codes.astype( '<u2' if width == 2 else '<u4' ).tobytes()
+	padding = b"\0" * ( -len(code_bytes) % 4 )
+	return HEADER.pack( MAGIC, VERSION, width, 0, len(codes) ) + code_bytes + padding + np.asarray( probs, dtype='<f4' ).tobytes()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def format_text( records ):
+	""" Text probabilities file of a list of (symbol, probability, flags), read back as the same list.
+	"""
+	lines = []
+	for symbol, p, flags in records:
+		if flags & NO_PROB:
+			lines.append( symbol + ( "\t\n" if flags & PARTIAL else "\n" ) )
+		elif flags & BAD_PROB:
+			lines.append( symbol + ( "\t?\n" if flags & PARTIAL else "\t?\t\n" ) )
+		else:
+			lines.append( symbol + "\t" + str(p) + ( "\t\n" if flags & LOOSE else "\n" ) )
+	return ''.join( lines ).encode('utf-8')
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def encode( symbols, probs, binary=False ):
+	""" Content (bytes) of the probabilities file of lists of symbols and probabilities, in text or binary format (text if a
+	probability is NaN, see above).
+	"""
+	if binary:
+		codes, values = from_symbols( symbols, probs )
+		if has_binary( codes ):
+			return encode_binary( codes, values )
+	return ''.join( s + "\t" + str(p) + "\n" for s, p in zip( symbols, probs ) ).encode('utf-8')
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def convert( content, binary ):
+	""" Converts the content of a probabilities file to the binary (binary=True) or text format. A text file with flagged
+	lines (see above) is returned unchanged.
+	"""
+	if is_binary( content ) == binary:
+		return content
+	codes, probs = decode( content )
+	if binary:
+		return encode_binary( codes, probs ) if has_binary( codes ) else content
+	# Shortest text of the float32 values (0.53 instead of 0.5299999713897705)
+	return format_text( [ (symbol, np.float32(p), flags) for symbol, p, flags in records( codes, probs ) ] )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def write_prob( dir_name, filename, symbols, probs, engine="", container=False, binary=False ):
+	""" Writes a probabilities file in the directory (or in the line container of its image, with container=True).
+	"""
+	line_container.write_files( dir_name, [ (filename, encode( symbols, probs, binary )) ], engine, container )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def to_string( codes ):
+	""" String of an array of code points (without flags).
+	"""
+	return codes.astype( '<u4', copy=False ).tobytes().decode('utf-32-le')
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def has_binary( codes ):
+	""" True if the array of code points has no flags, so it can be stored in the binary format.
+	"""
+	return len(codes) == 0 or int( codes.max() ) <= CODE_MASK
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def is_plain( codes, probs ):
+	""" True if every symbol of the arrays is one character with a probability, and no line has flags (the usual case).
+	"""
+	return len(codes) == 0 or ( codes.min() > 0 and codes.max() <= CODE_MASK and not np.isnan( probs ).any() )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def records( codes, probs ):
+	""" List of the (symbol, probability, flags) of the lines of the file.
+	"""
+	result = []
+	for c, p in zip( codes.tolist(), probs.tolist() ):
+		if p != p and c <= CODE_MASK and len(result) > 0:
+			# Continuation of a symbol of several characters
+			symbol, value, flags = result[-1]
+			result[-1] = ( symbol + chr(c), value, flags )
+		else:
+			code = c & CODE_MASK
+			result.append( ( chr(code) if code != 0 else '', p, c & ~CODE_MASK ) )
+	return result
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def entries( codes, probs ):
+	""" Lists of the symbols and probabilities of the file (a symbol of several characters is joined again), up to the first
+	line which is not "<symbol>\t<probability>" (empty symbols included).
+	"""
+	if is_plain( codes, probs ):
+		return ( list( to_string( codes ) ), probs.tolist() )
+	symbols, values = [], []
+	for symbol, p, flags in records( codes, probs ):
+		if flags & LOOSE:
+			if flags & PARTIAL:
+				symbols.append( symbol )
+			break
+		symbols.append( symbol )
+		values.append( p )
+	return ( symbols, values )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def characters( codes, probs ):
+	""" Lists of the characters and probabilities of the file, up to the first line which is not "<symbol>\t<probability>":
+	each character of a symbol has the probability of the symbol (the lines of two fields with an empty symbol are skipped).
+	"""
+	if is_plain( codes, probs ):
+		return ( list( to_string( codes ) ), probs.tolist() )
+	chars, values = [], []
+	for symbol, p, flags in records( codes, probs ):
+		if flags & LOOSE and not flags & PARTIAL:
+			break
+		if symbol == '':
+			continue
+		if flags & LOOSE:
+			chars.append( symbol[0] )
+			break
+		for c in symbol:
+			chars.append( c )
+			values.append( p )
+	return ( chars, values )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def confidence( codes, probs ):
+	""" Returns the text without the space symbols, the text, the number of (non-space) symbols with a probability, and
+	their average probability (as getConfidence: every line, added in order).
+	"""
+	if is_plain( codes, probs ):
+		text_s = to_string( codes )
+		counted = codes != 32
+		n = int( np.count_nonzero( counted ) )
+		total = sum( probs[ counted ].tolist() )
+		return ( text_s.replace( ' ', '' ), text_s, n, total / n if n > 0 else 0.0 )
+	text, text_s = [], []
+	total = 0.0
+	n = 0
+	for symbol, p, flags in records( codes, probs ):
+		if flags & PARTIAL and flags & NO_PROB:
+			symbol = symbol.rstrip()
+		if symbol == ' ':
+			text_s.append( ' ' )
+			continue
+		text.append( symbol )
+		text_s.append( symbol )
+		if flags & BAD_PROB:
+			raise ValueError( "Probability which is not a number after the symbol " + repr(symbol) + "." )
+		if not flags & NO_PROB:
+			total = total + p
+			n = n + 1
+	return ( ''.join( text ), ''.join( text_s ), n, total / n if n > 0 else 0.0 )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Converts the probabilities files of a directory to the binary or text format.
+	"""
+	parser = argparse.ArgumentParser("Converts the probabilities files (.prob) of a directory, or of its line containers, to the binary or text format.")
+	parser.add_argument('-sd', '--srcdir', action="store", required=True, help="Directory of the probabilities files (or of their line containers).")
+	parser.add_argument('-dd', '--dstdir', action="store", required=True, help="Directory where the converted files are saved (it can be the source directory).")
+	parser.add_argument('-f', '--format', action="store", default="binary", choices=FORMATS, help="Format of the converted files.")
+	parser.add_argument('-e', '--engine', action="store", default="", help="Engine of the probabilities files, when they are stored in line containers.")
+	parser.add_argument('-ce', '--container_engine', action="store", default="", help="Engine folder to store the converted files in line containers of the destination directory (empty: plain files).")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if ( not os.path.isdir( args.srcdir ) ):
+		print('Error: The directory of the probabilities files was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	if not os.path.exists( args.dstdir ):
+		try:
+			os.makedirs( args.dstdir )
+		except:
+			print('Error: The destination directory was not found and could not be created.\n')
+			parser.print_help()
+			sys.exit(2)
+
+	binary = args.format == "binary"
+	files_list = sorted( line_container.list_files( args.srcdir, '.prob', args.engine ) )
+	# One write per container
+	groups = {}
+	n_errors = 0
+	n_text = 0
+	for filename in files_list:
+		try:
+			content = convert( line_container.read_bytes( args.srcdir, filename, args.engine ), binary )
+		except (IOError, ValueError, UnicodeDecodeError) as e:
+			print("Error: " + filename + ": " + str(e))
+			n_errors = n_errors + 1
+			continue
+		if is_binary( content ) != binary:
+			n_text = n_text + 1
+		groups.setdefault( line_container.image_basename( filename ), [] ).append( (filename, content) )
+	for basename in groups:
+		line_container.write_files( args.dstdir, groups[ basename ], args.container_engine, args.container_engine != "", basename )
+
+	print("Files converted to " + args.format + ": " + str(len(files_list) - n_errors - n_text) + ", kept as text (flagged lines): " + str(n_text))
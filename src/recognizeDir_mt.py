@@ -3,6 +3,20 @@
 # Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
 # Description: 
 #   Using OCROPY, runs the recognition script on the binarized images of a folder.
+# If the folder holds per-image line containers (see line_container.py), the binarized lines
+# of their ocropus folder are recognized and the text and probabilities files are stored
+# in the same folder of the containers.
+#   By default, one ocropus-rpred process (of the OCROPY installation, run by its own Python
+# 2 interpreter) is run per line, and its text and probabilities files are moved to their
+# destination folders. With -ip, the lines are recognized by a pool of processes which load
+# the model once (ocrolib) and then recognize the lines they receive, like ocropus-rpred -n,
+# in batches of lines of similar width (ocropus_batch.py; -bs 1 recognizes them one by
+# one), writing the files directly to their destination folders. -ip needs an ocrolib
+# importable by this interpreter (DIR_OCROPY), able to unpickle the model.
+#   With -ip and -oc, the results are kept in a cache keyed by the pixels of the lines and the model
+# (see ocr_cache.py): the lines already recognized (e.g. in a previous run, or the same label
+# in other specimens) are not recognized again. With -pf binary, the probabilities files are
+# written in the binary format of prob_io.py.
 #
 ##########################################################################################
 # Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
@@ -20,35 +34,224 @@
 # limitations under the License.
 ##########################################################################################
 
-import argparse, os, sys
-from subprocess import Popen
-from itertools import islice
+import argparse, os, shutil, sys, tempfile
+import worker_profile
+import image_access, job_scheduler, line_container, ocr_cache, ocropus_batch, ocropus_nlbin, prob_io, triage_lines
 
 DIR_OCROPY = "/home/user/ocropy"
-N_THREADS = 6
+N_THREADS = worker_profile.jobs( "recognizeDir_mt", 6 )
+# Padding of the lines (ocropus-rpred --pad)
+PAD = 16
+# Results stored in the containers at once
+FLUSH_N = 256
+# Seconds a line may take before its process is killed
+TIME_LIMIT = 60
+# Parameters of the recognition which change its results (part of the keys of the OCR cache)
+CACHE_PARAMS = "pad=" + str(PAD) + ",threshold=" + str(ocropus_batch.THRESHOLD) + ",text=normalize_text"
+
+# State of the worker processes (see init_worker)
+NETWORK = None
+LNORM = None
+WEIGHTS = None
+BATCH_SIZE = 1
+INPUT_DIR = ""
+TXT_DIR = ""
+PROB_DIR = ""
+WITH_PROB = False
+CONTAINER = False
+OCR_CACHE = ""
+MODEL_ID = ""
+PROB_BINARY = False
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def txtRecognize_folder( images_dir, models_dir, model_filename, with_prob, skip={}, n_jobs=N_THREADS, time_limit=0, retries=0 ):
+	""" Recognizes the .png lines of the folder and its subfolders, running up to n_jobs ocropus-rpred processes (killed
+	after time_limit seconds, and run again up to retries times). Returns (the list of failed commands, the list of (line,
+	reason) of the lines over the time limit).
+	"""
+	files = list(f for f in job_scheduler.walk_files( images_dir, '.png' ) if os.path.basename(f).split('.')[0] not in skip)
+	commands = []
+	command = 'export PYTHONIOENCODING="UTF-8";export OCROPUS_DATA=' + models_dir + ";"
+	if with_prob:
+		commands = [ command + DIR_OCROPY + "/ocropus-rpred -n --probabilities -q -m " + model_filename + " " + images_dir + "/" + f for f in files ]
+	else:
+		commands = [ command + DIR_OCROPY + "/ocropus-rpred -n -q -m " + model_filename + " " + images_dir + "/" + f for f in files ]
+
+	results, failed = job_scheduler.run_commands( commands, n_jobs, False, True, time_limit, retries )
+	quarantine = [ ( f, job_scheduler.TIMEOUT ) for f, result in zip( files, results ) if result[1] == job_scheduler.TIMEOUT_CODE ]
+	return ( failed, quarantine )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def init_worker( model_path_filename, images_dir, txt_dir, prob_dir, with_prob, container, batch_size, cache_dir="", stats=None, prob_binary=False ):
+	""" Loads (once per process) the model and sets the folders (and the OCR cache) of the worker processes of the pool.
+	"""
+	global NETWORK, LNORM, WEIGHTS, BATCH_SIZE, INPUT_DIR, TXT_DIR, PROB_DIR, WITH_PROB, CONTAINER, OCR_CACHE, MODEL_ID, PROB_BINARY
+	sys.path.insert( 0, DIR_OCROPY )
+	import ocrolib
+	from ocrolib import lstm
+	NETWORK = ocrolib.load_object( model_path_filename, verbose=0 )
+	for x in NETWORK.walk():
+		x.postLoad()
+	for x in NETWORK.walk():
+		if isinstance( x, lstm.LSTM ):
+			x.allocate( 5000 )
+	LNORM = getattr( NETWORK, "lnorm", None )
+	if batch_size > 1:
+		WEIGHTS = ocropus_batch.load_weights( NETWORK )
+	BATCH_SIZE = batch_size
+	INPUT_DIR, TXT_DIR, PROB_DIR, WITH_PROB, CONTAINER = images_dir, txt_dir, prob_dir, with_prob, container
+	OCR_CACHE, PROB_BINARY = cache_dir, prob_binary
+	if cache_dir != "":
+		MODEL_ID = ocr_cache.model_id( model_path_filename )
+		ocr_cache.set_stats( stats )
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def prepare( image ):
+	""" Normalizes a binarized line (grayscale array in [0, 1]) as ocropus-rpred -n does: dewarping and scaling to the
+	height of the model, and padding. Returns the line (timesteps x height), or None if the line is empty (ocropus-rpred
+	skips it, and writes no files).
+	"""
+	from ocrolib import lstm
+	if image.size == 0 or image.max() == image.min():
+		return None
+	temp = image.max() - image
+	temp = temp * 1.0 / temp.max()
+	LNORM.measure( temp )
+	line = LNORM.normalize( image, cval=image.max() )
+	if line.size < 10 or line.max() == line.min():
+		return None
+	return lstm.prepare_line( line, PAD )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def decode( outputs ):
+	""" Text (normalized as the .txt files of ocropus-rpred) and list of (character, probability) of the outputs (timesteps x
+	classes) of the network for a line.
+	"""
+	import ocrolib
+	classes = ocropus_batch.translate_back( outputs )
+	text = NETWORK.l2s( [ c for c, p in classes ] )
+	probs = [ ( NETWORK.l2s( [c] ), p ) for c, p in classes ]
+	return ( ocrolib.normalize_text( text ), probs )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_results( filename, text, probs ):
+	""" Saves the .txt and .prob (text or binary format) files of a line in TXT_DIR and PROB_DIR. In container mode, returns their [(name, bytes)]
+	instead ([] otherwise).
+	"""
+	base = filename.split('.')[0]
+	files = [ (base + ".txt", (text + "\n").encode('utf-8')) ]
+	if WITH_PROB:
+		files.append( (base + ".prob", prob_io.encode( [ c for c, p in probs ], [ p for c, p in probs ], PROB_BINARY )) )
+	if CONTAINER:
+		return [ (os.path.basename(name), content) for name, content in files ]
+
+	for name, content in files:
+		with open( (TXT_DIR if name.endswith('.txt') else PROB_DIR) + "/" + name, "wb" ) as f:
+			f.write( content )
+	return []
+
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
-def txtRecognize_folder( images_dir, models_dir, model_filename, with_prob ):
-	for root, dirs, filenames in os.walk( images_dir ):
-		files = list(f for f in filenames if f.endswith('.png'))
-		commands = []
-		command = 'export PYTHONIOENCODING="UTF-8";export OCROPUS_DATA=' + models_dir + ";"
-		if with_prob:
-			commands = [ command + DIR_OCROPY + "/ocropus-rpred -n --probabilities -q -m " + model_filename + " " + images_dir + "/" + f for f in files ]
+def recognize_images( filenames, load ):
+	""" Recognizes a list of lines, whose binarized images (grayscale arrays in [0, 1], or None if the line is empty) and
+	other result files ([(name, bytes)], e.g. the binarized line) are returned by load(filename): one by one with the
+	network of ocrolib, or, with BATCH_SIZE > 1, in width buckets (ocropus_batch.py). Returns the list of (filename, result
+	files of save_results plus the other ones, error message or ""); the empty lines, skipped as ocropus-rpred does, get no
+	result files. With OCR_CACHE, the cached results are used and the new ones are stored.
+	One by one, each line is an item of the task of job_scheduler.run_tasks (its results are sent when the next one
+	starts); in buckets, the lines are recognized together, as a group of items.
+	"""
+	results = []
+	lines = []
+	if BATCH_SIZE > 1 and len(filenames) > 0:
+		# The lines of the batches are recognized together: the time limit of all of them
+		job_scheduler.next_item( len(filenames) )
+	for filename in filenames:
+		if BATCH_SIZE == 1:
+			results = job_scheduler.next_item( 1, results )
+		key = None
+		try:
+			image, other_files = load( filename )
+			if image is None:
+				results.append( ( filename, other_files, "" ) )
+				continue
+			if OCR_CACHE != "":
+				key = ocr_cache.result_key( ocr_cache.pixel_hash( image ), "ocropus", MODEL_ID, CACHE_PARAMS )
+				cached = ocr_cache.load_result( OCR_CACHE, key )
+				if cached is not None:
+					results.append( ( filename, save_results( filename, cached['text'], cached['probs'] ) + other_files, "" ) )
+					continue
+			line = prepare( image )
+		except Exception as e:
+			results.append( ( filename, [], str(e) ) )
+			continue
+		if line is None:
+			results.append( ( filename, other_files, "" ) )
+		elif BATCH_SIZE > 1:
+			lines.append( ( filename, line, key, other_files ) )
 		else:
-			commands = [ command + DIR_OCROPY + "/ocropus-rpred -n -q -m " + model_filename + " " + images_dir + "/" + f for f in files ]
-
-		processes = (Popen(cmd, shell=True) for cmd in commands)
-		running_processes = list(islice(processes, N_THREADS))  # start new processes
-		while running_processes:
-			for i, process in enumerate(running_processes):
-				if process.poll() is not None:  # the process has finished
-					running_processes[i] = next(processes, None)  # start new process
-					if running_processes[i] is None: # no new processes
-						del running_processes[i]
-						break
-						
+			NETWORK.predictSequence( line )
+			results.append( save_outputs( filename, key, NETWORK.outputs, other_files ) )
+
+	if len(lines) > 0:
+		outputs = ocropus_batch.forward_lines( WEIGHTS, [ line for filename, line, key, other_files in lines ], BATCH_SIZE )
+		for ( filename, line, key, other_files ), ys in zip( lines, outputs ):
+			results.append( save_outputs( filename, key, ys, other_files ) )
+	return results
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_outputs( filename, key, outputs, other_files ):
+	""" Decodes the outputs of the network for a line, stores them in the OCR cache (with key), and saves its results.
+	Returns (filename, result files of save_results plus other_files, "").
+	"""
+	text, probs = decode( outputs )
+	ocr_cache.save_result( OCR_CACHE, key, { 'text': text, 'probs': [ [ c, float(p) ] for c, p in probs ] } )
+	return ( filename, save_results( filename, text, probs ) + other_files, "" )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def read_line( filename ):
+	""" Binarized line (<line>.bin.png) of INPUT_DIR, for recognize_images (no other result files).
+	"""
+	return ( ocropus_nlbin.read_image_gray( line_container.read_bytes( INPUT_DIR, filename, "ocropus" ) ), [] )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def recognize_lines( filenames ):
+	""" Recognizes a list of binarized lines (<line>.bin.png) of INPUT_DIR (see recognize_images).
+	"""
+	return recognize_images( filenames, read_line )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def collect_results( images_dir, files, txt_dir, prob_dir, container, prob_binary=False ):
+	""" Collects the .txt and .prob files written by ocropus-rpred next to the lines (files) of images_dir: in container mode
+	they are returned as [(name, bytes)], otherwise they are moved to txt_dir and prob_dir (the probabilities files are
+	converted to the binary format with prob_binary). Returns (result files, lines without a text file).
+	"""
+	result_files = []
+	missing = []
+	for f in files:
+		base = os.path.join( os.path.dirname(f), os.path.basename(f).split('.')[0] )
+		if not os.path.isfile( images_dir + "/" + base + ".txt" ):
+			missing.append( f )
+			continue
+		for extension, dst_dir in [ ('.txt', txt_dir), ('.prob', prob_dir) ]:
+			src_filename = images_dir + "/" + base + extension
+			if not os.path.isfile( src_filename ):
+				continue
+			if container or ( extension == '.prob' and prob_binary ):
+				with open( src_filename, 'rb' ) as f_result:
+					content = f_result.read()
+				if extension == '.prob':
+					content = prob_io.convert( content, prob_binary )
+				if container:
+					result_files.append( (os.path.basename( base ) + extension, content) )
+					continue
+				os.remove( src_filename )
+				with open( dst_dir + "/" + base + extension, 'wb' ) as f_result:
+					f_result.write( content )
+			elif os.path.abspath( dst_dir ) != os.path.abspath( images_dir ):
+				shutil.move( src_filename, dst_dir + "/" + base + extension )
+	return ( result_files, missing )
+
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
@@ -58,6 +261,19 @@ if __name__ == '__main__':
 	parser.add_argument('-mf', '--model_folder', action="store", required=True, help="Directory where the OCR model is stored.")
 	parser.add_argument('-mn', '--model_name', action="store", required=True, help="Filename of the OCR model to use during the recognition process.")
 	parser.add_argument('-p', '--probabilities', action="store", required=True, help="Include the probabilities file or not: True or False.")	
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=N_THREADS, help="Maximum number of concurrent recognition processes.")
+	parser.add_argument('-sk', '--skip_list', action="store", default="", help="Skip list of the lines which are not recognized (see triage_lines.py).")
+	parser.add_argument('-td', '--txt_dir', action="store", default="", help="Directory where the text files are saved (default: the directory of the images). Not used with line containers.")
+	parser.add_argument('-pd', '--prob_dir', action="store", default="", help="Directory where the probabilities files are saved (default: the directory of the images). Not used with line containers.")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=64, help="Number of lines sent to each process at once.")
+	parser.add_argument('-so', '--schedule_order', action="store", default="cost", choices=["cost", "walk"], help="cost: send the lines in decreasing order of width x height (read from their headers), in chunks of decreasing size (up to chunk_size lines); walk: in the order of the folders, in chunks of chunk_size lines.")
+	parser.add_argument('-bs', '--batch_size', action="store", type=int, default=ocropus_batch.MAX_BATCH, help="Maximum number of lines of similar width recognized at once with -ip (1: one by one, with ocrolib).")
+	parser.add_argument('-ip', '--in_process', action="store_true", help="Recognize the lines in a pool of processes which load the model once with ocrolib (it must be importable by this Python interpreter), instead of running one ocropus-rpred process per line.")
+	parser.add_argument('-oc', '--ocr_cache', action="store", default="", help="Cache folder of the OCR results (see ocr_cache.py). Only used with -ip.")
+	parser.add_argument('-pf', '--prob_format', action="store", default="text", choices=prob_io.FORMATS, help="Format of the probabilities files (see prob_io.py).")
+	parser.add_argument('-tl', '--time_limit', action="store", type=float, default=TIME_LIMIT, help="Seconds a line may take before its process is killed and replaced (0: no limit).")
+	parser.add_argument('-rt', '--retries', action="store", type=int, default=1, help="Times a line over the time limit is tried again before it is quarantined.")
+	parser.add_argument('-qf', '--quarantine_file', action="store", default="", help="Path + Filename where the lines over the time limit are appended (with the format of the skip list).")
 	args = parser.parse_args()
 
 	# Arguments Validations
@@ -78,9 +294,79 @@ if __name__ == '__main__':
 		parser.print_help()
 		sys.exit(4)
 
+	txt_dir = args.txt_dir if args.txt_dir != "" else args.images_folder
+	prob_dir = args.prob_dir if args.prob_dir != "" else args.images_folder
+	for dst_dir in [ txt_dir, prob_dir ]:
+		if not os.path.exists( dst_dir ):
+			try:
+				os.makedirs( dst_dir )
+			except:
+				print('Error: The destination directory (' + dst_dir + ') was not found and could not be created.\n')
+				parser.print_help()
+				sys.exit(5)
+
 	with_prob = False
 	if args.probabilities == "True":
 		with_prob = True
+	skip = triage_lines.load_skip_list( args.skip_list )
+	with_containers = len( line_container.list_containers( args.images_folder ) ) > 0
 		
-	txtRecognize_folder( args.images_folder, args.model_folder, args.model_name, with_prob )
+	if not args.in_process and with_containers:
+		# OCROPY only works with files: the binarized lines stored in containers are recognized in a temporary folder
+		tmp_dir = tempfile.mkdtemp()
+		files = line_container.extract_files( args.images_folder, '.bin.png', "ocropus", tmp_dir )
+		failed, quarantine = txtRecognize_folder( tmp_dir, args.model_folder, args.model_name, with_prob, skip, args.jobs, args.time_limit, args.retries )
+		result_files, missing = collect_results( tmp_dir, [ f for f in files if f.split('.')[0] not in skip ], txt_dir, prob_dir, True, args.prob_format == "binary" )
+		line_container.write_files( args.images_folder, result_files, "ocropus", True )
+		shutil.rmtree( tmp_dir )
+	elif not args.in_process:
+		failed, quarantine = txtRecognize_folder( args.images_folder, args.model_folder, args.model_name, with_prob, skip, args.jobs, args.time_limit, args.retries )
+		files = [ f for f in job_scheduler.walk_files( args.images_folder, '.png' ) if os.path.basename(f).split('.')[0] not in skip ]
+		for sub_dir in set( os.path.dirname(f) for f in files ):
+			for dst_dir in [ txt_dir, prob_dir ]:
+				if sub_dir != "" and not os.path.exists( dst_dir + "/" + sub_dir ):
+					os.makedirs( dst_dir + "/" + sub_dir )
+		collect_results( args.images_folder, files, txt_dir, prob_dir, False, args.prob_format == "binary" )
+	else:
+		# Lines of the folder, its subfolders, and its containers (the outputs keep the same subfolders)
+		files = job_scheduler.walk_files( args.images_folder, '.bin.png' ) + line_container.list_files( args.images_folder, '.bin.png', "ocropus" )
+		files = sorted(set(f for f in files if os.path.basename(f).split('.')[0] not in skip))
+		for sub_dir in set( os.path.dirname(f) for f in files ):
+			for dst_dir in [ txt_dir, prob_dir ]:
+				if sub_dir != "" and not os.path.exists( dst_dir + "/" + sub_dir ):
+					os.makedirs( dst_dir + "/" + sub_dir )
+
+		# Each process loads the model once and receives the lines in chunks (recognized in width buckets). The processes over
+		# the time limit are replaced, and their lines tried again one by one
+		failed = []
+		quarantine = []
+		result_files = []
+		stats = ocr_cache.new_stats()
+		initargs = ( args.model_folder + "/" + args.model_name, args.images_folder, txt_dir, prob_dir, with_prob, with_containers, max(1, args.batch_size), args.ocr_cache, stats, args.prob_format == "binary" )
+		if args.schedule_order == "cost":
+			# Longest job first: the widest lines are sent first, and the chunks get smaller towards the end
+			chunks = job_scheduler.cost_chunks( files, [ image_access.line_cost( args.images_folder, f, "ocropus" ) for f in files ], args.jobs, args.chunk_size )
+		else:
+			chunks = [ files[i:i + max(1, args.chunk_size)] for i in range( 0, len(files), max(1, args.chunk_size) ) ]
+		for chunk, results, error in job_scheduler.run_tasks( recognize_lines, chunks, args.jobs, args.time_limit, args.retries, init_worker, initargs ):
+			if error != "":
+				failed.extend( chunk )
+				quarantine.extend( ( filename, error ) for filename in chunk )
+				continue
+			for filename, files_list, error in results:
+				if error != "":
+					failed.append( filename )
+					print("Error: " + filename + ": " + error)
+				else:
+					result_files.extend( files_list )
+			if len(result_files) >= FLUSH_N:
+				line_container.write_files( args.images_folder, result_files, "ocropus", True )
+				result_files = []
+		if len(result_files) > 0:
+			line_container.write_files( args.images_folder, result_files, "ocropus", True )
+		if args.ocr_cache != "":
+			print( ocr_cache.report( stats ) )
 
+	triage_lines.save_quarantine( args.quarantine_file, quarantine )
+	if len(failed) > 0:
+		print("Lines which could not be recognized: " + str(len(failed)) + " (quarantined: " + str(len(quarantine)) + ")")
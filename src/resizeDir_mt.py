@@ -2,7 +2,9 @@
 ##########################################################################################
 # Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
 # Description: 
-#   Opens, resizes, and saves, using opencv, the jpg found files in a directory.
+#   Opens, resizes, and saves, using opencv, the jpg found files in a directory. All the images
+# are resized by a fixed percentage, or (fit mode) only the images bigger than a maximum size
+# are resized, with the largest scale and quality that makes them fit.
 #
 ##########################################################################################
 # Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
@@ -20,43 +22,147 @@
 # limitations under the License.
 ##########################################################################################
 
-import argparse, os, sys
-import cv2 as cv
+import argparse, math, os, shutil, sys
 import multiprocessing
+import worker_profile
+import cv2 as cv
+import job_scheduler
 
-CORES_N = multiprocessing.cpu_count() - 1
+CORES_N = worker_profile.jobs( "resizeDir_mt", multiprocessing.cpu_count() - 1 )
 SRC_DIR = ""
 DST_DIR = ""
 PERCENT = 71.0
+# Fit mode: maximum size of the images (Google Cloud limit), and limits of the search
+MAX_BYTES = 10485760
+MAX_QUALITY = 100
+MIN_QUALITY = 75
+QUALITY_STEP = 5
+MIN_SCALE = 0.25
+SCALE_PRECISION = 0.01
+# Files sent to each process at once
+CHUNK_SIZE = 16
+
+# Decoding flags of the reduced (1/2, 1/4, 1/8) resolutions of the jpg decoder
+REDUCED_FLAGS = { 1: cv.IMREAD_UNCHANGED, 2: cv.IMREAD_REDUCED_COLOR_2, 4: cv.IMREAD_REDUCED_COLOR_4, 8: cv.IMREAD_REDUCED_COLOR_8 }
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def reduction_factor( scale ):
+	""" Largest reduction of the decoder (1, 2, 4, or 8) which still provides the pixels needed to resize to scale.
+	"""
+	factor = 8
+	while factor > 1 and scale > 1.0 / factor:
+		factor = factor // 2
+	return factor
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def scaleImg( image, scale ):
+	""" Resizes the image by scale (relative to the size of the array).
+	"""
+	if scale >= 1.0:
+		return image
+	width = max( 1, int(image.shape[1] * scale) )
+	height = max( 1, int(image.shape[0] * scale) )
+	return cv.resize( image, (width, height), interpolation=cv.INTER_AREA )
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 def resizeImg ( filename ):
-	""" Opens a png file and saves it with a different size, in a differnt folder. 
+	""" Opens a jpg file and saves it with a different size (PERCENT), in a different folder.
 	"""
 	src_filename = SRC_DIR + "/" + filename
 	dst_filename = DST_DIR + "/" + filename
-	# Load the image
-	image = cv.imread( src_filename, cv.IMREAD_UNCHANGED)
+	# Load the image (at a reduced resolution when it is enough for the new size)
+	factor = reduction_factor( PERCENT / 100.0 )
+	image = cv.imread( src_filename, REDUCED_FLAGS[factor] )
+	if image is None:
+		return ( filename, "failed", 0 )
 	# New size
-	width = int(image.shape[1] * PERCENT / 100.0)
-	height = int(image.shape[0] * PERCENT / 100.0)
-	# Resize
-	image = cv.resize( image, (width, height))
-	# Find the barcodes in the image and decode them
+	if factor == 1:
+		width = int(image.shape[1] * PERCENT / 100.0)
+		height = int(image.shape[0] * PERCENT / 100.0)
+		# Resize
+		image = cv.resize( image, (width, height))
+	else:
+		image = scaleImg( image, PERCENT * factor / 100.0 )
 	cv.imwrite( dst_filename, image, [int(cv.IMWRITE_JPEG_QUALITY), 100])
+	return ( filename, "resized", os.stat( dst_filename ).st_size )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def fitScale( image, quality, min_scale ):
+	""" Binary search of the largest scale (relative to the array, from min_scale to 1) whose jpg encoding with the quality
+	fits in MAX_BYTES. Returns (scale, encoded bytes), or (0, None) if not even min_scale fits.
+	"""
+	ok, buf = cv.imencode( '.jpg', image, [int(cv.IMWRITE_JPEG_QUALITY), quality] )
+	if ok and len(buf) <= MAX_BYTES:
+		return ( 1.0, buf )
+	ok, buf = cv.imencode( '.jpg', scaleImg( image, min_scale ), [int(cv.IMWRITE_JPEG_QUALITY), quality] )
+	if not ok or len(buf) > MAX_BYTES:
+		return ( 0, None )
+
+	# Invariant: low fits, high does not
+	low, high, best_buf = min_scale, 1.0, buf
+	while high - low > SCALE_PRECISION:
+		scale = (low + high) / 2.0
+		ok, buf = cv.imencode( '.jpg', scaleImg( image, scale ), [int(cv.IMWRITE_JPEG_QUALITY), quality] )
+		if ok and len(buf) <= MAX_BYTES:
+			low, best_buf = scale, buf
+		else:
+			high = scale
+	return ( low, best_buf )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def fitImg ( filename ):
+	""" Saves the jpg file in a different folder with the largest scale (down to MIN_SCALE of the original) and quality
+	(in that order of priority) that makes it fit in MAX_BYTES. The images that already fit are copied without changes.
+	"""
+	src_filename = SRC_DIR + "/" + filename
+	dst_filename = DST_DIR + "/" + filename
+	size = os.stat( src_filename ).st_size
+	if size <= MAX_BYTES:
+		if src_filename != dst_filename:
+			shutil.copyfile( src_filename, dst_filename )
+		return ( filename, "copied", size )
+
+	# The encoded size is roughly proportional to the number of pixels: decode at the reduced resolution suited for the estimated scale
+	factor = reduction_factor( math.sqrt( MAX_BYTES / float(size) ) )
+	while True:
+		image = cv.imread( src_filename, REDUCED_FLAGS[factor] )
+		if image is None:
+			return ( filename, "failed", 0 )
+		quality = MAX_QUALITY
+		while quality >= MIN_QUALITY:
+			scale, buf = fitScale( image, quality, min(1.0, MIN_SCALE * factor) )
+			if buf is not None:
+				break
+			quality = quality - QUALITY_STEP
+		# If the whole reduced image fits, a larger scale could fit too: repeat with more resolution
+		if buf is None or scale < 1.0 or factor == 1:
+			break
+		factor = factor // 2
+
+	if buf is None:
+		return ( filename, "failed", size )
+	with open( dst_filename, 'wb' ) as f:
+		f.write( buf.tobytes() )
+	return ( filename, "resized", len(buf) )
 
 #----------------------------------------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
 	""" Opens, resizes, and saves, using opencv, the jpg found files in a directory. 
 	"""
-	parser = argparse.ArgumentParser("Opens and saves, using opencv, the png found files in a directory.")
-	parser.add_argument('-i', '--input', action="store", required=True, help="Directory where the png images are located.")
+	parser = argparse.ArgumentParser("Opens, resizes, and saves, using opencv, the jpg found files in a directory.")
+	parser.add_argument('-i', '--input', action="store", required=True, help="Directory where the jpg images are located.")
 	parser.add_argument('-o', '--output', action="store", required=True, help="Directory where the new version of the images will be saved.")
+	parser.add_argument('-m', '--mode', action="store", default="fixed", choices=["fixed", "fit"], help="fixed: resize all the images by a percentage; fit: resize only the images bigger than the maximum size, as little as possible.")
+	parser.add_argument('-p', '--percent', action="store", type=float, default=71.0, help="Percentage of the new size (fixed mode).")
+	parser.add_argument('-mb', '--max_bytes', action="store", type=int, default=10485760, help="Maximum size in bytes of the images (fit mode).")
+	parser.add_argument('-mq', '--min_quality', action="store", type=int, default=75, help="Minimum jpg quality tried when even the smallest scale does not fit (fit mode).")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=CORES_N, help="Number of processes.")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=16, help="Number of files sent to each process at once.")
 	args = parser.parse_args()
 
 	# Arguments Validations
 	if ( not os.path.isdir( args.input ) ):
-		print('Error: The directory of the png files was not found.\n')
+		print('Error: The directory of the jpg files was not found.\n')
 		parser.print_help()
 		sys.exit(1)
 
@@ -68,14 +174,32 @@ if __name__ == '__main__':
 			parser.print_help()
 			sys.exit(2)
 
+	if args.percent <= 0 or args.percent > 100 or args.max_bytes <= 0 or args.min_quality < 1 or args.min_quality > MAX_QUALITY:
+		print('Error: The percentage must be in (0, 100], the maximum size positive, and the minimum quality in [1, 100].\n')
+		parser.print_help()
+		sys.exit(3)
+
 	SRC_DIR = args.input
 	DST_DIR = args.output
+	PERCENT = args.percent
+	MAX_BYTES = args.max_bytes
+	MIN_QUALITY = args.min_quality
+	CHUNK_SIZE = args.chunk_size
+
+	# Create the list of files to process (in the folder and its subfolders, which are replicated in the output)
+	filename_list = job_scheduler.walk_files( SRC_DIR, '.jpg' )
+	for sub_dir in set( os.path.dirname(f) for f in filename_list ):
+		if sub_dir != "" and not os.path.exists( DST_DIR + "/" + sub_dir ):
+			os.makedirs( DST_DIR + "/" + sub_dir )
 
-	# Create the list of files to process
-	filename_list = list()
-	for root, dirs, filenames in os.walk( SRC_DIR ):
-		filename_list = list(f for f in filenames if f.endswith('.jpg'))
+	# Pool handler: the results are consumed as they arrive, so only a few chunks are in memory at a time
+	counts = {}
+	p = multiprocessing.Pool( max(1, args.jobs) )
+	for filename, status, size in p.imap_unordered( fitImg if args.mode == "fit" else resizeImg, filename_list, CHUNK_SIZE ):
+		counts[ status ] = counts.get( status, 0 ) + 1
+		if status == "failed":
+			print("Error: " + filename + " could not be resized.")
+	p.close()
+	p.join()
 
-	# Pool handler
-	p = multiprocessing.Pool( CORES_N )
-	p.map( resizeImg, filename_list )
+	print(', '.join( status + ": " + str(counts[status]) for status in sorted(counts) ))
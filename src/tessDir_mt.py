@@ -3,6 +3,20 @@
 # Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
 # Description: 
 #   Run tesseract over all the images of an specified folder.
+# The images can also be read from per-image line containers (see line_container.py), and
+# the results stored in the tesseract folder of the containers (--container): the workers
+# return them, and the main process writes many lines at once, one write per container.
+#   With --lines (the global text file or manifest of get_lines_google.py), the input folder
+# holds the specimen images instead: each specimen is decoded once in the main process, its
+# crops are copied to a shared memory segment, and the workers give the raw pixels to
+# Tesseract (SetImageBytes, one copy of each crop), without reading or decoding the line files.
+#   A line which takes more than --time_limit seconds (e.g. Tesseract looping on a noisy
+# crop) gets its process killed and replaced; it is tried again --retries times, and then
+# appended to the --quarantine_file (skip list format, see triage_lines.py).
+#   With --ocr_cache, the results are kept in a cache keyed by the pixels of the lines and the
+# traineddata (see ocr_cache.py), so the lines already recognized are not recognized again.
+#   With --prob_format binary, the confidences files are written in the binary format of
+# prob_io.py.
 #
 ##########################################################################################
 # Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
@@ -20,59 +34,214 @@
 # limitations under the License.
 ##########################################################################################
 
-import sys, os, argparse, re
+import sys, os, argparse, io, itertools, re
 import multiprocessing
+import worker_profile
+import numpy as np
+from PIL import Image
+import tesserocr
 from tesserocr import PyTessBaseAPI, RIL, iterate_level
+import image_access, job_scheduler, line_container, line_manifest, ocr_cache, preprocess_cache, prob_io, triage_lines
 
-CORES_N = multiprocessing.cpu_count() - 1
+CORES_N = worker_profile.jobs( "tessDir_mt", multiprocessing.cpu_count() - 1 )
+# Seconds a line may take before its process is killed
+TIME_LIMIT = 60
+# Results stored in the containers at once
+FLUSH_N = 256
+# Parameters of the recognition which change its results (part of the keys of the OCR cache)
+CACHE_PARAMS = "save_blob_choices=T"
 IMGS_DIR = ""
 CONF_DIR = ""
 TEXT_DIR = ""
+CONTAINER = False
+PREPROCESS_CACHE = ""
+OCR_CACHE = ""
+MODEL_ID = ""
+PROB_BINARY = False
+# Tesseract API of the worker process (see init_worker)
+API = None
 ##############################################################################################################################################################
-def tesseract( filename ):
-	# OCR - use the Tesseract API through Cython and PyTesseract
-	with PyTessBaseAPI() as api:
-		pathFilename = IMGS_DIR + "/" + filename
+def init_worker( imgs_dir, text_dir, conf_dir, container, cache_dir="", ocr_cache_dir="", stats=None, prob_binary=False ):
+	""" Creates the Tesseract API of the worker process (the traineddata is loaded once per process) and sets the folders
+	(and the caches).
+	"""
+	global API, IMGS_DIR, TEXT_DIR, CONF_DIR, CONTAINER, PREPROCESS_CACHE, OCR_CACHE, MODEL_ID, PROB_BINARY
+	IMGS_DIR, TEXT_DIR, CONF_DIR, CONTAINER, PREPROCESS_CACHE, PROB_BINARY = imgs_dir, text_dir, conf_dir, container, cache_dir, prob_binary
+	API = PyTessBaseAPI()
+	API.SetVariable("save_blob_choices", "T")
+	OCR_CACHE = ocr_cache_dir
+	if ocr_cache_dir != "":
+		# The version of Tesseract and the traineddata of its languages identify the model
+		languages = API.GetInitLanguagesAsString().split('+')
+		MODEL_ID = tesserocr.tesseract_version() + ":" + "+".join( ocr_cache.model_id( os.path.join( API.GetDatapath(), l + ".traineddata" ) ) for l in languages )
+		ocr_cache.set_stats( stats )
+
+##############################################################################################################################################################
+def recognize( api ):
+	""" Recognizes the image set in the API. Returns (text, confidences file content).
+	"""
+	# Run the recognition once: the text and the iterator of the symbols use its result
+	api.Recognize()
+	label_text = api.GetUTF8Text()
+	label_text = label_text[:-1]		
+	ri = api.GetIterator()
 
-		label_text = ""
-		ri = None
+	conf_text = ""
+	# Iterate over each of the symbols of the file 
+	level = RIL.SYMBOL
+	for r in ( iterate_level(ri, level) if ri is not None else [] ):
 		try:
-			# Set the image 
-			api.SetImageFile( pathFilename )			
-			# Run and verify the recognition process
-			label_text = api.GetUTF8Text()
-			label_text = label_text[:-1]		
-			api.SetVariable("save_blob_choices", "T")
-			api.Recognize()
-			ri = api.GetIterator()
+			symbol = r.GetUTF8Text(level)
+			conf = 0.01 * r.Confidence(level)
+
+			# We only save non-break symbols
+			if (symbol not in ['\n','\r','\t','\f']):
+				conf_text += symbol + "\t" + str(conf) + "\n"
 		except:
-			return
+			continue
+	return ( label_text, conf_text )
 
-		conf_text = ""
-		# Iterate over each of the symbols of the file 
-		level = RIL.SYMBOL
-		for r in iterate_level(ri, level):
-			try:
-				symbol = r.GetUTF8Text(level)
-				conf = 0.01 * r.Confidence(level)
+##############################################################################################################################################################
+def save_results( filename, label_text, conf_text ):
+	""" Writes the text and confidences files of a line (if any symbol was recognized). In container mode, returns their
+	[(name, bytes)] instead, stored by the main process (flush_results); [] otherwise.
+	"""
+	if len(conf_text) == 0:
+		return []
+	# The lines extracted without image files (get_lines_google.py "none" format) have no extension
+	basename = os.path.splitext( filename )[0]
+	# All the characters and their Confidence in the probabilities file (text or binary format), and the recognized text
+	files = [ (basename + ".prob", prob_io.convert( conf_text.encode('utf-8'), PROB_BINARY )), (basename + ".txt", label_text.encode('utf-8')) ]
+	if CONTAINER:
+		return files
+	for name, content in files:
+		line_container.write_files( CONF_DIR if name.endswith( ".prob" ) else TEXT_DIR, [ (name, content) ] )
+	return []
+
+##############################################################################################################################################################
+def flush_results( result_files ):
+	""" Stores the result files [(name, bytes)] of the lines in the tesseract folder of the containers of CONF_DIR (.prob)
+	and TEXT_DIR (.txt), with one write per container.
+	"""
+	if os.path.abspath( CONF_DIR ) == os.path.abspath( TEXT_DIR ):
+		line_container.write_files( CONF_DIR, result_files, "tesseract", True )
+		return
+	line_container.write_files( CONF_DIR, [ f for f in result_files if f[0].endswith( ".prob" ) ], "tesseract", True )
+	line_container.write_files( TEXT_DIR, [ f for f in result_files if f[0].endswith( ".txt" ) ], "tesseract", True )
+
+##############################################################################################################################################################
+def cached_result( pixels ):
+	""" Looks up the pixels (numpy array) of a line in the OCR cache. Returns (key, (text, confidences file content) or None).
+	"""
+	key = ocr_cache.result_key( ocr_cache.pixel_hash( pixels ), "tesseract", MODEL_ID, CACHE_PARAMS )
+	result = ocr_cache.load_result( OCR_CACHE, key )
+	return ( key, ( result['text'], result['conf'] ) if result is not None else None )
+
+##############################################################################################################################################################
+def tesseract( filename ):
+	""" Recognizes a line of IMGS_DIR. Returns its result files of save_results.
+	"""
+	# OCR - use the Tesseract API (of the worker) through Cython and PyTesseract
+	api = API
+	pathFilename = IMGS_DIR + "/" + filename
+	key = None
 
-				# We only save non-break symbols
-				if (symbol not in ['\n','\r','\t','\f']):
-					conf_text += symbol + "\t" + str(conf) + "\n"
+	try:
+		# Set the image (the grayscale variant of the shared preprocessing, a file, or the line container of its image). With
+		# the OCR cache, the image is decoded first, to look its pixels up
+		if PREPROCESS_CACHE != "":
+			gray = preprocess_cache.get_variants( line_container.read_bytes( IMGS_DIR, filename ), PREPROCESS_CACHE )['gray']
+			if OCR_CACHE != "":
+				key, cached = cached_result( gray )
+				if cached is not None:
+					return save_results( filename, *cached )
+			api.SetImageBytes( gray.tobytes(), gray.shape[1], gray.shape[0], 1, gray.shape[1] )
+		elif os.path.isfile( pathFilename ) and OCR_CACHE == "":
+			api.SetImageFile( pathFilename )
+		else:
+			image = Image.open( io.BytesIO( line_container.read_bytes( IMGS_DIR, filename ) ) )
+			if OCR_CACHE != "":
+				key, cached = cached_result( np.asarray( image ) )
+				if cached is not None:
+					return save_results( filename, *cached )
+			api.SetImage( image )
+		label_text, conf_text = recognize( api )
+	except:
+		api.Clear()
+		return []
+
+	if key is not None:
+		ocr_cache.save_result( OCR_CACHE, key, { 'text': label_text, 'conf': conf_text } )
+	api.Clear()
+	return save_results( filename, label_text, conf_text )
+
+##############################################################################################################################################################
+def tesseract_lines( filenames ):
+	""" Recognizes a chunk of lines (a task of job_scheduler.run_tasks). Returns the list of (filename, result files, "").
+	"""
+	results = []
+	for filename in filenames:
+		results = job_scheduler.next_item( 1, results )
+		results.append( ( filename, tesseract( filename ), "" ) )
+	return results
+
+##############################################################################################################################################################
+def tesseract_shared( items ):
+	""" Recognizes the lines [(segment name, filename, region)] from the shared memory segments of their crops (image_access.share_regions).
+	The raw pixels of each crop are copied once from the segment and given to Tesseract (SetImageBytes), without reading or
+	decoding any file. Returns the list of (filename, result files, "") (see save_results).
+	"""
+	api = API
+	segments = {}
+	results = []
+	try:
+		for name, filename, region in items:
+			results = job_scheduler.next_item( 1, results )
+			if name not in segments:
+				segments[ name ] = image_access.attach_segment( name )
+			offset, width, height, channels = region
+			key = None
+			pixels = image_access.region_view( segments[ name ], region )
+			try:
+				if OCR_CACHE != "":
+					key, cached = cached_result( pixels )
+					if cached is not None:
+						results.append( ( filename, save_results( filename, *cached ), "" ) )
+						continue
+				api.SetImageBytes( pixels.tobytes(), width, height, channels, width * channels )
+				label_text, conf_text = recognize( api )
 			except:
+				api.Clear()
 				continue
+			finally:
+				# The segment cannot be closed while a view of it exists
+				del pixels
+			if key is not None:
+				ocr_cache.save_result( OCR_CACHE, key, { 'text': label_text, 'conf': conf_text } )
+			api.Clear()
+			results.append( ( filename, save_results( filename, label_text, conf_text ), "" ) )
+	finally:
+		for segment in segments.values():
+			segment.close()
+	return results
 
-		if len(conf_text) > 0:
-			basename = filename[:-4]
-			# Write all the characters and their Confidence in the probabilities file
-			conf_pathFilename = CONF_DIR + "/" + basename + ".prob"
-			with open(conf_pathFilename, "w") as f:
-				f.write( conf_text.encode('utf-8') )
-
-			# Write the recognized text line in the text file
-			text_pathFilename = TEXT_DIR + "/" + basename + ".txt"
-			with open(text_pathFilename, "w") as f:
-				f.write( label_text.encode('utf-8') )
+##############################################################################################################################################################
+def shared_tasks( records, segments, failed ):
+	""" Decodes the specimens of the records (as they are needed by the workers) and copies the crops of their lines to shared memory.
+	Yields a task (the list of (segment name, filename, region) of its lines) per specimen. segments gets {name: [segment, lines not
+	finished]}, and failed the specimens which could not be decoded.
+	"""
+	for specimen, specimen_records in itertools.groupby( records, key=lambda r: r[0] ):
+		specimen_records = list( specimen_records )
+		try:
+			segment, regions = image_access.share_regions( IMGS_DIR + "/" + specimen_records[0][2], [ list( r[4:8] ) for r in specimen_records ] )
+		except Exception as e:
+			print("Error: " + specimen_records[0][2] + ": " + str(e))
+			failed.append( specimen )
+			continue
+		segment.close()
+		segments[ segment.name ] = [ segment, len(specimen_records) ]
+		yield [ ( segment.name, r[3], region ) for r, region in zip( specimen_records, regions ) ]
 
 ##############################################################################################################################################################
 if __name__ == '__main__':
@@ -82,6 +251,18 @@ if __name__ == '__main__':
 	parser.add_argument('-id', '--imgs_dir', action="store", required=True, help="Input folder, where jpg images are stored.")
 	parser.add_argument('-td', '--text_dir', action="store", required=True, help="Folder where text files will be stored.")
 	parser.add_argument('-cd', '--conf_dir', action="store", required=True, help="Folder where confidence files will be stored.")
+	parser.add_argument('-ct', '--container', action="store_true", help="Store the text and confidence files in the tesseract folder of the line containers of text_dir and conf_dir.")
+	parser.add_argument('-j', '--jobs', action="store", type=int, default=CORES_N, help="Number of Tesseract processes.")
+	parser.add_argument('-sk', '--skip_list', action="store", default="", help="Skip list of the lines which are not recognized (see triage_lines.py).")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=16, help="Number of lines sent to each process at once.")
+	parser.add_argument('-so', '--schedule_order', action="store", default="cost", choices=["cost", "walk"], help="cost: send the lines in decreasing order of width x height (read from their headers), in chunks of decreasing size (up to chunk_size lines); walk: in the order of the folders, in chunks of chunk_size lines.")
+	parser.add_argument('-ln', '--lines', action="store", default="", help="Global text file or manifest (see line_manifest.py) of the lines. With it, imgs_dir holds the specimen images: each one is decoded once and its lines are given to Tesseract through shared memory.")
+	parser.add_argument('-pc', '--preprocess_cache', action="store", default="", help="Cache folder of the preprocessed lines (see preprocess_cache.py), shared with ocropusDir_mt.py. Not used with --lines.")
+	parser.add_argument('-oc', '--ocr_cache', action="store", default="", help="Cache folder of the OCR results (see ocr_cache.py).")
+	parser.add_argument('-pf', '--prob_format', action="store", default="text", choices=prob_io.FORMATS, help="Format of the probabilities (confidences) files (see prob_io.py).")
+	parser.add_argument('-tl', '--time_limit', action="store", type=float, default=TIME_LIMIT, help="Seconds a line may take before its process is killed and replaced (0: no limit).")
+	parser.add_argument('-rt', '--retries', action="store", type=int, default=1, help="Times a line over the time limit is tried again before it is quarantined.")
+	parser.add_argument('-qf', '--quarantine_file', action="store", default="", help="Path + Filename where the lines over the time limit are appended (with the format of the skip list).")
 	args = parser.parse_args()
 
 	# Arguments Validations
@@ -109,12 +290,92 @@ if __name__ == '__main__':
 	IMGS_DIR = args.imgs_dir
 	TEXT_DIR = args.text_dir
 	CONF_DIR = args.conf_dir
+	CONTAINER = args.container
+
+	if args.lines != "":
+		if not os.path.isfile( args.lines ):
+			print('Error: The file of the lines (' + args.lines + ') was not found.\n')
+			parser.print_help()
+			sys.exit(4)
+
+		# Lines of each specimen (the subfolders of the line filenames are kept)
+		skip = triage_lines.load_skip_list( args.skip_list )
+		records = [ r for r in line_manifest.read_records( args.lines ) if os.path.basename( r[3] ).split('.')[0] not in skip ]
+		for sub_dir in set( os.path.dirname( r[3] ) for r in records ):
+			for dir_name in [ TEXT_DIR, CONF_DIR ]:
+				if sub_dir != "" and not os.path.exists( dir_name + "/" + sub_dir ):
+					os.makedirs( dir_name + "/" + sub_dir )
+
+		# The main process decodes a specimen when a worker is free (so about one segment per worker is in memory), and
+		# unlinks its segment when all its lines are finished
+		segments = {}
+		failed = []
+		quarantine = []
+		result_files = []
+		stats = ocr_cache.new_stats()
+		try:
+			for items, results, error in job_scheduler.run_tasks( tesseract_shared, shared_tasks( records, segments, failed ), args.jobs, args.time_limit, args.retries, init_worker, (IMGS_DIR, TEXT_DIR, CONF_DIR, CONTAINER, "", args.ocr_cache, stats, args.prob_format == "binary") ):
+				for name, filename, region in items:
+					if error in [ job_scheduler.TIMEOUT, job_scheduler.CRASHED ]:
+						quarantine.append( ( filename, error ) )
+					segments[ name ][1] -= 1
+					if segments[ name ][1] == 0:
+						segments.pop( name )[0].unlink()
+				for filename, files_list, message in ( results if results is not None else [] ):
+					result_files.extend( files_list )
+				if len(result_files) >= FLUSH_N:
+					flush_results( result_files )
+					result_files = []
+		finally:
+			for segment, remaining in segments.values():
+				segment.unlink()
+		if len(result_files) > 0:
+			flush_results( result_files )
+
+		triage_lines.save_quarantine( args.quarantine_file, quarantine )
+		if args.ocr_cache != "":
+			print( ocr_cache.report( stats ) )
+		if len(failed) > 0:
+			print("Specimens which could not be decoded: " + str(len(failed)))
+		if len(quarantine) > 0:
+			print("Lines quarantined: " + str(len(quarantine)))
+		sys.exit(0)
 
 	# Create the list of files to process
-	filename_list = list()
-	for root, dirs, filenames in os.walk( IMGS_DIR ):
-		filename_list = list(f for f in filenames if f.endswith('.jpg'))
+	# Lines of the folder and its subfolders, and of its line containers (the output keeps the same subfolders)
+	skip = triage_lines.load_skip_list( args.skip_list )
+	filename_list = job_scheduler.walk_files( IMGS_DIR, '.jpg' )
+	filename_list += [ f for f in line_container.list_files( IMGS_DIR, '.jpg' ) if not os.path.isfile( IMGS_DIR + "/" + f ) ]
+	filename_list = [ f for f in filename_list if os.path.basename(f)[:-4] not in skip ]
+	for sub_dir in set( os.path.dirname(f) for f in filename_list ):
+		for dir_name in [ TEXT_DIR, CONF_DIR ]:
+			if sub_dir != "" and not os.path.exists( dir_name + "/" + sub_dir ):
+				os.makedirs( dir_name + "/" + sub_dir )
+
+	# Each process creates its Tesseract API once and receives the lines in chunks. The processes over the time limit are
+	# replaced, and their lines tried again one by one
+	quarantine = []
+	stats = ocr_cache.new_stats()
+	if args.schedule_order == "cost":
+		# Longest job first: the widest lines are sent first, and the chunks get smaller towards the end
+		chunks = job_scheduler.cost_chunks( filename_list, [ image_access.line_cost( IMGS_DIR, f ) for f in filename_list ], args.jobs, args.chunk_size )
+	else:
+		chunks = [ filename_list[i:i + max(1, args.chunk_size)] for i in range( 0, len(filename_list), max(1, args.chunk_size) ) ]
+	result_files = []
+	for chunk, results, error in job_scheduler.run_tasks( tesseract_lines, chunks, args.jobs, args.time_limit, args.retries, init_worker, (IMGS_DIR, TEXT_DIR, CONF_DIR, CONTAINER, args.preprocess_cache, args.ocr_cache, stats, args.prob_format == "binary") ):
+		if error in [ job_scheduler.TIMEOUT, job_scheduler.CRASHED ]:
+			quarantine.extend( ( filename, error ) for filename in chunk )
+		# In container mode, the results are stored by this process, many lines at once
+		for filename, files_list, message in ( results if results is not None else [] ):
+			result_files.extend( files_list )
+		if len(result_files) >= FLUSH_N:
+			flush_results( result_files )
+			result_files = []
+	if len(result_files) > 0:
+		flush_results( result_files )
 
-	# Pool handler
-	p = multiprocessing.Pool( CORES_N )
-	p.map( tesseract, filename_list )
+	triage_lines.save_quarantine( args.quarantine_file, quarantine )
+	if args.ocr_cache != "":
+		print( ocr_cache.report( stats ) )
+	if len(quarantine) > 0:
+		print("Lines quarantined: " + str(len(quarantine)))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Triage of the cropped lines before running the OCR engines. Each crop is scored with a
+# few vectorized features (size, pixel variance, ink ratio, stroke density, and fraction of
+# full-height bars) and the crops that cannot contain text (slivers, empty boxes, barcodes,
+# rulers, ...) are written to a skip list. binarizeDir_mt.py, recognizeDir_mt.py, and
+# tessDir_mt.py do not process the lines of the skip list, and getLinesRejected.py rejects
+# them, so they are still transcribed by the volunteers.
+#   Skip list format (tab separated): line filename, reason, height, width, std, ink ratio,
+# stroke density, bars ratio.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, io, os, sys
+import multiprocessing
+from PIL import Image
+import numpy as np
+import line_container
+
+CORES_N = multiprocessing.cpu_count()
+INPUT_DIR = ""
+
+# Thresholds of the triage
+MIN_HEIGHT = 8          # pixels
+MIN_WIDTH = 8           # pixels
+MIN_STD = 6.0           # standard deviation of the gray levels
+MIN_INK = 0.01          # fraction of ink pixels
+MAX_INK = 0.7
+MIN_DENSITY = 0.01      # ink/background transitions per pixel
+MAX_BARS = 0.5          # fraction of the ink columns covered by ink in (almost) all their height
+BAR_FILL = 0.85
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def otsu_threshold( gray ):
+	""" Otsu's threshold of an 8 bits grayscale image (computed from its histogram).
+	"""
+	hist = np.bincount( gray.ravel(), minlength=256 ).astype( np.float64 )
+	levels = np.arange( 256 )
+	w0 = np.cumsum( hist )
+	w1 = w0[-1] - w0
+	m0 = np.cumsum( hist * levels )
+	mean0 = m0 / np.maximum( w0, 1 )
+	mean1 = ( m0[-1] - m0 ) / np.maximum( w1, 1 )
+	return int( np.argmax( w0 * w1 * (mean0 - mean1) ** 2 ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def line_features( gray ):
+	""" Features of a cropped line (2D uint8 array): height, width, std, ink ratio, stroke density, and bars ratio.
+	"""
+	height, width = gray.shape
+	if height == 0 or width == 0:
+		return ( height, width, 0.0, 0.0, 0.0, 0.0 )
+
+	std = float( gray.std() )
+	ink = gray <= otsu_threshold( gray )
+	ink_ratio = float( ink.mean() )
+	# Horizontal transitions between ink and background: the strokes crossed by each row
+	density = float( np.count_nonzero( ink[:,1:] != ink[:,:-1] ) ) / (height * width)
+	# Barcodes and rulers: many columns inked in (almost) all their height
+	fill = ink.mean( axis=0 )
+	ink_columns = np.count_nonzero( fill > 0 )
+	bars = float( np.count_nonzero( fill >= BAR_FILL ) ) / ink_columns if ink_columns > 0 else 0.0
+	return ( height, width, std, ink_ratio, density, bars )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def triage( features ):
+	""" Returns the reason to skip a line with the features, or "" if it may contain text.
+	"""
+	height, width, std, ink_ratio, density, bars = features
+	if height < MIN_HEIGHT or width < MIN_WIDTH:
+		return "small"
+	if std < MIN_STD or ink_ratio < MIN_INK:
+		return "blank"
+	if ink_ratio > MAX_INK:
+		return "dark"
+	if bars > MAX_BARS and width > 2 * height:
+		return "barcode"
+	if density < MIN_DENSITY:
+		return "no_strokes"
+	return ""
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def score_line( filename ):
+	""" Decodes (in grayscale) a cropped line of INPUT_DIR and returns (filename, reason, features).
+	"""
+	image = Image.open( io.BytesIO( line_container.read_bytes( INPUT_DIR, filename ) ) )
+	if image.format == "JPEG":
+		image.draft( 'L', image.size )
+	features = line_features( np.asarray( image.convert('L') ) )
+	return ( filename, triage( features ), features )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def load_skip_list( path_filename ):
+	""" Returns the dictionary {line name (without extension): reason} of a skip list ("" returns an empty dictionary).
+	"""
+	skip = {}
+	if path_filename == "":
+		return skip
+	with open( path_filename ) as f:
+		for line in f:
+			fields = line.rstrip('\n').split('\t')
+			if len(fields) > 1 and fields[1] != "":
+				skip[ fields[0].split('.')[0] ] = fields[1]
+	return skip
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_quarantine( path_filename, lines ):
+	""" Appends the lines [(line filename, reason)] which could not be processed (e.g. over the time limit of the OCR
+	engines) to a quarantine list with the format of the skip list, so it can be used as one. Nothing is done for "".
+	"""
+	if path_filename == "" or len(lines) == 0:
+		return
+	with open( path_filename, "a+" ) as f:
+		for filename, reason in lines:
+			f.write( filename + "\t" + reason.replace( "\t", " " ).replace( "\n", " " ) + "\n" )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" Writes the skip list of the cropped lines of a directory which cannot contain text.
+	"""
+	parser = argparse.ArgumentParser("Writes the skip list of the cropped lines of a directory which cannot contain text.")
+	parser.add_argument('-id', '--input_dir', action="store", required=True, help="Directory with the cropped lines (jpg or png files, or line containers).")
+	parser.add_argument('-o', '--output', action="store", required=True, help="Path + Filename of the skip list.")
+	parser.add_argument('-a', '--all', action="store_true", help="Write the features of all the lines (an empty reason means the line is processed).")
+	parser.add_argument('-cs', '--chunk_size', action="store", type=int, default=64, help="Number of lines sent to each process at once.")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if ( not os.path.isdir( args.input_dir ) ):
+		print('Error: The directory of the cropped lines was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+
+	INPUT_DIR = args.input_dir
+
+	# Create the list of files to process
+	filename_list = line_container.list_files( INPUT_DIR, '.jpg' ) + line_container.list_files( INPUT_DIR, '.png' )
+	filename_list.sort()
+
+	counts = {}
+	p = multiprocessing.Pool( CORES_N )
+	with open( args.output, "w+" ) as f:
+		for filename, reason, features in p.imap( score_line, filename_list, args.chunk_size ):
+			counts[ reason ] = counts.get( reason, 0 ) + 1
+			if reason != "" or args.all:
+				f.write( filename + "\t" + reason + "\t" + "\t".join( str(round(v, 4)) for v in features ) + "\n" )
+	p.close()
+	p.join()
+
+	n_skipped = len(filename_list) - counts.pop( "", 0 )
+	print("Lines: " + str(len(filename_list)) + ", skipped: " + str(n_skipped) + " (" + ', '.join( reason + ": " + str(counts[reason]) for reason in sorted(counts) ) + ")")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Calibration of the concurrency of the OCR stages in this host. Each stage runs over a
+# sample of cropped lines with every combination of a grid of process counts (-j) and of
+# internal thread limits of each process (OMP_NUM_THREADS, OPENBLAS_NUM_THREADS, ... see
+# worker_profile.py), and the configuration with the most lines/sec whose workers fit in
+# the memory is saved in the profile of the host. The stages load it automatically.
+#   The peak memory of a worker is measured as the largest resident set of the processes of
+# each run (os.wait4). A configuration is discarded if a worker needs more than -mw MB, or if
+# its workers need more than the available memory.
+#   Stages: binarizeDir_mt, tessDir_mt, and, with a model (-mf, -mn), recognizeDir_mt and
+# ocropusDir_mt; resizeDir_mt with a sample of -n specimen images of a folder (-sd).
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import argparse, os, shutil, subprocess, sys, tempfile, time
+import multiprocessing
+import job_scheduler, worker_profile
+
+SRC_DIR = os.path.dirname( os.path.abspath(__file__) )
+STAGES = [ "binarizeDir_mt", "recognizeDir_mt", "ocropusDir_mt", "tessDir_mt", "resizeDir_mt" ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def stage_arguments( stage, sample_dir, bin_dir, specimens_dir, output_dir, args ):
+	""" Arguments of the script of the stage (without -j) to process the sample (of lines, or of specimens for
+	resizeDir_mt), writing its results in output_dir.
+	"""
+	model = [ "-mf", args.model_folder, "-mn", args.model_name, "-p", "True", "-td", output_dir, "-pd", output_dir ]
+	if stage == "binarizeDir_mt":
+		return [ "-if", sample_dir, "-of", output_dir ]
+	if stage == "recognizeDir_mt":
+		return [ "-if", bin_dir ] + model
+	if stage == "ocropusDir_mt":
+		return [ "-if", sample_dir ] + model
+	if stage == "tessDir_mt":
+		return [ "-id", sample_dir, "-td", output_dir, "-cd", output_dir ]
+	return [ "-i", specimens_dir, "-o", output_dir ]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def run_stage( stage, arguments, jobs, threads ):
+	""" Runs the script of the stage with jobs processes of threads threads. Returns (seconds, peak memory of a process in MB),
+	or None if it failed.
+	"""
+	env = dict( os.environ )
+	for variable in worker_profile.THREAD_VARIABLES:
+		env[ variable ] = str( threads )
+	start = time.time()
+	p = subprocess.Popen( [ sys.executable, SRC_DIR + "/" + stage + ".py" ] + arguments + [ "-j", str(jobs) ], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+	pid, status, usage = os.wait4( p.pid, 0 )
+	p.returncode = os.waitstatus_to_exitcode( status )
+	if p.returncode != 0:
+		return None
+	# ru_maxrss is in KB in Linux
+	return ( time.time() - start, usage.ru_maxrss / 1024.0 )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def parse_grid( text ):
+	""" List of the positive integers of a comma separated text.
+	"""
+	return sorted( set( int(v) for v in text.split(',') if v.strip() != "" and int(v) > 0 ) )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	""" MAIN """
+	cpus = multiprocessing.cpu_count()
+	parser = argparse.ArgumentParser("Runs the OCR stages over a sample of lines with a grid of process counts and thread limits, and saves the best configuration of each stage in the profile of the host.")
+	parser.add_argument('-if', '--input_folder', action="store", required=True, help="Directory with the jpg files of the lines (the sample is taken from them).")
+	parser.add_argument('-n', '--n_lines', action="store", type=int, default=200, help="Number of lines of the sample (and of specimens, for resizeDir_mt).")
+	parser.add_argument('-st', '--stages', action="store", default=",".join( STAGES ), help="Stages to calibrate (comma separated).")
+	parser.add_argument('-pj', '--processes', action="store", default=",".join( str(2 ** i) for i in range( cpus.bit_length() ) if 2 ** i < cpus ) + "," + str(cpus), help="Grid of process counts (comma separated).")
+	parser.add_argument('-tt', '--threads', action="store", default="1,2,4", help="Grid of thread limits of each process (comma separated).")
+	parser.add_argument('-os', '--oversubscribe', action="store_true", help="Also try the configurations with more threads (processes x threads) than CPUs.")
+	parser.add_argument('-mw', '--max_worker_mb', action="store", type=float, default=0, help="Maximum memory (MB) of a worker process (0: no limit).")
+	parser.add_argument('-mf', '--model_folder', action="store", default="", help="Directory of the OCRopus model (for recognizeDir_mt and ocropusDir_mt).")
+	parser.add_argument('-mn', '--model_name', action="store", default="", help="Filename of the OCRopus model.")
+	parser.add_argument('-sd', '--specimens_dir', action="store", default="", help="Directory with specimen images (for resizeDir_mt).")
+	parser.add_argument('-of', '--output_file', action="store", default="", help="Path + Filename of the profile (default: " + worker_profile.profile_path_filename() + ").")
+	parser.add_argument('-dr', '--dry_run', action="store_true", help="Only print the results; the profile is not saved.")
+	args = parser.parse_args()
+
+	# Arguments Validations
+	if ( not os.path.isdir( args.input_folder ) ):
+		print('Error: The directory of the jpg files was not found.\n')
+		parser.print_help()
+		sys.exit(1)
+	stages = [ s.strip() for s in args.stages.split(',') if s.strip() != "" ]
+	for stage in stages:
+		if stage not in STAGES:
+			print('Error: Unknown stage: ' + stage + '.\n')
+			parser.print_help()
+			sys.exit(2)
+	with_model = os.path.isfile( args.model_folder + "/" + args.model_name )
+	stages = [ s for s in stages if ( s not in [ "recognizeDir_mt", "ocropusDir_mt" ] or with_model ) and ( s != "resizeDir_mt" or os.path.isdir( args.specimens_dir ) ) ]
+
+	# Sample of lines (and its binarized lines, the input of recognizeDir_mt), and of specimens (resizeDir_mt)
+	tmp_dir = tempfile.mkdtemp()
+	sample_dir = tmp_dir + "/sample"
+	bin_dir = tmp_dir + "/bin"
+	specimens_dir = tmp_dir + "/specimens"
+	os.makedirs( sample_dir )
+	files = sorted( job_scheduler.walk_files( args.input_folder, '.jpg' ) )[ :max(1, args.n_lines) ]
+	for i, filename in enumerate( files ):
+		shutil.copyfile( args.input_folder + "/" + filename, sample_dir + "/" + ( "%06d" % i ) + "_" + os.path.basename( filename ) )
+	if "recognizeDir_mt" in stages and run_stage( "binarizeDir_mt", stage_arguments( "binarizeDir_mt", sample_dir, "", "", bin_dir, args ), cpus, 1 ) is None:
+		print("Error: The sample could not be binarized; recognizeDir_mt is not calibrated.")
+		stages.remove( "recognizeDir_mt" )
+	n_items = { s: len(files) for s in stages }
+	if "resizeDir_mt" in stages:
+		os.makedirs( specimens_dir )
+		specimens = sorted( job_scheduler.walk_files( args.specimens_dir, '.jpg' ) )[ :max(1, args.n_lines) ]
+		for i, filename in enumerate( specimens ):
+			shutil.copyfile( args.specimens_dir + "/" + filename, specimens_dir + "/" + ( "%06d" % i ) + "_" + os.path.basename( filename ) )
+		n_items["resizeDir_mt"] = len( specimens )
+	available = worker_profile.available_memory_mb()
+	print("Host CPUs: " + str(cpus) + ", available memory: " + str(available) + " MB, sample: " + str(len(files)) + " lines")
+
+	best = {}
+	for stage in stages:
+		print("%-16s %6s %8s %10s %10s %12s" % (stage, "jobs", "threads", "seconds", "items/s", "worker MB"))
+		for jobs in parse_grid( args.processes ):
+			for threads in parse_grid( args.threads ):
+				if jobs * threads > cpus and not args.oversubscribe:
+					continue
+				output_dir = tmp_dir + "/output"
+				shutil.rmtree( output_dir, ignore_errors=True )
+				os.makedirs( output_dir )
+				result = run_stage( stage, stage_arguments( stage, sample_dir, bin_dir, specimens_dir, output_dir, args ), jobs, threads )
+				if result is None:
+					print("%-16s %6d %8d %10s" % ("", jobs, threads, "failed"))
+					continue
+				seconds, mem_mb = result
+				rate = n_items[stage] / seconds
+				fits = ( args.max_worker_mb <= 0 or mem_mb <= args.max_worker_mb ) and ( available <= 0 or jobs * mem_mb <= worker_profile.MEMORY_FRACTION * available )
+				print("%-16s %6d %8d %10.2f %10.1f %12.1f%s" % ("", jobs, threads, seconds, rate, mem_mb, "" if fits else "  (over the memory limit)"))
+				if fits and ( stage not in best or rate > best[stage]["lines_per_s"] ):
+					best[ stage ] = { "jobs": jobs, "threads": threads, "mem_mb": round( mem_mb, 1 ), "lines_per_s": round( rate, 2 ) }
+		if stage in best:
+			print("Best: " + str(best[stage]["jobs"]) + " processes x " + str(best[stage]["threads"]) + " threads")
+	shutil.rmtree( tmp_dir )
+
+	if not args.dry_run and len(best) > 0:
+		worker_profile.save_profile( best, args.output_file )
+		print("Profile saved: " + ( args.output_file if args.output_file != "" else worker_profile.profile_path_filename() ))
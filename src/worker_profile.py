@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+##########################################################################################
+# Developer: Icaro Alzuru         Project: HuMaIN (http://humain.acis.ufl.edu)
+# Description:
+#   Per-host profile of the concurrency of the OCR stages, written by tune_workers.py: for
+# each stage (the name of its script, e.g. tessDir_mt), the number of worker processes, the
+# threads of each process (Tesseract OpenMP and NumPy BLAS), and the peak memory of a worker.
+#   The stages import this module before NumPy, so the thread limit of the running script is
+# set (OMP_NUM_THREADS, OMP_THREAD_LIMIT, OPENBLAS_NUM_THREADS, MKL_NUM_THREADS) before the
+# libraries start their thread pools, unless those variables are already set. The stages take
+# their default number of processes from jobs(), which keeps the workers within the available
+# memory.
+#   The profile is stored in ~/.humain/workers_<host>.json, or in the file of the
+# HUMAIN_WORKER_PROFILE environment variable.
+#
+##########################################################################################
+# Copyright 2019    Advanced Computing and Information Systems (ACIS) Lab - UF
+#                   (https://www.acis.ufl.edu/)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################################
+
+import json, os, socket, sys
+
+# Stage of the running script
+STAGE = os.path.splitext( os.path.basename( sys.argv[0] ) )[0] if len(sys.argv) > 0 else ""
+# Variables which limit the internal threads of the engines
+THREAD_VARIABLES = [ "OMP_NUM_THREADS", "OMP_THREAD_LIMIT", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS" ]
+# Fraction of the available memory which the workers of a stage may use
+MEMORY_FRACTION = 0.8
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def profile_path_filename():
+	""" Path + Filename of the profile of this host.
+	"""
+	if os.environ.get( "HUMAIN_WORKER_PROFILE", "" ) != "":
+		return os.environ["HUMAIN_WORKER_PROFILE"]
+	return os.path.join( os.path.expanduser("~"), ".humain", "workers_" + socket.gethostname() + ".json" )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def load_profile( path_filename="" ):
+	""" Returns the profile {stage: {'jobs', 'threads', 'mem_mb', 'lines_per_s'}}, or {} if there is none.
+	"""
+	try:
+		with open( path_filename if path_filename != "" else profile_path_filename(), 'r' ) as f:
+			return json.load( f ).get( "stages", {} )
+	except (OSError, ValueError):
+		return {}
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def save_profile( stages, path_filename="" ):
+	""" Stores the configuration of the stages in the profile (the other stages of the profile are kept).
+	"""
+	path_filename = path_filename if path_filename != "" else profile_path_filename()
+	profile = load_profile( path_filename )
+	profile.update( stages )
+	if os.path.dirname( path_filename ) != "" and not os.path.exists( os.path.dirname( path_filename ) ):
+		os.makedirs( os.path.dirname( path_filename ), exist_ok=True )
+
+	tmp_path_filename = path_filename + "." + str(os.getpid()) + ".tmp"
+	with open( tmp_path_filename, 'w' ) as f:
+		json.dump( { "host": socket.gethostname(), "cpus": os.cpu_count(), "stages": profile }, f, indent=1, sort_keys=True )
+	os.replace( tmp_path_filename, path_filename )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def available_memory_mb():
+	""" Memory available in the host (MB), or 0 if it is unknown.
+	"""
+	try:
+		return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1 << 20)
+	except (ValueError, OSError, AttributeError):
+		return 0
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def set_threads( threads ):
+	""" Limits the internal threads of the engines of this process and of its children (before NumPy or tesserocr are loaded).
+	"""
+	for variable in THREAD_VARIABLES:
+		os.environ[ variable ] = str( threads )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def jobs( stage, default ):
+	""" Number of worker processes of the stage: the one of the profile (or default), reduced so the workers fit in the
+	available memory when the profile knows their peak memory.
+	"""
+	config = load_profile().get( stage, {} )
+	n = config.get( "jobs", default )
+	mem_mb = config.get( "mem_mb", 0 )
+	available = available_memory_mb()
+	if mem_mb > 0 and available > 0:
+		n = min( n, int( MEMORY_FRACTION * available // mem_mb ) )
+	return max( 1, n )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------------------------
+def configure( stage=STAGE ):
+	""" Sets the thread limit of the profile of the stage, unless the thread variables are already set.
+	"""
+	if any( variable in os.environ for variable in THREAD_VARIABLES ):
+		return
+	config = load_profile().get( stage, {} )
+	if config.get( "threads", 0 ) > 0:
+		set_threads( config["threads"] )
+
+configure()